@@ -0,0 +1,298 @@
+"""Waiting rooms for hot on-sales and token-bucket rate limits.
+
+An event with a waiting room (``Events.waitingRoomRate`` set) only lets
+buyers reserve and purchase with an admission token. Buyers join the
+event's queue, poll for their position, and are admitted from the front at
+``waitingRoomRate`` buyers per second. An admitted buyer gets a signed,
+short-lived token for that event and user, so any worker can check it
+without shared state.
+
+Queues and rate-limit buckets live in an ``AdmissionBackend``. The
+in-process ``MemoryBackend`` is the default, and it is only right for a
+single worker process: with several, each has its own queues, so a buyer
+is only known to the worker they joined on. A backend shared between
+workers (Redis, say) can be plugged in with the ``ADMISSION_BACKEND``
+setting as ``"module:Class"``.
+"""
+import abc
+import importlib
+import math
+import threading
+import time
+
+from itsdangerous import BadSignature, URLSafeTimedSerializer
+
+ADMISSION_HEADER = "X-Admission-Token"
+
+# How long an admission token is good for; long enough to pick seats and check out
+DEFAULT_TOKEN_TTL = 600
+
+# Seconds an event's waiting room setting is cached before it is read again
+SETTINGS_TTL = 5.0
+
+
+class AdmissionBackend(abc.ABC):
+    """Where waiting room queues and rate-limit buckets are kept.
+
+    Every method is called with the current time, so a backend never needs
+    a clock of its own, and must be safe to call from many threads.
+    """
+
+    @abc.abstractmethod
+    def join(self, event_id, user_id, rate, now):
+        """Add the user to the event's queue if they aren't in it.
+
+        Returns ``(position, admitted)``: how many buyers are ahead of them,
+        and whether they have been let in. Admission moves at ``rate`` buyers
+        per second.
+        """
+
+    @abc.abstractmethod
+    def status(self, event_id, user_id, rate, now):
+        """Like ``join()``, but returns None for a user who isn't queued."""
+
+    @abc.abstractmethod
+    def leave(self, event_id, user_id):
+        pass
+
+    @abc.abstractmethod
+    def take(self, key, rate, burst, now):
+        """Take one token from the bucket for ``key``.
+
+        Returns 0 if there was one, or else the seconds until there will be.
+        """
+
+    @abc.abstractmethod
+    def stats(self):
+        pass
+
+
+class _Queue:
+    __slots__ = ("tickets", "next_ticket", "admitted_up_to", "updated_at", "admitted_total")
+
+    def __init__(self, now):
+        self.tickets = {}  # user_id -> ticket number, in join order
+        self.next_ticket = 0
+        self.admitted_up_to = 0.0  # tickets below this have been admitted
+        self.updated_at = now
+        self.admitted_total = 0
+
+
+class MemoryBackend(AdmissionBackend):
+    """In-process backend. Each worker keeps its own queues and buckets.
+
+    Only for a single worker process. With more, a buyer who joined a queue
+    on one worker isn't in it on the others, every worker admits
+    ``waitingRoomRate`` buyers a second, and rate limits apply per worker.
+    """
+
+    def __init__(self, max_buckets=100000):
+        self.max_buckets = max_buckets
+        self._lock = threading.Lock()
+        self._queues = {}
+        self._buckets = {}  # key -> [tokens, updated_at, rate, burst]
+
+    def _advance(self, queue, rate, now):
+        # Admission only moves while someone is waiting, so an idle queue can't bank a burst
+        before = int(queue.admitted_up_to)
+        queue.admitted_up_to = min(queue.next_ticket, queue.admitted_up_to + (now - queue.updated_at) * rate)
+        queue.updated_at = now
+        queue.admitted_total += int(queue.admitted_up_to) - before
+
+    def _position(self, queue, ticket):
+        admitted = ticket < int(queue.admitted_up_to)
+        return (0 if admitted else ticket - int(queue.admitted_up_to)), admitted
+
+    def join(self, event_id, user_id, rate, now):
+        with self._lock:
+            queue = self._queues.get(event_id)
+            if queue is None:
+                queue = self._queues[event_id] = _Queue(now)
+            self._advance(queue, rate, now)
+            ticket = queue.tickets.get(user_id)
+            if ticket is None:
+                ticket = queue.tickets[user_id] = queue.next_ticket
+                queue.next_ticket += 1
+            return self._position(queue, ticket)
+
+    def status(self, event_id, user_id, rate, now):
+        with self._lock:
+            queue = self._queues.get(event_id)
+            if queue is None or user_id not in queue.tickets:
+                return None
+            self._advance(queue, rate, now)
+            return self._position(queue, queue.tickets[user_id])
+
+    def leave(self, event_id, user_id):
+        with self._lock:
+            queue = self._queues.get(event_id)
+            if queue is not None:
+                queue.tickets.pop(user_id, None)
+
+    def take(self, key, rate, burst, now):
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                if len(self._buckets) >= self.max_buckets:
+                    # Full buckets carry no information, so they are the ones to forget. Each
+                    # bucket refills at its own limit's rate, which may not be the caller's.
+                    self._buckets = {k: b for k, b in self._buckets.items()
+                                     if b[0] + (now - b[1]) * b[2] < b[3]}
+                bucket = self._buckets[key] = [burst, now, rate, burst]
+            tokens = min(burst, bucket[0] + (now - bucket[1]) * rate)
+            bucket[1:] = now, rate, burst
+            if tokens >= 1:
+                bucket[0] = tokens - 1
+                return 0
+            bucket[0] = tokens
+            return (1 - tokens) / rate
+
+    def stats(self):
+        with self._lock:
+            return {
+                "buckets": len(self._buckets),
+                "queues": {
+                    str(event_id): {
+                        "joined": queue.next_ticket,
+                        "waiting": queue.next_ticket - int(queue.admitted_up_to),
+                        "admitted": queue.admitted_total,
+                    }
+                    for event_id, queue in self._queues.items()
+                },
+            }
+
+
+def load_backend(spec):
+    """Return the backend for the ``ADMISSION_BACKEND`` setting: None, an instance or ``"module:Class"``."""
+    if spec is None:
+        return MemoryBackend()
+    if isinstance(spec, str):
+        module_name, _, class_name = spec.partition(":")
+        return getattr(importlib.import_module(module_name), class_name)()
+    return spec
+
+
+class WaitingRoom:
+    """Queues buyers for events that have a waiting room and issues their admission tokens.
+
+    ``load_rate`` returns an event's ``waitingRoomRate``, or None when it has
+    no waiting room; results are cached for ``SETTINGS_TTL`` seconds.
+    """
+
+    def __init__(self, backend, secret, load_rate, token_ttl=DEFAULT_TOKEN_TTL):
+        self.backend = backend
+        self.token_ttl = token_ttl
+        self.load_rate = load_rate
+        self._serializer = URLSafeTimedSerializer(secret or "", salt="tessera-admission")
+        self._lock = threading.Lock()
+        self._rates = {}  # event_id -> (rate or None, loaded at)
+        self._issued = 0
+        self._rejected = 0
+
+    def rate(self, event_id):
+        now = time.monotonic()
+        with self._lock:
+            cached = self._rates.get(event_id)
+        if cached is not None and now - cached[1] < SETTINGS_TTL:
+            return cached[0]
+        rate = self.load_rate(event_id)
+        with self._lock:
+            self._rates[event_id] = (rate, now)
+        return rate
+
+    def forget(self, event_id):
+        """Drop the cached setting after it changed."""
+        with self._lock:
+            self._rates.pop(event_id, None)
+
+    def enabled(self, event_id):
+        return bool(self.rate(event_id))
+
+    def _result(self, event_id, user_id, rate, position, admitted):
+        if not admitted:
+            return {
+                "admitted": False,
+                "position": position,
+                "estimatedWaitSeconds": math.ceil((position + 1) / rate) if rate else None,
+            }
+        now = time.time()
+        with self._lock:
+            self._issued += 1
+        return {
+            "admitted": True,
+            "token": self._serializer.dumps({"e": event_id, "u": user_id}),
+            "expiresAt": now + self.token_ttl,
+        }
+
+    def join(self, event_id, user_id):
+        rate = self.rate(event_id)
+        position, admitted = self.backend.join(event_id, user_id, rate, time.time())
+        return self._result(event_id, user_id, rate, position, admitted)
+
+    def status(self, event_id, user_id):
+        """The user's place in the queue, or None if they haven't joined."""
+        rate = self.rate(event_id)
+        found = self.backend.status(event_id, user_id, rate, time.time())
+        if found is None:
+            return None
+        return self._result(event_id, user_id, rate, *found)
+
+    def check(self, token, event_id, user_id):
+        """True if ``token`` admits this user to this event and hasn't expired."""
+        if token:
+            try:
+                claims = self._serializer.loads(token, max_age=self.token_ttl)
+                if claims.get("e") == event_id and claims.get("u") == user_id:
+                    return True
+            except BadSignature:
+                pass
+        with self._lock:
+            self._rejected += 1
+        return False
+
+    def stats(self):
+        with self._lock:
+            enabled = {str(event_id): rate for event_id, (rate, _) in self._rates.items() if rate}
+            issued, rejected = self._issued, self._rejected
+        return {
+            "enabledEvents": enabled,
+            "tokenTtlSeconds": self.token_ttl,
+            "tokensIssued": issued,
+            "tokensRejected": rejected,
+            **self.backend.stats(),
+        }
+
+
+class RateLimiter:
+    """Token-bucket limits per user and per client address.
+
+    A limit with a rate of 0 is off. ``check()`` returns the seconds to wait
+    before retrying, or 0 if the request may go ahead.
+    """
+
+    def __init__(self, backend, user_rate, user_burst, ip_rate, ip_burst):
+        self.backend = backend
+        self.limits = {"user": (user_rate, user_burst), "ip": (ip_rate, ip_burst)}
+        self._lock = threading.Lock()
+        self._limited = {"user": 0, "ip": 0}
+
+    def check(self, user_id, address):
+        now = time.time()
+        for scope, subject in (("ip", address), ("user", user_id)):
+            rate, burst = self.limits[scope]
+            if not rate or subject is None:
+                continue
+            wait = self.backend.take(f"{scope}:{subject}", rate, max(burst, 1), now)
+            if wait:
+                with self._lock:
+                    self._limited[scope] += 1
+                return wait
+        return 0
+
+    def stats(self):
+        with self._lock:
+            limited = dict(self._limited)
+        return {
+            "limits": {scope: {"perSecond": rate, "burst": burst} for scope, (rate, burst) in self.limits.items()},
+            "limited": limited,
+        }
@@ -1,138 +1,931 @@
+import contextlib
 import hashlib
+import json
+import logging
+import math
 import os
-from flask import Flask, jsonify, make_response, request
+import time
+from flask import Blueprint, Flask, Response, current_app, jsonify, make_response, request
+from flask.logging import default_handler
 import sqlite3
 from datetime import datetime, timedelta, date
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_cors import CORS
-from flask_jwt_extended import JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt
+from flask_jwt_extended import (JWTManager, create_access_token, jwt_required, get_jwt_identity, get_jwt,
+                                verify_jwt_in_request)
 from dotenv import load_dotenv
+from db import ConnectionPool
+from admission import (ADMISSION_HEADER, DEFAULT_TOKEN_TTL, RateLimiter, WaitingRoom, load_backend)
+import archive
+from holds import DEFAULT_HOLD_TTL, HoldSweeper, hold_ttl
+from jobs import JobQueueFull, JobRunner
+from bestseats import MAX_BLOCK_SIZE
+from catalog import (DEFAULT_SEARCH_PAGE_SIZE, EVENT_COLUMNS, InvalidQuery, encode_cursor,
+                     encode_search_cursor, events_page_query, parse_fields, parse_limit, search_query)
+from checkout import (IDEMPOTENCY_HEADER, MAX_KEY_LENGTH, CheckoutLog, IdempotencyConflict,
+                      request_fingerprint)
+from eventstats import event_stats
+from exports import Export, ExportStats, FORMATS as EXPORT_FORMATS, parse_format, parse_position, stream
+from metrics import InstrumentedConnection, Metrics, TimedLock, record_lock_wait
+from migrations import migrate
+from provisioning import LayoutError, plan_layout, provision_event_in_batches
+from scanning import ADMITTED, ALREADY_ADMITTED, BarcodeSigner, ScanIndex
+from seatcache import SeatMapCache
+from seatmap import (COMPACT_MEDIA_TYPE, COMPRESSIBLE_MIMETYPES, FORMATS as SEAT_MAP_FORMATS, MIN_COMPRESS_BYTES,
+                     compress, encode as encode_seat_map, encodings as compression_encodings, negotiate_format)
+from seatstate import SeatStateStore, row_order
+from seatstream import SeatChangeLog, SubscriberLimitReached, format_event
+from seatsync import SeatVersionSync
+from tickethistory import (DEFAULT_PAGE_SIZE as DEFAULT_TICKET_PAGE_SIZE, TICKET_COLUMNS, TicketHistoryCache,
+                           sales_version, ticket_page)
+from writer import Rollback, Retry, SeatWriter, WriterBusy, WriterTimeout
 
 # Load environment variables from .env file
 load_dotenv()
 
-app = Flask(__name__)
-CORS(app)
-# CORS(
-#     app,
-#     resources={r"/*": {"origins": "*"}},
-#     supports_credentials=True
-# )
-app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY")
-app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(days=14)
-app.config["JWT_VERIFY_SUB"] = False
-jwt = JWTManager(app)
-
-# Returns a connection to the database which can be used to send SQL commands to the database
+# Every endpoint is registered on this blueprint; create_app() builds the Flask app around it
+api = Blueprint('api', __name__)
+jwt = JWTManager()
+
+# Settings create_app() takes from its `config` argument, then from the environment variable of the
+# same name, then from these defaults
+DEFAULT_CONFIG = {
+  'TESSERA_DB_PATH': '../database/tessera.db',
+  # Where the tickets and sales of archived past events are kept; attached to every connection.
+  # Defaults to a file next to TESSERA_DB_PATH, so each database has its own archive.
+  'ARCHIVE_DB_PATH': None,
+  # POST /admin/archive without a date archives events more than this many days old
+  'ARCHIVE_AFTER_DAYS': 30,
+  'DB_POOL_SIZE': 8,
+  # How long a reservation is held when the event doesn't set its own holdTtlSeconds
+  'HOLD_TTL_SECONDS': DEFAULT_HOLD_TTL,
+  'HOLD_SWEEP_INTERVAL': 5.0,
+  'SEAT_CACHE_MAX_EVENTS': 256,
+  # Buyers whose /profile pages are kept rendered in memory
+  'PROFILE_CACHE_MAX_USERS': 10000,
+  'SEAT_CACHE_MAX_BYTES': 64 * 1024 * 1024,
+  'SEAT_STREAM_BUFFER': 2048,
+  'SEAT_STREAM_MAX_SUBSCRIBERS': 1000,
+  # Seconds between checks for seat changes made by other worker processes; 0 turns it off
+  'SEAT_SYNC_INTERVAL': 1.0,
+  'CHECKOUT_LOG_MAX_ENTRIES': 10000,
+  # Most queued writes the seat writer commits together, and how many may wait before it turns
+  # writes away with a 503
+  'WRITER_MAX_BATCH': 64,
+  'WRITER_MAX_QUEUE': 1000,
+  # Seconds a write may wait for the seat writer to start it before the request gets a 503
+  'WRITER_TIMEOUT_SECONDS': 10.0,
+  # Where waiting room queues and rate-limit buckets live: unset for in-process, or "module:Class"
+  'ADMISSION_BACKEND': None,
+  'ADMISSION_TOKEN_TTL': DEFAULT_TOKEN_TTL,
+  # Token-bucket limits on POST/PUT/PATCH/DELETE requests, per logged-in user and per client
+  # address: requests per second and burst size. A rate of 0 turns the limit off.
+  'RATE_LIMIT_USER_PER_SECOND': 10.0,
+  'RATE_LIMIT_USER_BURST': 30,
+  'RATE_LIMIT_IP_PER_SECOND': 100.0,
+  'RATE_LIMIT_IP_BURST': 300,
+  # Events created from a layout with more seats than this are generated by a background job
+  'PROVISION_ASYNC_SEATS': 20000,
+  # Key ticket barcodes are signed with; defaults to the JWT secret. Changing it voids every
+  # barcode issued under the old key.
+  'BARCODE_SECRET': None,
+  # Requests slower than this are logged with the SQL they ran
+  'SLOW_REQUEST_MS': None,
+  # Bearer token Prometheus must send to read /metrics; if unset, /metrics is open
+  'METRICS_TOKEN': None,
+  # Comma-separated event ids to load at startup, or else how many of the busiest upcoming events
+  'PRELOAD_EVENTS': None,
+  'WARMUP_EVENTS': 4,
+}
+
+# Seconds between keep-alive comments on an idle seat stream
+SEAT_STREAM_HEARTBEAT = 15
+
+# Merges `overrides`, the environment and DEFAULT_CONFIG, converting environment strings to the
+# type of their default
+def load_config(overrides=None):
+  overrides = overrides or {}
+  config = {}
+  for key, default in DEFAULT_CONFIG.items():
+    if key in overrides:
+      value = overrides[key]
+    else:
+      value = os.getenv(key, default)
+      if isinstance(value, str) and default is not None:
+        value = type(default)(value)
+    config[key] = value
+  if not config['ARCHIVE_DB_PATH']:
+    config['ARCHIVE_DB_PATH'] = archive.default_path(config['TESSERA_DB_PATH'])
+  return config
+
+# The services below belong to the app create_app() built last. Each worker process serves one
+# app, so endpoints use them directly.
+
+# Shared pool of WAL-mode connections, opened once and reused across requests
+db_pool = None
+# Request latency, SQL and lock-wait metrics for /metrics
+metrics = None
+# Serialized seat maps per event, invalidated by bumping the event's version on every seat change
+seat_map_cache = None
+# Rendered /profile pages per buyer, checked against their sales version before they are served
+ticket_history_cache = None
+# Compact in-memory status of every seat, loaded per event on first use and updated write-through
+seat_states = None
+# Recent seat changes per event, streamed to browsers watching the seat map
+seat_changes = None
+# Completed checkouts by idempotency key, so a retried purchase returns its original result
+checkout_log = None
+# Background thread that releases abandoned reservations once their hold expires
+hold_sweeper = None
+# Background thread that drops in-memory seat state other worker processes have made stale
+seat_sync = None
+# Single thread that applies reserve, purchase and event writes in group-committed batches
+seat_writer = None
+# Queues for events with a waiting room, and the admission tokens reserve and purchase require
+waiting_room = None
+# Per-user and per-address token buckets for mutating requests
+rate_limiter = None
+# Signs the barcodes issued at checkout
+barcode_signer = None
+# Barcodes per event, loaded on the first gate scan, so scans are answered from memory
+scan_index = None
+# Rows, time to first byte and throughput of the streaming exports
+export_stats = None
+# Background thread for long admin tasks, such as generating the tickets of a large event
+job_runner = None
+
+# Held around every transaction that changes seat status, through to its seats_changed() call, so
+# the in-memory views above see this process's changes in the same order SQLite committed them
+seat_write_lock = TimedLock('seat_write')
+
+# Runs a write operation on the seat writer and waits for its result. See SeatWriter for how an
+# operation is written.
+def run_write(operation):
+  started = time.perf_counter()
+  try:
+    return seat_writer.execute(operation)
+  finally:
+    record_lock_wait('seat_writer', time.perf_counter() - started)
+
+# A write that couldn't get the database, a place in the writer's queue or its turn in time is worth
+# retrying, so the client gets a 503 it can act on instead of SQLite's message in a 500
+def write_error_response(e):
+  if isinstance(e, (WriterBusy, WriterTimeout)) or (isinstance(e, sqlite3.OperationalError)
+                                   and ('locked' in str(e) or 'busy' in str(e))):
+    response = jsonify({'error': 'The server is busy, try again shortly'})
+    response.headers['Retry-After'] = '1'
+    return response, 503
+  return jsonify({'error': str(e)}), 500
+
+# Borrows a connection from the pool for a `with` block; it is returned to the pool
+# (and any uncommitted transaction rolled back) when the block exits, even on errors
 def get_db_connection():
-  conn = sqlite3.connect('../database/tessera.db')
-  conn.row_factory = sqlite3.Row
-  return conn
-
-# Endpoint for getting events, with optional date filtering
-@app.route('/events', methods=['GET'])
+  return db_pool.connection()
+
+# Called after a committed write changes the status of seats in an event
+def seats_changed(event_id, seats, status):
+  seat_states.apply(event_id, seats, status)
+  version = seat_map_cache.bump(event_id)
+  seat_changes.publish(event_id, version, seats, status)
+  if seat_sync is not None:
+    seat_sync.local_change(event_id, len(seats))
+
+# Called by the hold sweeper with the (event_id, rowName, seatNumber) seats it released
+def holds_released(released):
+  by_event = {}
+  for event_id, row_name, seat_number in released:
+    by_event.setdefault(event_id, []).append((row_name, seat_number))
+  for event_id, seats in by_event.items():
+    seats_changed(event_id, seats, 'AVAILABLE')
+
+# Called when another process changed seats in an event this one holds in memory: everything
+# derived from the old state is dropped, and stream subscribers are told to refetch the map
+def seats_stale(event_id):
+  seat_states.invalidate(event_id)
+  version = seat_map_cache.bump(event_id)
+  seat_changes.reset(event_id, version)
+
+# Called after an archiving batch took an event's tickets out of the live tables. Its barcodes
+# are of no more use at the gates.
+def event_archived(event_id):
+  seats_stale(event_id)
+  scan_index.forget(event_id)
+
+# Called when a seat writer batch was rolled back after its operations ran. Some of them update the
+# in-memory seat state before the commit, so none of it can be trusted.
+def seat_writes_aborted():
+  for event_id in seat_states.event_ids():
+    seats_stale(event_id)
+
+# Events this process holds seat state, cached maps or stream subscribers for
+def tracked_events():
+  return seat_states.event_ids() + seat_map_cache.event_ids() + seat_changes.event_ids()
+
+# The SeatVersions version an event's in-memory seat state was loaded at, if it is loaded
+def loaded_seat_version(event_id):
+  state = seat_states.loaded(event_id)
+  return state.version if state is not None else None
+
+# Stops the background threads and closes the pool of the app built before, so building a new
+# app in the same process (tests, benchmarks) doesn't leave the old one running
+def shutdown():
+  for thread in (job_runner, seat_writer, hold_sweeper, seat_sync):
+    if thread is not None:
+      thread.stop()
+  if db_pool is not None:
+    db_pool.close()
+
+# Builds the app. `config` overrides the environment; see DEFAULT_CONFIG for the settings.
+# Startup migrates the schema, starts the background threads and warms the worker up before
+# the app is returned, so a WSGI server only routes traffic to it once it is ready.
+def create_app(config=None):
+  global db_pool, metrics, seat_map_cache, seat_states, seat_changes, checkout_log, hold_sweeper, seat_sync
+  global seat_writer, waiting_room, rate_limiter, barcode_signer, scan_index, job_runner, ticket_history_cache
+  global export_stats
+
+  started = time.perf_counter()
+  settings = load_config(config)
+  shutdown()
+
+  # The background threads log through their modules' loggers. Send those and the app's own
+  # to one handler, unless the server running us has set logging up already.
+  logging.basicConfig(level=logging.INFO, format='[%(asctime)s] %(levelname)s in %(module)s: %(message)s')
+
+  app = Flask(__name__)
+  app.logger.removeHandler(default_handler)
+  # Keep keys in the order they were added, so seat map rows stay in venue order (B before AA)
+  app.json.sort_keys = False
+  # Let the browser read the seat map's ETag and change-stream cursor, the events page cursor,
+  # whether a checkout was a replay and how long to back off
+  CORS(app, expose_headers=['ETag', 'X-Seat-Map-Cursor', 'X-Next-Cursor', 'Idempotent-Replayed', 'Retry-After'])
+  # CORS(
+  #     app,
+  #     resources={r"/*": {"origins": "*"}},
+  #     supports_credentials=True
+  # )
+  app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY")
+  app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(days=14)
+  app.config["JWT_VERIFY_SUB"] = False
+  # Anything else in `config` (TESTING, JWT settings...) goes straight to Flask
+  app.config.update(config or {})
+  app.config.update(settings)
+  jwt.init_app(app)
+
+  slow_ms = settings['SLOW_REQUEST_MS']
+  metrics = Metrics(slow_request_seconds=slow_ms / 1000 if slow_ms else None, logger=app.logger)
+
+  # Statements on pooled connections are timed for the request that runs them
+  db_pool = ConnectionPool(settings['TESSERA_DB_PATH'], size=settings['DB_POOL_SIZE'],
+                           factory=InstrumentedConnection,
+                           on_open=lambda conn: archive.attach(conn, settings['ARCHIVE_DB_PATH']),
+                           on_wait=lambda seconds: record_lock_wait('pool', seconds))
+
+  # Bring the schema up to date before serving anything
+  with get_db_connection() as conn:
+    migrate(conn)
+    archive.create_schema(conn)
+  migrated = time.perf_counter()
+
+  seat_map_cache = SeatMapCache(
+    max_events=settings['SEAT_CACHE_MAX_EVENTS'],
+    max_bytes=settings['SEAT_CACHE_MAX_BYTES'])
+  ticket_history_cache = TicketHistoryCache(max_users=settings['PROFILE_CACHE_MAX_USERS'])
+  seat_states = SeatStateStore(db_pool)
+  seat_changes = SeatChangeLog(
+    max_changes_per_event=settings['SEAT_STREAM_BUFFER'],
+    max_subscribers_per_event=settings['SEAT_STREAM_MAX_SUBSCRIBERS'])
+  checkout_log = CheckoutLog(max_entries=settings['CHECKOUT_LOG_MAX_ENTRIES'])
+
+  admission_backend = load_backend(settings['ADMISSION_BACKEND'])
+  waiting_room = WaitingRoom(admission_backend, app.config['JWT_SECRET_KEY'], load_rate=waiting_room_rate,
+                             token_ttl=settings['ADMISSION_TOKEN_TTL'])
+  rate_limiter = RateLimiter(admission_backend,
+                             user_rate=settings['RATE_LIMIT_USER_PER_SECOND'],
+                             user_burst=settings['RATE_LIMIT_USER_BURST'],
+                             ip_rate=settings['RATE_LIMIT_IP_PER_SECOND'],
+                             ip_burst=settings['RATE_LIMIT_IP_BURST'])
+
+  barcode_signer = BarcodeSigner(settings['BARCODE_SECRET'] or app.config['JWT_SECRET_KEY'])
+  scan_index = ScanIndex(barcode_signer, load_sales=event_sales)
+  export_stats = ExportStats()
+
+  seat_writer = SeatWriter(db_pool, max_batch=settings['WRITER_MAX_BATCH'],
+                           max_queue=settings['WRITER_MAX_QUEUE'], write_lock=seat_write_lock,
+                           on_abort=seat_writes_aborted, timeout=settings['WRITER_TIMEOUT_SECONDS'])
+  seat_writer.start()
+
+  job_runner = JobRunner(db_pool, write=run_write)
+  job_runner.start()
+
+  hold_sweeper = HoldSweeper(db_pool, interval=settings['HOLD_SWEEP_INTERVAL'],
+                             on_release=holds_released, write_lock=seat_write_lock)
+  hold_sweeper.start()
+
+  seat_sync = None
+  if settings['SEAT_SYNC_INTERVAL'] > 0:
+    seat_sync = SeatVersionSync(db_pool, interval=settings['SEAT_SYNC_INTERVAL'],
+                                tracked=tracked_events, baseline=loaded_seat_version,
+                                on_stale=seats_stale, write_lock=seat_write_lock)
+    seat_sync.start()
+
+  app.register_blueprint(api)
+
+  with app.app_context():
+    warmup = warm_up(settings)
+
+  app.config['STARTUP'] = {
+    'pid': os.getpid(),
+    'migrateMs': round((migrated - started) * 1000, 3),
+    **warmup,
+    'totalMs': round((time.perf_counter() - started) * 1000, 3),
+  }
+  app.logger.info("worker %d ready in %.1fms (%d events preloaded)", os.getpid(),
+                  app.config['STARTUP']['totalMs'], len(warmup['preloadedEvents']))
+  return app
+
+# The event's waiting room admission rate, or None if it has no waiting room
+def waiting_room_rate(event_id):
+  with get_db_connection() as conn:
+    row = conn.execute('SELECT waitingRoomRate FROM Events WHERE event_id = ?', (event_id,)).fetchone()
+  return row['waitingRoomRate'] if row else None
+
+# An event's ticket sales after `after_sale_id`, for the gate scan index
+def event_sales(event_id, after_sale_id):
+  with get_db_connection() as conn:
+    return [tuple(row) for row in conn.execute('''
+      SELECT id, barcode, rowName, seatNumber, admittedAt, admittedGate FROM TicketSales
+      WHERE event_id = ? AND id > ? ORDER BY id
+    ''', (event_id, after_sale_id))]
+
+# Returns an error response if the event has a waiting room and the request carries no valid
+# admission token for this user, or None if the request may go ahead
+def admission_denied(event_id, user_id):
+  try:
+    event_id = int(event_id)
+  except (TypeError, ValueError):
+    return None
+  if not waiting_room.enabled(event_id):
+    return None
+  if waiting_room.check(request.headers.get(ADMISSION_HEADER), event_id, user_id):
+    return None
+  return jsonify({
+    'error': f'This on-sale has a waiting room. Join it at /events/{event_id}/waiting-room and send '
+             f'the admission token in the {ADMISSION_HEADER} header',
+    'waitingRoom': f'/events/{event_id}/waiting-room'
+  }), 403
+
+# Upcoming events with the most seat activity, the ones a fresh worker should have in memory
+def hot_events(limit):
+  with get_db_connection() as conn:
+    rows = conn.execute('''
+      SELECT e.event_id FROM SeatVersions v
+      JOIN Events e ON e.event_id = v.event_id
+      WHERE e.date >= ?
+      ORDER BY v.version DESC
+      LIMIT ?
+    ''', (date.today().isoformat(), limit)).fetchall()
+  return [row['event_id'] for row in rows]
+
+# Opens every pooled connection and loads the seat state and seat map of the hot events, so the
+# first requests a worker takes don't pay for it
+def warm_up(settings):
+  started = time.perf_counter()
+  with contextlib.ExitStack() as stack:
+    connections = [stack.enter_context(db_pool.connection()) for _ in range(db_pool.size)]
+    for conn in connections:
+      conn.execute('SELECT COUNT(*) FROM SchemaMigrations').fetchone()
+  pool_opened = time.perf_counter()
+
+  if settings['PRELOAD_EVENTS']:
+    event_ids = [int(event_id) for event_id in str(settings['PRELOAD_EVENTS']).split(',') if event_id.strip()]
+  else:
+    event_ids = hot_events(settings['WARMUP_EVENTS'])
+
+  preloaded = []
+  for event_id in event_ids:
+    if seat_states.get(event_id) is not None:
+      seat_map_body(event_id, seat_map_cache.version(event_id))
+      preloaded.append(event_id)
+
+  return {
+    'poolWarmupMs': round((pool_opened - started) * 1000, 3),
+    'preloadMs': round((time.perf_counter() - pool_opened) * 1000, 3),
+    'preloadedEvents': preloaded,
+  }
+
+# Seats are matched in chunks so a large batch stays under SQLite's bound-parameter limit
+SEAT_CHUNK_SIZE = 400
+
+# Turns the event_id of a request body into the int the routes' <int:event_id> gives, which the seat
+# state and caches are keyed by; "23" is the same event. Returns None if it isn't an id.
+def parse_event_id(event_id):
+  if event_id is None or isinstance(event_id, bool) or (isinstance(event_id, float) and not event_id.is_integer()):
+    return None
+  try:
+    return int(event_id)
+  except (TypeError, ValueError):
+    return None
+
+# Turns a request's list of {rowName, seatNumber} objects into unique (rowName, seatNumber)
+# tuples in request order. Returns None if any seat is malformed.
+def parse_seats(seats):
+  parsed = []
+  seen = set()
+  for seat in seats:
+    if not isinstance(seat, dict):
+      return None
+    row_name = seat.get('rowName')
+    seat_number = seat.get('seatNumber')
+    if not row_name or not isinstance(row_name, str) or seat_number is None or isinstance(seat_number, bool):
+      return None
+    # Seat numbers are stored as integers; "12" from a form field is the same seat
+    try:
+      seat_number = int(seat_number)
+    except (TypeError, ValueError):
+      return None
+    key = (row_name, seat_number)
+    if key not in seen:
+      seen.add(key)
+      parsed.append(key)
+  return parsed
+
+# Yields (placeholders, params) pairs matching `(rowName, seatNumber) IN (VALUES ...)` for each chunk of seats
+def seat_chunks(seats):
+  for i in range(0, len(seats), SEAT_CHUNK_SIZE):
+    chunk = seats[i:i + SEAT_CHUNK_SIZE]
+    placeholders = ', '.join(['(?, ?)'] * len(chunk))
+    params = [value for seat in chunk for value in seat]
+    yield placeholders, params
+
+# Moves every seat in the batch from one status to another with one conditional UPDATE per chunk.
+# `hold` is a (user_id, expires_at) pair recorded on the moved seats; without it the hold is cleared.
+# `holder` is a (user_id, now) pair that limits the move to seats that user holds and whose hold
+# has not expired. Must run inside a write transaction. Returns the seats that could not be moved,
+# split into seats that don't exist and seats that are not eligible; both are empty on success.
+def transition_seats(conn, event_id, seats, from_status, to_status, hold=None, holder=None):
+  held_by, expires_at = hold or (None, None)
+  holder_condition = ''
+  holder_params = []
+  if holder:
+    holder_condition = 'AND heldBy = ? AND holdExpiresAt > ?'
+    holder_params = list(holder)
+
+  moved = set()
+  for placeholders, params in seat_chunks(seats):
+    rows = conn.execute(f'''
+      UPDATE Tickets
+      SET status = ?, heldBy = ?, holdExpiresAt = ?
+      WHERE event_id = ? AND status = ? {holder_condition}
+        AND (rowName, seatNumber) IN (VALUES {placeholders})
+      RETURNING rowName, seatNumber
+    ''', [to_status, held_by, expires_at, event_id, from_status] + holder_params + params).fetchall()
+    moved.update((row['rowName'], row['seatNumber']) for row in rows)
+
+  if len(moved) == len(seats):
+    return [], []
+
+  # Something was taken; look the leftovers up once to report every conflict together
+  leftovers = [seat for seat in seats if seat not in moved]
+  existing = set()
+  for placeholders, params in seat_chunks(leftovers):
+    rows = conn.execute(f'''
+      SELECT rowName, seatNumber FROM Tickets
+      WHERE event_id = ? AND (rowName, seatNumber) IN (VALUES {placeholders})
+    ''', [event_id] + params).fetchall()
+    existing.update((row['rowName'], row['seatNumber']) for row in rows)
+
+  missing = [seat for seat in leftovers if seat not in existing]
+  conflicts = [seat for seat in leftovers if seat in existing]
+  return missing, conflicts
+
+def seat_labels(seats):
+  return [{'rowName': row_name, 'seatNumber': seat_number} for row_name, seat_number in seats]
+
+# Reserves seats for the user by flipping the rows that are still AVAILABLE. Returns
+# (holdExpiresAt, missing, unavailable); on conflicts the caller must undo what was flipped.
+# Whether an event's seats can be reserved and bought. Those of an event still being provisioned can't:
+# if provisioning fails, its tickets are deleted again.
+def event_on_sale(conn, event_id):
+  row = conn.execute('SELECT provisioning FROM Events WHERE event_id = ?', (event_id,)).fetchone()
+  return row is not None and not row[0]
+
+def claim_seats(conn, event_id, seats, user_id, default_ttl):
+  expires_at = time.time() + hold_ttl(conn, event_id, default_ttl)
+  missing, unavailable = transition_seats(conn, event_id, seats, 'AVAILABLE', 'RESERVED',
+                                          hold=(user_id, expires_at))
+  return expires_at, missing, unavailable
+
+# Seat writer operation that reserves every seat in the batch for the user, or none of them.
+# Resolves to (holdExpiresAt, [], []) on success, or (None, missing, unavailable).
+def hold_seats(event_id, seats, user_id, default_ttl):
+  def operation(conn):
+    if not event_on_sale(conn, event_id):
+      raise Rollback((None, seats, []))
+    expires_at, missing, unavailable = claim_seats(conn, event_id, seats, user_id, default_ttl)
+    if missing or unavailable:
+      # All or nothing: release anything this request already claimed
+      raise Rollback((None, missing, unavailable))
+    return (expires_at, [], []), lambda: seats_changed(event_id, seats, 'RESERVED')
+  return operation
+
+# Builds the error response for a batch that could not be claimed, listing every conflicting seat
+def seat_conflict_response(missing, unavailable):
+  labels = ', '.join(f'{row}{number}' for row, number in missing or unavailable)
+  error = f'Seats do not exist: {labels}' if missing else f'Seats are not available: {labels}'
+  return jsonify({
+    'error': error,
+    'missing': seat_labels(missing),
+    'unavailable': seat_labels(unavailable)
+  }), 404 if missing else 400
+
+# Builds the error body and status for a checkout whose seats are not all held by the buyer. Only
+# runs on the failure path, so it can afford to look the conflicting seats up to say what went wrong.
+def hold_conflict_result(conn, event_id, missing, conflicts, user_id, now):
+  expired = set()
+  for placeholders, params in seat_chunks(conflicts):
+    rows = conn.execute(f'''
+      SELECT rowName, seatNumber, heldBy, holdExpiresAt FROM Tickets
+      WHERE event_id = ? AND status = 'RESERVED' AND (rowName, seatNumber) IN (VALUES {placeholders})
+    ''', [event_id] + params).fetchall()
+    expired.update((row['rowName'], row['seatNumber']) for row in rows
+                   if row['heldBy'] == user_id and (row['holdExpiresAt'] or 0) <= now)
+
+  expired = [seat for seat in conflicts if seat in expired]
+  unavailable = [seat for seat in conflicts if seat not in expired]
+  if missing:
+    error = 'Seats do not exist: '
+  elif unavailable:
+    error = 'Seats are not reserved by you: '
+  else:
+    error = 'Your hold has expired on seats: '
+  error += ', '.join(f'{row}{number}' for row, number in missing or unavailable or expired)
+  return {
+    'error': error,
+    'missing': seat_labels(missing),
+    'unavailable': seat_labels(unavailable),
+    'expired': seat_labels(expired)
+  }, 404 if missing else 400
+
+# Answers a retried checkout with the result of the original one
+def replayed_response(replay):
+  status, body = replay
+  response = jsonify(body)
+  response.headers['Idempotent-Replayed'] = 'true'
+  return response, status
+
+@api.before_app_request
+def start_request_metrics():
+  metrics.start_request()
+
+# Endpoints the rate limits don't apply to. Every gate at a venue scans through the same few staff
+# accounts and usually one address, at a rate no buyer would reach.
+RATE_LIMIT_EXEMPT = {'api.scan_ticket'}
+
+# Turns away mutating requests from users and addresses that are over their rate limit
+@api.before_app_request
+def limit_mutating_requests():
+  if request.method not in ('POST', 'PUT', 'PATCH', 'DELETE') or request.endpoint in RATE_LIMIT_EXEMPT:
+    return None
+  try:
+    verify_jwt_in_request(optional=True)
+    user_id = get_jwt_identity()
+  except Exception:
+    # The endpoint reports a bad token itself; count the request against the address only
+    user_id = None
+  wait = rate_limiter.check(user_id, request.remote_addr)
+  if wait:
+    response = jsonify({'error': 'Too many requests, slow down'})
+    response.headers['Retry-After'] = str(math.ceil(wait))
+    return response, 429
+  return None
+
+@api.after_app_request
+def record_request_metrics(response):
+  route = request.url_rule.rule if request.url_rule else 'unmatched'
+  metrics.finish_request(request.method, route, response.status_code)
+  return response
+
+# Compresses large JSON and text responses for clients that accept it. Streamed responses and ones
+# that are already encoded, like cached seat maps, are left alone.
+@api.after_app_request
+def compress_response(response):
+  if (response.status_code != 200 or response.direct_passthrough or response.is_streamed
+      or 'Content-Encoding' in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES):
+    return response
+  body = response.get_data()
+  encoding = response_encoding(len(body))
+  if encoding:
+    response.set_data(compress(body, encoding))
+    response.headers['Content-Encoding'] = encoding
+    response.vary.add('Accept-Encoding')
+  return response
+
+# Endpoint for Prometheus to scrape request, SQL and lock-wait metrics
+@api.route('/metrics', methods=['GET'])
+def get_metrics():
+  token = current_app.config['METRICS_TOKEN']
+  if token and request.headers.get('Authorization') != f'Bearer {token}':
+    return jsonify({'error': 'Unauthorized'}), 401
+
+  pool = db_pool.stats()
+  cache = seat_map_cache.stats()
+  writer = seat_writer.stats()
+  admission = waiting_room.stats()
+  gauges = [
+    ('tessera_db_pool_connections', 'gauge', 'Connections the pool has open.', pool['created']),
+    ('tessera_db_pool_connections_in_use', 'gauge', 'Connections checked out right now.', pool['inUse']),
+    ('tessera_db_pool_waits_total', 'counter', 'Times a request waited for a connection.', pool['waits']),
+    ('tessera_seat_cache_hits_total', 'counter', 'Seat map cache hits.', cache['hits']),
+    ('tessera_seat_cache_misses_total', 'counter', 'Seat map cache misses.', cache['misses']),
+    ('tessera_writer_queue_depth', 'gauge', 'Writes waiting for the seat writer.', writer['queueDepth']),
+    ('tessera_writer_batches_total', 'counter', 'Transactions the seat writer committed.', writer['batches']),
+    ('tessera_writer_operations_total', 'counter', 'Writes the seat writer committed or rolled back.',
+     writer['operations']),
+    ('tessera_writer_failed_batches_total', 'counter', 'Seat writer transactions that failed.',
+     writer['failedBatches']),
+    ('tessera_writer_timeouts_total', 'counter', 'Writes turned away after waiting WRITER_TIMEOUT_SECONDS.',
+     writer['timedOut']),
+    ('tessera_waiting_room_waiting', 'gauge', 'Buyers queued in a waiting room and not yet admitted.',
+     [({'event': event_id}, queue['waiting']) for event_id, queue in admission['queues'].items()]),
+    ('tessera_waiting_room_admitted_total', 'counter', 'Buyers admitted from a waiting room.',
+     [({'event': event_id}, queue['admitted']) for event_id, queue in admission['queues'].items()]),
+    ('tessera_rate_limited_total', 'counter', 'Mutating requests turned away by a rate limit.',
+     [({'scope': scope}, count) for scope, count in rate_limiter.stats()['limited'].items()]),
+    ('tessera_gate_scans_total', 'counter', 'Gate scans, by result.',
+     [({'result': result}, count) for result, count in scan_index.stats()['scans'].items()]),
+    ('tessera_export_rows_total', 'counter', 'Rows sent by the streaming exports.',
+     [({'export': name}, export['rows']) for name, export in export_stats.stats().items()]),
+    ('tessera_seat_stream_subscribers', 'gauge', 'Browsers watching a seat stream.',
+     seat_changes.stats()['subscribers']),
+    ('tessera_worker_startup_seconds', 'gauge', 'Time this worker took to migrate and warm up.',
+     current_app.config['STARTUP']['totalMs'] / 1000),
+  ]
+  return Response(metrics.render(gauges), mimetype='text/plain; version=0.0.4')
+
+# Endpoint for getting events, with optional date and location filtering. Results come in pages
+# ordered by date; the X-Next-Cursor response header is passed back as `cursor` for the next page.
+# `fields` limits the columns returned and `limit` sets the page size.
+@api.route('/events', methods=['GET'])
 def get_events():
-  conn = get_db_connection()
-  cursor = conn.cursor()
-  
-  # Start with the base SQL query
-  query = 'SELECT * FROM Events'
-  params = []
-  query_conditions = []
-  
-  # Check for the 'afterDate' filter
-  after_date = request.args.get('afterDate')
-  if after_date:
-      query_conditions.append('date > ?')
-      params.append(after_date)
-  # Check for the 'location' filter
-  location = request.args.get('location')
-  if location:
-      query_conditions.append('location = ?')
-      params.append(location)
-
-  # Add WHERE clause if conditions are present
-  if query_conditions:
-      query += ' WHERE ' + ' AND '.join(query_conditions)
-  
-  # Execute the query with the specified conditions
-  cursor.execute(query, params)
-  events = cursor.fetchall()
+  try:
+    columns = parse_fields(request.args.get('fields'))
+    limit = parse_limit(request.args.get('limit'))
+    query, params = events_page_query(
+      columns,
+      after_date=request.args.get('afterDate'),
+      location=request.args.get('location'),
+      cursor=request.args.get('cursor'),
+      limit=limit)
+  except InvalidQuery as e:
+    return jsonify({'error': str(e)}), 400
+
+  with get_db_connection() as conn:
+    events = conn.execute(query, params).fetchall()
+
+  has_more = len(events) > limit
+  events = events[:limit]
   
   # Convert the rows to dictionaries to make them serializable
-  events_list = [dict(event) for event in events]
-  conn.close()
+  events_list = [{column: event[column] for column in columns} for event in events]
   
-  return jsonify(events_list)
+  response = jsonify(events_list)
+  if has_more:
+    last = events[-1]
+    response.headers['X-Next-Cursor'] = encode_cursor(last['date'], last['event_id'])
+  return response
+
+# Endpoint for searching events by name, description and location. Every word in `q` has to match,
+# as a prefix, and results come best match first. Takes the same afterDate, location, fields and
+# limit as /events and pages the same way, through X-Next-Cursor.
+@api.route('/events/search', methods=['GET'])
+def search_events():
+  try:
+    columns = parse_fields(request.args.get('fields'))
+    limit = parse_limit(request.args.get('limit'), default=DEFAULT_SEARCH_PAGE_SIZE)
+    query, params, offset = search_query(
+      columns,
+      request.args.get('q'),
+      after_date=request.args.get('afterDate'),
+      location=request.args.get('location'),
+      cursor=request.args.get('cursor'),
+      limit=limit)
+  except InvalidQuery as e:
+    return jsonify({'error': str(e)}), 400
+
+  with get_db_connection() as conn:
+    events = conn.execute(query, params).fetchall()
+
+  response = jsonify([{column: event[column] for column in columns} for event in events[:limit]])
+  if len(events) > limit:
+    response.headers['X-Next-Cursor'] = encode_search_cursor(offset + limit)
+  return response
+
+# Endpoint for getting a single event
+@api.route('/events/<int:event_id>', methods=['GET'])
+def get_event(event_id):
+  try:
+    columns = parse_fields(request.args.get('fields'))
+  except InvalidQuery as e:
+    return jsonify({'error': str(e)}), 400
 
-# Endpoint for getting seat availability for an event
-@app.route('/events/<int:event_id>/seats', methods=['GET'])
+  with get_db_connection() as conn:
+    event = conn.execute(f'SELECT {", ".join(columns)} FROM Events WHERE event_id = ? AND provisioning = 0',
+                         (event_id,)).fetchone()
+
+  if event is None:
+    return jsonify({'error': 'Event not found'}), 404
+
+  return jsonify(dict(event)), 200
+
+# Endpoint for getting seat availability for an event. Takes the same `format` as seats-with-prices.
+@api.route('/events/<int:event_id>/seats', methods=['GET'])
 def get_event_seats(event_id):
+  seat_format = negotiate_format(request.args.get('format'), request.accept_mimetypes)
+  if seat_format is None:
+    return jsonify({'error': f'format must be one of: {", ".join(SEAT_MAP_FORMATS)}'}), 400
+
   try:
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Get all available tickets for the event
-    cursor.execute('''
-      SELECT rowName, seatNumber, status
-      FROM Tickets
-      WHERE event_id = ?
-      ORDER BY rowName, seatNumber
-    ''', (event_id,))
-    
-    available_tickets = cursor.fetchall()
-    
-    # Get all sold tickets for the event
-    cursor.execute('''
-      SELECT rowName, seatNumber
-      FROM TicketSales
-      WHERE event_id = ?
-      ORDER BY rowName, seatNumber
-    ''', (event_id,))
+    state = seat_states.get(event_id)
+    if state is None:
+      return jsonify({}), 200
     
-    sold_seats = cursor.fetchall()
-    conn.close()
+    # Organize seats by row; only sold seats are reported as taken
+    seats = (
+      (row, seat_num, 'SOLD' if status == 'SOLD' else 'AVAILABLE', None)
+      for row in sorted(state.rows, key=row_order)
+      for seat_num, status in state.row_statuses(row)
+    )
     
-    # Convert sold seats to a set for quick lookup
-    sold_set = set((dict(seat)['rowName'], dict(seat)['seatNumber']) for seat in sold_seats)
+    response = jsonify(encode_seat_map(seats, None, seat_format))
+    if seat_format == 'runs':
+      response.mimetype = COMPACT_MEDIA_TYPE
+    return response, 200
     
-    # Organize seats by row
-    seats_by_row = {}
-    for ticket in available_tickets:
-      row = ticket['rowName']
-      seat_num = ticket['seatNumber']
-      is_sold = (row, seat_num) in sold_set
-      
-      if row not in seats_by_row:
-        seats_by_row[row] = []
-      
-      seats_by_row[row].append({
-        'seatNumber': seat_num,
-        'status': 'SOLD' if is_sold else 'AVAILABLE'
-      })
+  except Exception as e:
+    return jsonify({'error': str(e)}), 500
+
+# Endpoint for getting the number of seats in each status for an event
+@api.route('/events/<int:event_id>/availability', methods=['GET'])
+def get_event_availability(event_id):
+  try:
+    state = seat_states.get(event_id)
+    if state is None:
+      return jsonify({'error': 'Event has no seats'}), 404
     
-    return jsonify(seats_by_row), 200
+    return jsonify(state.summary()), 200
     
   except Exception as e:
-    return jsonify({'error': str(e)}), 00
+    return jsonify({'error': str(e)}), 500
+
+# Endpoint for finding the best `count` adjacent available seats in one row, from the in-memory
+# free-seat index: the front-most row with room, as close to its middle as possible. `maxPriceCents`
+# caps the price per seat and `tiers` lists the price tiers to search, in order of preference.
+# With `reserve` the seats are also held for the logged-in caller, as /reserve_seats would.
+@api.route('/events/<int:event_id>/best-available', methods=['POST'])
+@jwt_required(optional=True)
+def find_best_available(event_id):
+  body = request.get_json(silent=True) or {}
+  count = body.get('count')
+  max_price_cents = body.get('maxPriceCents')
+  tiers = body.get('tiers')
+  reserve = bool(body.get('reserve'))
+
+  if not isinstance(count, int) or isinstance(count, bool) or not 1 <= count <= MAX_BLOCK_SIZE:
+    return jsonify({'error': f'count must be an integer from 1 to {MAX_BLOCK_SIZE}'}), 400
+  if max_price_cents is not None and (not isinstance(max_price_cents, int) or isinstance(max_price_cents, bool)):
+    return jsonify({'error': 'maxPriceCents must be an integer'}), 400
+  if tiers is not None and (not isinstance(tiers, list) or not all(isinstance(tier, str) for tier in tiers)):
+    return jsonify({'error': 'tiers must be a list of tier names'}), 400
+
+  current_user_id = get_jwt_identity()
+  if reserve and current_user_id is None:
+    return jsonify({'error': 'Log in to reserve seats'}), 401
+  if reserve:
+    denied = admission_denied(event_id, current_user_id)
+    if denied:
+      return denied
 
-# Endpoint for getting seat availability with prices for an event
-@app.route('/events/<int:event_id>/seats-with-prices', methods=['GET'])
-def get_event_seats_with_prices(event_id):
   try:
-    conn = get_db_connection()
+    expires_at = None
+    if reserve:
+      outcome = run_write(reserve_best_available(event_id, count, max_price_cents, tiers, current_user_id,
+                                                 current_app.config['HOLD_TTL_SECONDS']))
+      if outcome is None:
+        return jsonify({'error': 'Seats are changing too quickly, try again'}), 409
+      block, expires_at = outcome
+    else:
+      block = seat_states.best_available(event_id, count, max_price_cents, tiers)
+
+    if block is None:
+      return jsonify({'error': 'Event has no seats'}), 404
+    if not block:
+      return jsonify({'error': f'No {count} adjacent seats available'}), 404
+
+    result = {
+      'rowName': block.row_name,
+      'seats': [{'rowName': block.row_name, 'seatNumber': seat_number} for seat_number in block.seat_numbers],
+      'tier': block.tier,
+      'priceCents': block.price_cents,
+      'totalCents': block.price_cents * count,
+      'reserved': expires_at is not None,
+    }
+    if expires_at is not None:
+      result['holdExpiresAt'] = expires_at
+    return jsonify(result), 200
+
+  except Exception as e:
+    return write_error_response(e)
+
+# Seat writer operation that searches for the best block and reserves it. Searching on the writer
+# keeps concurrent callers off the same block. Resolves to (block, holdExpiresAt), or None if the
+# seats kept being taken.
+def reserve_best_available(event_id, count, max_price_cents, tiers, user_id, default_ttl):
+  attempts = 0
+  def operation(conn):
+    nonlocal attempts
+    attempts += 1
+    block = seat_states.best_available(event_id, count, max_price_cents, tiers)
+    if block and not event_on_sale(conn, event_id):
+      block = None
+    if not block:
+      return (block, None), None
+    seats = [(block.row_name, seat_number) for seat_number in block.seat_numbers]
+    expires_at, missing, unavailable = claim_seats(conn, event_id, seats, user_id, default_ttl)
+    if missing or unavailable:
+      # Another worker took seats the index still had as free; reload the event and look again
+      if attempts > 1:
+        seats_stale(event_id)
+      raise Retry()
+    # Take the block out of the index now rather than at commit, so the operations after this one
+    # in the batch don't pick it too. seats_changed() repeats this harmlessly.
+    seat_states.apply(event_id, seats, 'RESERVED')
+    return (block, expires_at), lambda: seats_changed(event_id, seats, 'RESERVED')
+  return operation
+
+# Endpoint for joining an event's waiting room. Answers with the buyer's place in the queue, or, once
+# they are admitted, an admission token to send with reserve and purchase requests. Joining again
+# keeps the original place, so clients poll this until they are admitted.
+@api.route('/events/<int:event_id>/waiting-room', methods=['POST'])
+@jwt_required()
+def join_waiting_room(event_id):
+  if not waiting_room.enabled(event_id):
+    return jsonify({'waitingRoom': False}), 200
+  return jsonify({'waitingRoom': True, **waiting_room.join(event_id, get_jwt_identity())}), 200
+
+# Endpoint for checking a buyer's place in an event's waiting room without joining it
+@api.route('/events/<int:event_id>/waiting-room', methods=['GET'])
+@jwt_required()
+def get_waiting_room_status(event_id):
+  if not waiting_room.enabled(event_id):
+    return jsonify({'waitingRoom': False}), 200
+  status = waiting_room.status(event_id, get_jwt_identity())
+  if status is None:
+    return jsonify({'error': 'Not in the queue for this event'}), 404
+  return jsonify({'waitingRoom': True, **status}), 200
+
+# Builds the response for a serialized seat map, tagged so clients can revalidate it cheaply
+def seat_map_response(body, etag, cursor, seat_format, encoding):
+  response = make_response(body, 200)
+  response.mimetype = COMPACT_MEDIA_TYPE if seat_format == 'runs' else 'application/json'
+  if encoding:
+    response.headers['Content-Encoding'] = encoding
+  response.vary.update(('Accept', 'Accept-Encoding'))
+  response.set_etag(etag)
+  # Where /seats/stream should pick up to receive every change made after this map
+  response.headers['X-Seat-Map-Cursor'] = cursor
+  # Let clients keep the map but always check the ETag before reusing it
+  response.headers['Cache-Control'] = 'no-cache'
+  return response
+
+# Returns the serialized seat map with prices for this version of an event in the given format and
+# content coding, from the cache or built from the database
+def seat_map_body(event_id, version, seat_format='json', encoding=None):
+  variant = f'{seat_format}+{encoding}' if encoding else seat_format
+  body = seat_map_cache.get(event_id, version, variant)
+  if body is not None:
+    return body
+
+  if encoding:
+    body = compress(seat_map_body(event_id, version, seat_format), encoding)
+    seat_map_cache.put(event_id, version, body, variant)
+    return body
+
+  with get_db_connection() as conn:
     cursor = conn.cursor()
     
-    # Get all tickets with their price tier information
+    # Get all tickets with their price tier. An event still being provisioned has none yet.
     cursor.execute('''
-      SELECT t.rowName, t.seatNumber, t.status, pt.priceCents
-      FROM Tickets t
-      JOIN PriceTiers pt ON t.priceTierId = pt.id
-      WHERE t.event_id = ?
-      ORDER BY t.rowName, t.seatNumber
-    ''', (event_id,))
+      SELECT rowName, seatNumber, status, priceTierId
+      FROM Tickets
+      WHERE event_id = ? AND NOT EXISTS (SELECT 1 FROM Events WHERE event_id = ? AND provisioning)
+      ORDER BY length(rowName), rowName, seatNumber
+    ''', (event_id, event_id))
     
     tickets = cursor.fetchall()
+
+    tiers = {tier['id']: (tier['name'], tier['priceCents']) for tier in cursor.execute(
+      'SELECT id, name, priceCents FROM PriceTiers WHERE event_id = ?', (event_id,)
+    )}
     
     # Get all sold tickets to mark them as SOLD
     cursor.execute('''
@@ -142,34 +935,112 @@ def get_event_seats_with_prices(event_id):
     ''', (event_id,))
     
     sold_seats = cursor.fetchall()
-    conn.close()
-    
-    # Convert sold seats to a set
-    sold_set = set((dict(seat)['rowName'], dict(seat)['seatNumber']) for seat in sold_seats)
-    
-    # Organize seats by row with prices
-    seats_by_row = {}
-    for ticket in tickets:
-      row = ticket['rowName']
-      seat_num = ticket['seatNumber']
-      is_sold = (row, seat_num) in sold_set
-      
-      if row not in seats_by_row:
-        seats_by_row[row] = []
-      
-      seats_by_row[row].append({
-        'seatNumber': seat_num,
-        'status': 'SOLD' if is_sold else ticket['status'],
-        'priceCents': ticket['priceCents']
-      })
-    
-    return jsonify(seats_by_row), 200
+  
+  # Convert sold seats to a set
+  sold_set = set((seat['rowName'], seat['seatNumber']) for seat in sold_seats)
+  
+  # Seats without a tier have no price, so they are left out as the old join did
+  seats = (
+    (ticket['rowName'], ticket['seatNumber'],
+     'SOLD' if (ticket['rowName'], ticket['seatNumber']) in sold_set else ticket['status'],
+     ticket['priceTierId'])
+    for ticket in tickets if ticket['priceTierId'] in tiers
+  )
+  
+  body = current_app.json.dumps(encode_seat_map(seats, tiers, seat_format)).encode()
+  seat_map_cache.put(event_id, version, body, variant)
+  return body
+
+# Picks the content coding for a response body, or None to send it as is
+def response_encoding(size):
+  if size < MIN_COMPRESS_BYTES:
+    return None
+  return request.accept_encodings.best_match(compression_encodings())
+
+# Endpoint for getting seat availability with prices for an event. `format=runs` (or an Accept of
+# the compact media type) sends each row as runs of seats instead of one object per seat.
+@api.route('/events/<int:event_id>/seats-with-prices', methods=['GET'])
+def get_event_seats_with_prices(event_id):
+  seat_format = negotiate_format(request.args.get('format'), request.accept_mimetypes)
+  if seat_format is None:
+    return jsonify({'error': f'format must be one of: {", ".join(SEAT_MAP_FORMATS)}'}), 400
+  encoding = request.accept_encodings.best_match(compression_encodings())
+
+  # Clients that already hold the current version of the map get a 304 without touching the database
+  version = seat_map_cache.version(event_id)
+  etag = f'{seat_map_cache.etag(event_id, version)}-{seat_format}-{encoding or "identity"}'
+  if request.if_none_match.contains(etag):
+    seat_map_cache.not_modified()
+    response = make_response('', 304)
+    response.set_etag(etag)
+    return response
+
+  try:
+    body = seat_map_body(event_id, version, seat_format)
+    if encoding and len(body) >= MIN_COMPRESS_BYTES:
+      body = seat_map_body(event_id, version, seat_format, encoding)
+    else:
+      encoding = None
+    return seat_map_response(body, etag, seat_map_cache.cursor(version), seat_format, encoding)
     
   except Exception as e:
     return jsonify({'error': str(e)}), 500
 
+# Endpoint for streaming seat status changes for an event as server-sent events. Pass the
+# X-Seat-Map-Cursor from seats-with-prices as `since` to receive every change after that map;
+# reconnecting browsers resume from Last-Event-ID. A `reset` event means the cursor can't be
+# resumed and the full map should be fetched again.
+@api.route('/events/<int:event_id>/seats/stream', methods=['GET'])
+def stream_event_seats(event_id):
+  cursor = request.args.get('since') or request.headers.get('Last-Event-ID')
+  current = seat_map_cache.version(event_id)
+  since = seat_map_cache.parse_cursor(cursor) if cursor else current
+  needs_reset = since is None or since > current
+
+  if seat_changes.is_full(event_id):
+    return jsonify({'error': f'event {event_id} has too many seat stream subscribers'}), 503
+
+  # Subscribing happens in the generator, so a client that leaves before the stream starts
+  # was never counted. One that lost a race for the last place gets an empty stream and retries.
+  def generate():
+    subscribed = False
+    try:
+      seat_changes.subscribe(event_id, current)
+      subscribed = True
+      version = since
+      yield 'retry: 3000\n\n'
+      if needs_reset:
+        version = current
+        yield format_event('reset', {}, seat_map_cache.cursor(version))
+
+      while True:
+        changes, latest = seat_changes.wait(event_id, version, SEAT_STREAM_HEARTBEAT)
+        if changes is None:
+          version = latest
+          yield format_event('reset', {}, seat_map_cache.cursor(version))
+        elif changes:
+          version = changes[-1][0]
+          deltas = [
+            {'rowName': row_name, 'seatNumber': seat_number, 'status': status, 'version': change_version}
+            for change_version, row_name, seat_number, status in changes
+          ]
+          yield format_event('seats', deltas, seat_map_cache.cursor(version))
+        else:
+          yield ': keep-alive\n\n'
+    except SubscriberLimitReached:
+      return
+    finally:
+      if subscribed:
+        seat_changes.unsubscribe(event_id)
+
+  response = Response(generate(), mimetype='text/event-stream')
+  response.headers['Cache-Control'] = 'no-cache'
+  # Stop reverse proxies from buffering the stream
+  response.headers['X-Accel-Buffering'] = 'no'
+  return response
+
 # Endpoint for creating a new user
-@app.route('/users', methods=['POST'])
+@api.route('/users', methods=['POST'])
 def create_user():
     # Extract email, username, and password from the JSON payload
     email = request.json.get('email')
@@ -183,18 +1054,17 @@ def create_user():
     # Hash the password
     hashed_password = hashlib.sha256(password.encode()).hexdigest()
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Attempt to insert the new user into the Users table
-        cursor.execute('INSERT INTO Users (email, username, password_hash) VALUES (?, ?, ?)',
-                       (email, username, hashed_password))
-        conn.commit()  # Commit the changes to the database
-
-        # Retrieve the user_id of the newly created user to confirm creation
-        cursor.execute('SELECT user_id FROM Users WHERE username = ?', (username,))
-        new_user_id = cursor.fetchone()
-        conn.close()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+            
+            # Attempt to insert the new user into the Users table
+            cursor.execute('INSERT INTO Users (email, username, password_hash) VALUES (?, ?, ?)',
+                           (email, username, hashed_password))
+            conn.commit()  # Commit the changes to the database
+
+            # Retrieve the user_id of the newly created user to confirm creation
+            cursor.execute('SELECT user_id FROM Users WHERE username = ?', (username,))
+            new_user_id = cursor.fetchone()
 
         return jsonify({'message': 'User created successfully', 'user_id': new_user_id['user_id']}), 201
 
@@ -204,7 +1074,7 @@ def create_user():
         return jsonify({'error': str(e)}), 500
 
 # Endpoint for user login
-@app.route('/login', methods=['POST'])
+@api.route('/login', methods=['POST'])
 def user_login():
     username = request.json.get('username')
     password = request.json.get('password')
@@ -215,38 +1085,33 @@ def user_login():
     hashed_password_input = hashlib.sha256(password.encode()).hexdigest()
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Retrieve hashed password, user_id, and admin status from the database
-        cursor.execute('SELECT password_hash, user_id, admin FROM Users WHERE username = ?', (username,))
-        user_data = cursor.fetchone()
+        with get_db_connection() as conn:
+            # Retrieve hashed password, user_id, and admin status from the database
+            user_data = conn.execute('SELECT password_hash, user_id, admin FROM Users WHERE username = ?',
+                                     (username,)).fetchone()
+
         if user_data is None:
-            conn.close()
             return jsonify({'error': 'Username not found'}), 401
 
         if hashed_password_input == user_data['password_hash']:
             access_token = create_access_token(
                 identity=user_data['user_id'],
                 additional_claims={"admin": user_data['admin']})
-            conn.close()
             return jsonify(access_token=access_token), 200
         else:
-            conn.close()
             return jsonify({'error': 'Invalid password.'}), 401
 
-    except Exception as e:
-        print(e)
+    except Exception:
+        current_app.logger.exception('Login failed')
         return jsonify({'error': "An error occurred during login"}), 500
 
 # Endpoint for changing user password
-@app.route('/users', methods=['PUT'])
+@api.route('/users', methods=['PUT'])
 @jwt_required()
 def change_password():
     current_user_id = get_jwt_identity()
     old_password = request.json.get('old_password')
     new_password = request.json.get('new_password')
-    print(current_user_id)
 
     if not old_password or not new_password:
         return jsonify({'error': 'old_password and new_password are required'}), 400
@@ -256,42 +1121,37 @@ def change_password():
     hashed_new = hashlib.sha256(new_password.encode()).hexdigest()
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
 
-        # Get user data for the current user
-        cursor.execute('SELECT password_hash, username FROM Users WHERE user_id = ?', (current_user_id,))
-        user_data = cursor.fetchone()
-        print(user_data)
+            # Get user data for the current user
+            cursor.execute('SELECT password_hash, username FROM Users WHERE user_id = ?', (current_user_id,))
+            user_data = cursor.fetchone()
 
-        if user_data is None:
-            conn.close()
-            return jsonify({'error': 'User not found'}), 404
+            if user_data is None:
+                return jsonify({'error': 'User not found'}), 404
 
-        # Verify old password
-        if hashed_old != user_data['password_hash']:
-            conn.close()
-            return jsonify({'error': 'Old password is incorrect'}), 400
+            # Verify old password
+            if hashed_old != user_data['password_hash']:
+                return jsonify({'error': 'Old password is incorrect'}), 400
 
-        # Check if new password is different
-        if hashed_new == user_data['password_hash']:
-            conn.close()
-            return jsonify({'error': 'New password cannot be the same as current password'}), 400
+            # Check if new password is different
+            if hashed_new == user_data['password_hash']:
+                return jsonify({'error': 'New password cannot be the same as current password'}), 400
 
-        # Update password
-        cursor.execute('UPDATE Users SET password_hash = ? WHERE user_id = ?',
-                       (hashed_new, current_user_id))
-        conn.commit()
-        conn.close()
+            # Update password
+            cursor.execute('UPDATE Users SET password_hash = ? WHERE user_id = ?',
+                           (hashed_new, current_user_id))
+            conn.commit()
 
         return jsonify({'message': 'Password changed successfully'}), 200
 
-    except Exception as e:
-        print(e)
+    except Exception:
+        current_app.logger.exception('Password change failed')
         return jsonify({'error': 'An error occurred while changing password'}), 500
 
 # Endpoint for deleting a user
-@app.route('/users', methods=['DELETE'])
+@api.route('/users', methods=['DELETE'])
 def delete_user():
     username = request.json.get('username')
     password = request.json.get('password')
@@ -300,149 +1160,192 @@ def delete_user():
     hashed_password_input = hashlib.sha256(password.encode()).hexdigest()
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Retrieve current password from the database
-        cursor.execute('SELECT password_hash from Users WHERE username = ?',(username,))
-        hash_from_db = cursor.fetchone()
-
-        if hashed_password_input != hash_from_db['password_hash']:
-            return jsonify({'error': 'Password does not match'}), 400
-        else:
-            cursor.execute('DELETE FROM Users WHERE username = ?', (username,))
-            conn.commit()
-            conn.close()
-            return jsonify({'message': 'User deleted successfully'}), 201
+        with get_db_connection() as conn:
+            cursor = conn.cursor()
+
+            # Retrieve current password from the database
+            cursor.execute('SELECT password_hash from Users WHERE username = ?',(username,))
+            hash_from_db = cursor.fetchone()
+
+            if hashed_password_input != hash_from_db['password_hash']:
+                return jsonify({'error': 'Password does not match'}), 400
+            else:
+                cursor.execute('DELETE FROM Users WHERE username = ?', (username,))
+                conn.commit()
+                return jsonify({'message': 'User deleted successfully'}), 201
     
-    except Exception as e:
-        print(e)
+    except Exception:
+        current_app.logger.exception('User deletion failed')
         return jsonify({'error': "you dont exist or sumn"}), 500
 
-# Endpoint for getting all user emails
-@app.route('/emails', methods=['GET'])
+# Streams `export` as NDJSON or CSV (`format`), starting after the key `after`. With `limit`, only that
+# many rows are sent, and X-Next-Cursor is the `after` for the rest.
+def export_response(export, filename):
+    try:
+        fmt = parse_format(request.args.get('format'))
+        after = parse_position(request.args.get('after'), 'after')
+        limit = parse_position(request.args.get('limit'), 'limit')
+    except InvalidQuery as e:
+        return jsonify({'error': str(e)}), 400
+
+    up_to = None
+    if limit is not None:
+        with get_db_connection() as conn:
+            up_to = export.page_end(conn, after, limit)
+        if up_to is None:
+            limit = None  # this is the last page; stream whatever is left
+
+    response = Response(stream(db_pool, export, fmt, after=after, up_to=up_to, stats=export_stats),
+                        mimetype=EXPORT_FORMATS[fmt])
+    response.headers['Content-Disposition'] = f'attachment; filename="{filename}.{fmt}"'
+    if up_to is not None:
+        response.headers['X-Next-Cursor'] = str(up_to)
+    return response
+
+# Endpoint for admins to export every user's email address, streamed with the user_id as the key
+@api.route('/emails', methods=['GET'])
+@jwt_required()
 def get_emails():
-    conn = get_db_connection()
-    cursor = conn.cursor()
-    
-    # Start with the base SQL query and fill emails list
-    query = 'SELECT email FROM Users'
-    cursor.execute(query)
-    emails = cursor.fetchall()
-    
-    # Convert the rows to dictionaries to make them serializable
-    emails_list = [dict(email) for email in emails]
-    conn.close()
-    
-    return jsonify(emails_list), 200
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    return export_response(Export('emails', 'Users', ['email'], key='user_id'), 'emails')
+
+# Endpoint for admins to export every event, streamed in event_id order
+@api.route('/admin/export/events', methods=['GET'])
+@jwt_required()
+def export_events():
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    columns = list(EVENT_COLUMNS) + ['holdTtlSeconds', 'waitingRoomRate', 'archivedAt']
+    return export_response(Export('events', 'Events', columns, key='event_id'), 'events')
+
+# Endpoint for admins to export ticket sales in sale order, all of them or one event's (`event_id`).
+# Sales of archived events are in the archive database instead.
+@api.route('/admin/export/sales', methods=['GET'])
+@jwt_required()
+def export_sales():
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    columns = ['event_id', 'rowName', 'seatNumber', 'userId', 'barcode', 'purchasedAt', 'admittedAt', 'admittedGate']
+    event_id = request.args.get('event_id', type=int)
+    if event_id is None:
+        return export_response(Export('sales', 'TicketSales', columns, key='id'), 'sales')
+    export = Export('sales', 'TicketSales', columns, key='id', where='event_id = ?', params=(event_id,))
+    return export_response(export, f'event-{event_id}-sales')
 
 # Endpoint for reserving seats before payment
-@app.route('/reserve_seats', methods=['POST'])
+@api.route('/reserve_seats', methods=['POST'])
 @jwt_required()
 def reserve_seats():
+    current_user_id = get_jwt_identity()
     event_id = request.json.get('event_id')
     seats = request.json.get('seats')  # List of {rowName, seatNumber} objects
 
     if not event_id or not seats or not isinstance(seats, list):
         return jsonify({'error': 'event_id and seats list are required'}), 400
 
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        # Reserve each seat by updating its status to RESERVED
-        for seat in seats:
-            row_name = seat.get('rowName')
-            seat_number = seat.get('seatNumber')
-            
-            if not row_name or seat_number is None:
-                conn.close()
-                return jsonify({'error': 'Invalid seat format. rowName and seatNumber are required'}), 400
-
-            # Check if seat is already reserved or sold
-            cursor.execute('''
-                SELECT status FROM Tickets 
-                WHERE event_id = ? AND rowName = ? AND seatNumber = ?
-            ''', (event_id, row_name, seat_number))
-            
-            existing_ticket = cursor.fetchone()
-            
-            if not existing_ticket:
-                conn.close()
-                return jsonify({'error': f'Seat {row_name}{seat_number} does not exist'}), 404
-            
-            if existing_ticket['status'] != 'AVAILABLE':
-                conn.close()
-                return jsonify({'error': f'Seat {row_name}{seat_number} is not available'}), 400
+    event_id = parse_event_id(event_id)
+    if event_id is None:
+        return jsonify({'error': 'event_id must be an integer'}), 400
 
-            # Update the seat status to RESERVED
-            cursor.execute('''
-                UPDATE Tickets 
-                SET status = 'RESERVED' 
-                WHERE event_id = ? AND rowName = ? AND seatNumber = ?
-            ''', (event_id, row_name, seat_number))
+    seat_keys = parse_seats(seats)
+    if seat_keys is None:
+        return jsonify({'error': 'Invalid seat format. rowName and seatNumber are required'}), 400
 
-        conn.commit()
-        conn.close()
+    denied = admission_denied(event_id, current_user_id)
+    if denied:
+        return denied
 
-        return jsonify({'message': f'{len(seats)} seats reserved successfully'}), 200
+    try:
+        # Turn away seats we already know are taken without queueing for the database write lock
+        state = seat_states.get(event_id)
+        if state is not None:
+            statuses = [(seat, state.status(*seat)) for seat in seat_keys]
+            missing = [seat for seat, status in statuses if status is None]
+            unavailable = [seat for seat, status in statuses if status not in (None, 'AVAILABLE')]
+            if missing or unavailable:
+                return seat_conflict_response(missing, unavailable)
+
+        expires_at, missing, unavailable = run_write(
+            hold_seats(event_id, seat_keys, current_user_id, current_app.config['HOLD_TTL_SECONDS']))
+        if expires_at is None:
+            return seat_conflict_response(missing, unavailable)
+
+        return jsonify({
+            'message': f'{len(seat_keys)} seats reserved successfully',
+            'holdExpiresAt': expires_at
+        }), 200
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return write_error_response(e)
 
 # Endpoint for awarding a user a ticket
-@app.route('/award_ticket', methods=['POST'])
+@api.route('/award_ticket', methods=['POST'])
 @jwt_required()
 def award_ticket():
     event_id = request.json.get('event_id')
     current_user = get_jwt_identity()
 
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-
-        cursor.execute('INSERT INTO Tickets (event_id, user_id, purchase_date, price) VALUES (?, ?, ?, ?)', 
-                       (event_id, current_user, date.today(), 0.0))
-        conn.commit()
-        conn.close()
+        with get_db_connection() as conn:
+            conn.execute('INSERT INTO Tickets (event_id, user_id, purchase_date, price) VALUES (?, ?, ?, ?)', 
+                         (event_id, current_user, date.today(), 0.0))
+            conn.commit()
 
         return jsonify({'message': 'Ticket awarded successfully'}), 201
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# Endpoint for getting all tickets for the current user
-@app.route('/profile', methods=['GET'])
+# Endpoint for getting the current user's tickets, upcoming events first and then past ones, archived
+# events included. Results come in pages of `limit` (50 by default); the X-Next-Cursor response
+# header is passed back as `cursor` for the next page. Pages are served from memory until the user's
+# sales change.
+@api.route('/profile', methods=['GET'])
 @jwt_required()
 def get_user_tickets():
     current_user_id = get_jwt_identity()
     
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        
-        # Get all ticket sales for the current user with event details
-        cursor.execute('''
-            SELECT ts.id, ts.event_id, ts.rowName, ts.seatNumber, ts.barcode, ts.purchasedAt, 
-                   e.name, e.date, e.time, e.location, e.description, e.imageUrl
-            FROM TicketSales ts
-            JOIN Events e ON ts.event_id = e.event_id
-            WHERE ts.userId = ?
-            ORDER BY e.date
-        ''', (current_user_id,))
-        
-        tickets = cursor.fetchall()
-        conn.close()
-        
-        # Convert rows to dictionaries
-        tickets_list = [dict(ticket) for ticket in tickets]
-        
-        return jsonify(tickets_list), 200
-        
+        limit = parse_limit(request.args.get('limit'), default=DEFAULT_TICKET_PAGE_SIZE)
+        cursor = request.args.get('cursor')
+        today = date.today().isoformat()
+        # The first page depends on the day, since it starts with the upcoming events
+        page = (cursor or today, limit)
+
+        with get_db_connection() as conn:
+            version = sales_version(conn, current_user_id)
+            cached = ticket_history_cache.get(current_user_id, version, page)
+            if cached is None:
+                tickets, next_cursor = ticket_page(conn, current_user_id, today, cursor, limit)
+                body = json.dumps([{column: ticket[column] for column in TICKET_COLUMNS} for ticket in tickets])
+                cached = (body, next_cursor)
+                ticket_history_cache.put(current_user_id, version, page, *cached)
+
+        response = Response(cached[0], mimetype='application/json')
+        if cached[1]:
+            response.headers['X-Next-Cursor'] = cached[1]
+        return response, 200
+
+    except InvalidQuery as e:
+        return jsonify({'error': str(e)}), 400
+
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
-# Endpoint for admins to create events
-@app.route('/admin/events', methods=['POST'])
+# Endpoint for admins to create events. With a `layout` (tiers and sections, as in the layout files
+# script.py takes) it also creates the event's price tiers and every ticket in one transaction.
+# Layouts with more than PROVISION_ASYNC_SEATS seats, or any sent with "background": true, are
+# generated by a background job instead; the 202 response links to the job's status.
+@api.route('/admin/events', methods=['POST'])
 @jwt_required()
 def create_event():
     name = request.json.get('name')
@@ -451,85 +1354,444 @@ def create_event():
     time = request.json.get('time')
     location = request.json.get('location')
     imageUrl = request.json.get('imageUrl')
+    hold_ttl_seconds = request.json.get('holdTtlSeconds')  # Optional, falls back to HOLD_TTL_SECONDS
+    layout = request.json.get('layout')
+    background = request.json.get('background') is True
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    if not isinstance(name, str) or not name.strip():
+        return jsonify({'error': 'name is required'}), 400
+
+    if hold_ttl_seconds is not None and (not isinstance(hold_ttl_seconds, int) or hold_ttl_seconds <= 0):
+        return jsonify({'error': 'holdTtlSeconds must be a positive integer'}), 400
+
+    event = {'name': name, 'description': description, 'date': date, 'time': time, 'location': location,
+             'imageUrl': imageUrl, 'holdTtlSeconds': hold_ttl_seconds}
+
+    if layout is None:
+        def operation(conn):
+            cursor = conn.execute('INSERT INTO Events (name, description, date, time, location, imageUrl, holdTtlSeconds) VALUES (?, ?, ?, ?, ?, ?, ?)', 
+                                  (name, description, date, time, location, imageUrl or '', hold_ttl_seconds))
+            return cursor.lastrowid, None
+
+        try:
+            # Queued with the seat writes so it doesn't compete with them for SQLite's write lock
+            event_id = run_write(operation)
+            return jsonify({'message': 'Event created successfully', 'event_id': event_id}), 201
+        except Exception as e:
+            return write_error_response(e)
+
+    try:
+        if not isinstance(layout, dict):
+            raise LayoutError('layout must be an object with tiers and sections')
+        _, rows = plan_layout(layout)
+    except LayoutError as e:
+        return jsonify({'error': f'Invalid layout: {e}'}), 400
+    seats = sum(count for _, _, _, count in rows)
+
+    def provision(progress=None):
+        # A batch of tickets per seat writer transaction, so writes for other events don't wait on a whole
+        # venue. The event stays hidden until every batch is in.
+        return provision_event_in_batches(run_write, event, layout, on_published=seats_stale, log=progress)
+
+    try:
+        if background or seats > current_app.config['PROVISION_ASYNC_SEATS']:
+            job_id = job_runner.submit('provision_event', provision, details={'name': name, 'seats': seats})
+            response = jsonify({'message': 'Event is being created', 'jobId': job_id, 'status': 'queued',
+                                'seats': seats})
+            response.headers['Location'] = f'/admin/jobs/{job_id}'
+            return response, 202
+
+        return jsonify({'message': 'Event created successfully', **provision()}), 201
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
+    except Exception as e:
+        return write_error_response(e)
+
+# Endpoint for admins to move the tickets and sales of past events to the archive database. Takes
+# `before` (YYYY-MM-DD, no later than today; defaults to ARCHIVE_AFTER_DAYS ago) and runs as a
+# background job, in small batches on the seat writer so on-sales carry on meanwhile.
+@api.route('/admin/archive', methods=['POST'])
+@jwt_required()
+def archive_past_events():
     claims = get_jwt()
 
     if claims.get("admin") != 1:
         return {"msg": "Admins only"}, 403
 
+    before = (request.get_json(silent=True) or {}).get('before')
+    today = date.today()
+    if before is None:
+        before = (today - timedelta(days=current_app.config['ARCHIVE_AFTER_DAYS'])).isoformat()
+    try:
+        if not isinstance(before, str) or date.fromisoformat(before) > today:
+            raise ValueError
+    except ValueError:
+        return jsonify({'error': 'before must be a date (YYYY-MM-DD) no later than today'}), 400
+
+    def run(progress):
+        return archive.archive_events(db_pool, run_write, before, on_moved=event_archived, progress=progress)
+
     try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
-        cursor.execute('INSERT INTO Events (name, description, date, time, location, imageUrl) VALUES (?, ?, ?, ?, ?, ?)', 
-                       (name, description, date, time, location, imageUrl))
-        conn.commit()
-        conn.close()
-        return jsonify({'message': 'Event created successfully'}), 201
+        job_id = job_runner.submit('archive_events', run, details={'before': before})
+    except JobQueueFull as e:
+        return jsonify({'error': str(e)}), 503
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return write_error_response(e)
+    response = jsonify({'message': 'Archiving events', 'jobId': job_id, 'status': 'queued', 'before': before})
+    response.headers['Location'] = f'/admin/jobs/{job_id}'
+    return response, 202
+
+# Endpoint for admins to follow a background job. `status` is queued, running, done or failed; a
+# finished job has its `result` (for provision_event, the new event_id and timing) or `error`.
+@api.route('/admin/jobs/<job_id>', methods=['GET'])
+@jwt_required()
+def get_job(job_id):
+    claims = get_jwt()
 
-# Endpoint for purchasing reserved seats
-@app.route('/purchase_seats', methods=['POST'])
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    job = job_runner.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    return jsonify(job), 200
+
+# Endpoint for admins to list the most recent background jobs, newest first
+@api.route('/admin/jobs', methods=['GET'])
+@jwt_required()
+def list_jobs():
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    return jsonify({'jobs': job_runner.recent(), 'runner': job_runner.stats()}), 200
+
+# Endpoint for admins to see how busy the database connection pool is
+@api.route('/admin/db/pool', methods=['GET'])
+@jwt_required()
+def get_pool_stats():
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    return jsonify(db_pool.stats()), 200
+
+# Endpoint for admins to see how many abandoned holds the sweeper is reclaiming
+@api.route('/admin/holds/sweeper', methods=['GET'])
+@jwt_required()
+def get_hold_sweeper_stats():
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    return jsonify(hold_sweeper.stats()), 200
+
+# Endpoint for admins to see how well the seat map cache is working
+@api.route('/admin/cache/seats', methods=['GET'])
+@jwt_required()
+def get_seat_cache_stats():
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    return jsonify(seat_map_cache.stats()), 200
+
+# Endpoint for admins to see how often /profile pages are served from memory
+@api.route('/admin/cache/profiles', methods=['GET'])
+@jwt_required()
+def get_ticket_history_cache_stats():
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    return jsonify(ticket_history_cache.stats()), 200
+
+# Endpoint for admins to see how much memory the in-memory seat state uses and how long it took to load
+@api.route('/admin/seat-state', methods=['GET'])
+@jwt_required()
+def get_seat_state_stats():
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    return jsonify(seat_states.stats()), 200
+
+# Endpoint for admins to see how many browsers are watching seat streams
+@api.route('/admin/seat-streams', methods=['GET'])
+@jwt_required()
+def get_seat_stream_stats():
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    return jsonify(seat_changes.stats()), 200
+
+# Endpoint for admins to see how long this worker took to start and how often other workers
+# made its in-memory seat state stale
+@api.route('/admin/worker', methods=['GET'])
+@jwt_required()
+def get_worker_stats():
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    return jsonify({
+        'startup': current_app.config['STARTUP'],
+        'seatSync': seat_sync.stats() if seat_sync is not None else None
+    }), 200
+
+# Endpoint for admins to see how an event is selling: available, reserved and sold seats and revenue
+# per price tier. Served from the EventTierStats summary, so refreshing a dashboard during an on-sale
+# doesn't count tickets.
+@api.route('/admin/events/<int:event_id>/stats', methods=['GET'])
+@jwt_required()
+def get_event_stats(event_id):
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    with get_db_connection() as conn:
+        stats = event_stats(conn, event_id)
+
+    if stats is None:
+        return jsonify({'error': 'Event not found'}), 404
+    return jsonify(stats), 200
+
+# Endpoint for gate scanners. Checks a ticket barcode against the event's in-memory barcode index
+# and, the first time a good ticket is scanned, admits it. Takes {"barcode": ..., "gate": ...};
+# `result` is one of admitted, already_admitted, wrong_event, invalid or unknown.
+@api.route('/events/<int:event_id>/scan', methods=['POST'])
+@jwt_required()
+def scan_ticket(event_id):
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    data = request.get_json(silent=True) or {}
+    code = data.get('barcode')
+    gate = data.get('gate')
+    if not isinstance(code, str) or not code.strip() or not (gate is None or isinstance(gate, str)):
+        return jsonify({'error': 'barcode is required, and gate must be a string'}), 400
+    code = code.strip()
+
+    result, ticket = scan_index.scan(event_id, code, gate)
+    if result == ADMITTED:
+        # Marked in memory already; the conditional update also catches a scan at another worker
+        def operation(conn):
+            updated = conn.execute(
+                'UPDATE TicketSales SET admittedAt = ?, admittedGate = ? WHERE barcode = ? AND admittedAt IS NULL',
+                (ticket['admittedAt'], gate, code)).rowcount
+            return updated, None
+
+        try:
+            if not run_write(operation):
+                scan_index.admitted_elsewhere(event_id, code)
+                result, ticket = ALREADY_ADMITTED, {**ticket, 'admittedAt': None, 'gate': None}
+        except Exception as e:
+            scan_index.undo(event_id, code)
+            return write_error_response(e)
+
+    status = {ADMITTED: 200, ALREADY_ADMITTED: 409}.get(result, 404)
+    return jsonify({'result': result, **(ticket or {})}), status
+
+# Endpoint for admins to export an event's barcodes for offline scanners, as newline-delimited JSON
+# (or CSV) with one ticket per line. Rows are streamed, so memory stays flat for any size of event.
+@api.route('/admin/events/<int:event_id>/barcodes', methods=['GET'])
+@jwt_required()
+def export_barcodes(event_id):
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    with get_db_connection() as conn:
+        if conn.execute('SELECT 1 FROM Events WHERE event_id = ?', (event_id,)).fetchone() is None:
+            return jsonify({'error': 'Event not found'}), 404
+
+    export = Export('barcodes', 'TicketSales', ['barcode', 'rowName', 'seatNumber', 'admittedAt'], key='id',
+                    where='event_id = ?', params=(event_id,))
+    return export_response(export, f'event-{event_id}-barcodes')
+
+# Endpoint for admins to see how fast the streaming exports run: rows, bytes, time to first byte and
+# rows per second, per export
+@api.route('/admin/exports', methods=['GET'])
+@jwt_required()
+def get_export_stats():
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    return jsonify(export_stats.stats()), 200
+
+# Endpoint for admins to see how deep the seat writer's queue is and how many writes each commit carries
+@api.route('/admin/writer', methods=['GET'])
+@jwt_required()
+def get_writer_stats():
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    return jsonify(seat_writer.stats()), 200
+
+# Endpoint for admins to open or close an event's waiting room. `admitPerSecond` is how many buyers
+# each worker lets in per second; null closes the waiting room.
+@api.route('/admin/events/<int:event_id>/waiting-room', methods=['PUT'])
+@jwt_required()
+def set_waiting_room(event_id):
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    rate = (request.get_json(silent=True) or {}).get('admitPerSecond')
+    if rate is not None and (isinstance(rate, bool) or not isinstance(rate, (int, float)) or rate <= 0):
+        return jsonify({'error': 'admitPerSecond must be a positive number or null'}), 400
+
+    def operation(conn):
+        updated = conn.execute('UPDATE Events SET waitingRoomRate = ? WHERE event_id = ?', (rate, event_id)).rowcount
+        return updated, None
+
+    try:
+        if not run_write(operation):
+            return jsonify({'error': 'Event not found'}), 404
+        # Other workers pick the change up within a few seconds
+        waiting_room.forget(event_id)
+        return jsonify({'event_id': event_id, 'admitPerSecond': rate}), 200
+    except Exception as e:
+        return write_error_response(e)
+
+# Endpoint for admins to see waiting room queues and how often rate limits turned requests away
+@api.route('/admin/waiting-room', methods=['GET'])
+@jwt_required()
+def get_admission_stats():
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    return jsonify({
+        'waitingRoom': waiting_room.stats(),
+        'rateLimits': rate_limiter.stats()
+    }), 200
+
+# Endpoint for admins to see how often checkouts are being retried
+@api.route('/admin/checkout/idempotency', methods=['GET'])
+@jwt_required()
+def get_checkout_log_stats():
+    claims = get_jwt()
+
+    if claims.get("admin") != 1:
+        return {"msg": "Admins only"}, 403
+
+    return jsonify(checkout_log.stats()), 200
+
+# Endpoint for purchasing reserved seats. Send an Idempotency-Key header with a fresh value per
+# checkout and the same value on every retry of it; a replay gets the original result back.
+@api.route('/purchase_seats', methods=['POST'])
 @jwt_required()
 def purchase_seats():
     current_user_id = get_jwt_identity()
     event_id = request.json.get('event_id')
     seats = request.json.get('seats')  # List of {rowName, seatNumber} objects
+    idempotency_key = request.headers.get(IDEMPOTENCY_HEADER)
 
     if not event_id or not seats or not isinstance(seats, list):
         return jsonify({'error': 'event_id and seats list are required'}), 400
 
-    try:
-        conn = get_db_connection()
-        cursor = conn.cursor()
+    event_id = parse_event_id(event_id)
+    if event_id is None:
+        return jsonify({'error': 'event_id must be an integer'}), 400
 
-        # Process each seat
-        for seat in seats:
-            row_name = seat.get('rowName')
-            seat_number = seat.get('seatNumber')
-            
-            if not row_name or seat_number is None:
-                conn.close()
-                return jsonify({'error': 'Invalid seat format. rowName and seatNumber are required'}), 400
-
-            # Check if seat is RESERVED
-            cursor.execute('''
-                SELECT status FROM Tickets 
-                WHERE event_id = ? AND rowName = ? AND seatNumber = ?
-            ''', (event_id, row_name, seat_number))
-            
-            existing_ticket = cursor.fetchone()
-            
-            if not existing_ticket:
-                conn.close()
-                return jsonify({'error': f'Seat {row_name}{seat_number} does not exist'}), 404
-            
-            if existing_ticket['status'] != 'RESERVED':
-                conn.close()
-                return jsonify({'error': f'Seat {row_name}{seat_number} is not reserved'}), 400
+    seat_keys = parse_seats(seats)
+    if seat_keys is None:
+        return jsonify({'error': 'Invalid seat format. rowName and seatNumber are required'}), 400
 
-            # Generate barcode (event_id + row + seat number)
-            barcode = f'{event_id}{row_name}{seat_number}'
+    if idempotency_key is not None and not 0 < len(idempotency_key) <= MAX_KEY_LENGTH:
+        return jsonify({'error': f'{IDEMPOTENCY_HEADER} must be 1 to {MAX_KEY_LENGTH} characters'}), 400
+    fingerprint = request_fingerprint(event_id, seat_keys) if idempotency_key else None
 
-            # Create entry in TicketSales
-            cursor.execute('''
-                INSERT INTO TicketSales (event_id, rowName, seatNumber, userId, barcode, purchasedAt)
-                VALUES (?, ?, ?, ?, ?, ?)
-            ''', (event_id, row_name, seat_number, current_user_id, barcode, datetime.now()))
+    denied = admission_denied(event_id, current_user_id)
+    if denied:
+        return denied
 
-            # Update the ticket status to SOLD
-            cursor.execute('''
-                UPDATE Tickets 
-                SET status = 'SOLD'
-                WHERE event_id = ? AND rowName = ? AND seatNumber = ?
-            ''', (event_id, row_name, seat_number))
+    try:
+        # A retry of a checkout this process already completed is answered without the database
+        if idempotency_key:
+            replay = checkout_log.cached(current_user_id, idempotency_key, fingerprint)
+            if replay:
+                return replayed_response(replay)
 
-        conn.commit()
-        conn.close()
+        outcome, result = run_write(checkout_seats(event_id, seat_keys, current_user_id, idempotency_key, fingerprint))
+        if outcome == 'replay':
+            return replayed_response(result)
+        return jsonify(result[0]), result[1]
 
-        return jsonify({'message': f'{len(seats)} seats purchased successfully'}), 200
+    except IdempotencyConflict as e:
+        return jsonify({'error': str(e)}), 422
 
     except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return write_error_response(e)
+
+# Seat writer operation for a checkout. Resolves to ('replay', (status, body)) for a checkout that
+# already completed, or ('done', (body, status)) for a purchase or a conflict.
+def checkout_seats(event_id, seat_keys, user_id, idempotency_key, fingerprint):
+    def operation(conn):
+        # Completed by another worker, before a restart, or by a duplicate that got here first
+        if idempotency_key:
+            replay = checkout_log.lookup(conn, user_id, idempotency_key, fingerprint)
+            if replay:
+                return ('replay', replay), None
+
+        event = conn.execute('SELECT date, provisioning FROM Events WHERE event_id = ?', (event_id,)).fetchone()
+        if event is None or event['provisioning']:
+            raise Rollback(('done', ({'error': 'Event not found'}, 404)))
+
+        # Only the buyer holding the seats can check them out, and only until the hold expires
+        now = time.time()
+        missing, conflicts = transition_seats(conn, event_id, seat_keys, 'RESERVED', 'SOLD',
+                                              holder=(user_id, now))
+        if missing or conflicts:
+            raise Rollback(('done', hold_conflict_result(conn, event_id, missing, conflicts, user_id, now)))
+
+        purchased_at = datetime.now()
+        sales = [(event_id, row_name, seat_number, user_id, barcode_signer.issue(event_id), purchased_at,
+                  event['date'] or '')
+                 for row_name, seat_number in seat_keys]
+        conn.executemany('''
+            INSERT INTO TicketSales (event_id, rowName, seatNumber, userId, barcode, purchasedAt, eventDate)
+            VALUES (?, ?, ?, ?, ?, ?, ?)
+        ''', sales)
+
+        body = {
+            'message': f'{len(seat_keys)} seats purchased successfully',
+            'tickets': [{'rowName': sale[1], 'seatNumber': sale[2], 'barcode': sale[4]} for sale in sales]
+        }
+        if idempotency_key:
+            checkout_log.record(conn, user_id, idempotency_key, fingerprint, 200, body)
+
+        def on_commit():
+            if idempotency_key:
+                checkout_log.remember(user_id, idempotency_key, fingerprint, 200, body)
+            seats_changed(event_id, seat_keys, 'SOLD')
+            scan_index.add(event_id, [(sale[4], sale[1], sale[2]) for sale in sales])
+        return ('done', (body, 200)), on_commit
+    return operation
 
 if __name__ == '__main__':
-    app.run(port=8080, debug=True)
\ No newline at end of file
+    create_app().run(port=8080, debug=True)
\ No newline at end of file
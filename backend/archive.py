@@ -0,0 +1,214 @@
+"""Moves the tickets and sales of past events out of the live tables.
+
+``Tickets`` and ``TicketSales`` are what every on-sale reads and writes,
+so they only need upcoming events. Archiving moves an older event's rows
+to the same tables in a separate SQLite file, attached to every pooled
+connection as ``archive``; ``/profile`` reads buyers' past purchases from
+there.
+
+An event is moved in batches, each a short write on the seat writer, so
+seat writes for other events keep going in between. A batch first deletes
+from the live tables the rows the previous batch copied, then copies the
+next ones. SQLite doesn't commit attached WAL databases atomically, but
+this way a row only leaves the live tables once its copy was committed in
+an earlier transaction. A run that stops halfway can simply be run again.
+"""
+import os
+import time
+
+SCHEMA = "archive"
+
+# Rows moved per seat writer transaction
+DEFAULT_BATCH_SIZE = 2000
+
+TICKET_COLUMNS = ("event_id", "rowName", "seatNumber", "status", "priceTierId")
+SALE_COLUMNS = ("id", "event_id", "rowName", "seatNumber", "userId", "barcode", "purchasedAt",
+                "admittedAt", "admittedGate", "eventDate")
+
+
+def default_path(db_path):
+    """The archive file that goes with the live database at ``db_path``: ``tessera.db`` keeps its
+    archive in ``tessera-archive.db`` next to it."""
+    stem, ext = os.path.splitext(db_path)
+    return f"{stem}-archive{ext or '.db'}"
+
+
+def attach(conn, path):
+    """Attach the archive file to ``conn``, creating it if it doesn't exist."""
+    conn.execute(f"ATTACH DATABASE ? AS {SCHEMA}", (path,))
+    # The live tables give a row up once its copy has committed, so the copy has to be on disk
+    conn.execute(f"PRAGMA {SCHEMA}.synchronous = FULL")
+
+
+def create_schema(conn):
+    """Create the archive tables on a connection the archive is attached to."""
+    conn.execute(f"PRAGMA {SCHEMA}.journal_mode = WAL")
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA}.Tickets (
+            event_id INTEGER NOT NULL,
+            rowName TEXT NOT NULL,
+            seatNumber INTEGER NOT NULL,
+            status TEXT NOT NULL,
+            priceTierId INTEGER NOT NULL,
+            PRIMARY KEY (event_id, rowName, seatNumber)
+        ) WITHOUT ROWID
+    """)
+    # Keyed by barcode rather than id: ids of deleted live sales can be handed out again
+    conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {SCHEMA}.TicketSales (
+            id INTEGER NOT NULL,
+            event_id INTEGER NOT NULL,
+            rowName TEXT NOT NULL,
+            seatNumber INTEGER NOT NULL,
+            userId INTEGER NOT NULL,
+            barcode TEXT PRIMARY KEY,
+            purchasedAt DATETIME NOT NULL,
+            admittedAt REAL,
+            admittedGate TEXT,
+            eventDate TEXT NOT NULL DEFAULT ''
+        ) WITHOUT ROWID
+    """)
+    # Archives made before sales carried their event's date
+    columns = [row[1] for row in conn.execute(f"PRAGMA {SCHEMA}.table_info(TicketSales)")]
+    if "eventDate" not in columns:
+        conn.execute(f"ALTER TABLE {SCHEMA}.TicketSales ADD COLUMN eventDate TEXT NOT NULL DEFAULT ''")
+        conn.execute(f"""
+            UPDATE {SCHEMA}.TicketSales
+            SET eventDate = COALESCE((SELECT date FROM main.Events e WHERE e.event_id = TicketSales.event_id), '')
+        """)
+    conn.execute(f"DROP INDEX IF EXISTS {SCHEMA}.idx_archive_sales_user")
+    # Same order as the live idx_ticketsales_history, for /profile (tickethistory.py)
+    conn.execute(f"""
+        CREATE INDEX IF NOT EXISTS {SCHEMA}.idx_archive_sales_history
+        ON TicketSales(userId, eventDate, event_id, rowName, seatNumber, id, purchasedAt)
+    """)
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {SCHEMA}.idx_archive_sales_event ON TicketSales(event_id)")
+    conn.commit()
+
+
+def archivable_events(conn, before):
+    """Events dated before ``before`` (YYYY-MM-DD) that still have rows in the live tables.
+
+    Events still being provisioned are left for provisioning to finish or remove.
+    """
+    rows = conn.execute("""
+        SELECT event_id FROM Events e
+        WHERE date < ? AND provisioning = 0
+          AND (EXISTS (SELECT 1 FROM main.Tickets t WHERE t.event_id = e.event_id)
+               OR EXISTS (SELECT 1 FROM main.TicketSales s WHERE s.event_id = e.event_id))
+        ORDER BY date, event_id
+    """, (before,)).fetchall()
+    return [row[0] for row in rows]
+
+
+def move_batch(conn, event_id, limit):
+    """Run one batch for an event inside a write transaction.
+
+    Returns ``(sales, tickets, copied)``: the sales and tickets deleted from
+    the live tables, which the previous batch had copied, and how many rows
+    this batch copied. The event is done once a batch copies nothing.
+    """
+    conn.execute("UPDATE Events SET archivedAt = COALESCE(archivedAt, ?) WHERE event_id = ?",
+                 (time.time(), event_id))
+
+    # Both deletes walk the event's rows in the order they were copied and stop after `limit`
+    sales = conn.execute(f"""
+        DELETE FROM main.TicketSales WHERE id IN (
+            SELECT id FROM main.TicketSales s
+            WHERE event_id = ? AND EXISTS (SELECT 1 FROM {SCHEMA}.TicketSales a WHERE a.barcode = s.barcode)
+            ORDER BY id LIMIT ?
+        )
+    """, (event_id, limit)).rowcount
+    tickets = conn.execute(f"""
+        DELETE FROM main.Tickets WHERE rowid IN (
+            SELECT rowid FROM main.Tickets t
+            WHERE event_id = ? AND EXISTS (
+                SELECT 1 FROM {SCHEMA}.Tickets a
+                WHERE a.event_id = t.event_id AND a.rowName = t.rowName AND a.seatNumber = t.seatNumber
+            )
+            ORDER BY rowName, seatNumber LIMIT ?
+        )
+    """, (event_id, limit)).rowcount
+    if tickets:
+        # Other workers drop the event's seat state when its version moves
+        conn.execute("""
+            INSERT INTO SeatVersions (event_id, version) VALUES (?, 1)
+            ON CONFLICT (event_id) DO UPDATE SET version = version + 1
+        """, (event_id,))
+
+    columns = ", ".join(SALE_COLUMNS)
+    copied = conn.execute(f"""
+        INSERT OR IGNORE INTO {SCHEMA}.TicketSales ({columns})
+        SELECT {columns} FROM main.TicketSales WHERE event_id = ? ORDER BY id LIMIT ?
+    """, (event_id, limit)).rowcount
+    if copied < limit:
+        columns = ", ".join(TICKET_COLUMNS)
+        copied += conn.execute(f"""
+            INSERT OR IGNORE INTO {SCHEMA}.Tickets ({columns})
+            SELECT {columns} FROM main.Tickets WHERE event_id = ? ORDER BY rowName, seatNumber LIMIT ?
+        """, (event_id, limit - copied)).rowcount
+    return sales, tickets, copied
+
+
+def _file_bytes(path):
+    # Recent writes are in the -wal file until a checkpoint copies them over
+    return sum(os.path.getsize(name) for name in (path, path + "-wal") if os.path.exists(name))
+
+
+def live_sizes(conn):
+    """Rows left in the live tables, and the size of both database files.
+
+    Deleting rows doesn't shrink the live file; SQLite reuses the freed
+    pages, which ``freeBytes`` counts, for new events.
+    """
+    page_size = conn.execute("PRAGMA main.page_size").fetchone()[0]
+    free_pages = conn.execute("PRAGMA main.freelist_count").fetchone()[0]
+    archive_path = conn.execute(f"SELECT file FROM pragma_database_list WHERE name = '{SCHEMA}'").fetchone()[0]
+    return {
+        "tickets": conn.execute("SELECT COUNT(*) FROM main.Tickets").fetchone()[0],
+        "sales": conn.execute("SELECT COUNT(*) FROM main.TicketSales").fetchone()[0],
+        "databaseBytes": conn.execute("PRAGMA main.page_count").fetchone()[0] * page_size,
+        "freeBytes": free_pages * page_size,
+        "archiveBytes": _file_bytes(archive_path) if archive_path else None,
+    }
+
+
+def archive_events(pool, write, before, batch_size=DEFAULT_BATCH_SIZE, on_moved=None, progress=None):
+    """Move every event dated before ``before`` to the archive.
+
+    ``write`` runs a seat writer operation and waits for it (``run_write``
+    in app.py). ``on_moved(event_id)`` is called after each batch that took
+    tickets out of the live table, with the seat write lock held.
+    """
+    started = time.perf_counter()
+    with pool.connection() as conn:
+        events = archivable_events(conn, before)
+
+    moved = {"sales": 0, "tickets": 0}
+    for number, event_id in enumerate(events, 1):
+        while True:
+            def operation(conn):
+                result = move_batch(conn, event_id, batch_size)
+                on_commit = (lambda: on_moved(event_id)) if on_moved is not None and result[1] else None
+                return result, on_commit
+
+            sales, tickets, copied = write(operation)
+            moved["sales"] += sales
+            moved["tickets"] += tickets
+            if not copied:
+                break
+        if progress is not None:
+            progress(f"{number}/{len(events)} events archived, {moved['tickets']} tickets and "
+                     f"{moved['sales']} sales moved")
+
+    seconds = time.perf_counter() - started
+    with pool.connection() as conn:
+        live = live_sizes(conn)
+    return {
+        "before": before,
+        "events": events,
+        **moved,
+        "seconds": round(seconds, 3),
+        "rowsPerSecond": round((moved["sales"] + moved["tickets"]) / seconds) if seconds else None,
+        "live": live,
+    }
@@ -0,0 +1,454 @@
+"""On-sale load test for the Flask backend.
+
+Provisions a synthetic venue into a throwaway copy of the schema, then has
+many concurrent simulated buyers load the seat map, reserve seats and buy
+them, the way a popular on-sale looks. Reports throughput, latency
+percentiles per endpoint, database lock/busy errors, and checks that no
+seat was sold twice.
+
+Run from backend/:
+
+    python bench.py --buyers 50 --duration 20
+    python bench.py --transport http --layout layouts/arena.json --out after.json
+    python bench.py --compare before.json after.json
+"""
+import argparse
+import http.client
+import json
+import os
+import random
+import shutil
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+
+SCHEMA_SOURCE = "../database/tessera.db"
+
+
+# Tables SQLite creates behind an FTS5 table, which creating the virtual table makes again
+FTS_SHADOW_SUFFIXES = ("_data", "_idx", "_docsize", "_config", "_content")
+
+
+def clone_schema(source_path, target_path):
+    """Create an empty database with the same tables and indexes as ``source_path``.
+
+    The migrations the source has applied are copied too, so starting the
+    app on the copy doesn't apply them again.
+    """
+    source = sqlite3.connect(f"file:{source_path}?mode=ro", uri=True)
+    target = sqlite3.connect(target_path)
+    try:
+        virtual = [name for (name,) in source.execute(
+            "SELECT name FROM sqlite_master WHERE type = 'table' AND sql LIKE 'CREATE VIRTUAL TABLE%'"
+        )]
+        shadows = {name + suffix for name in virtual for suffix in FTS_SHADOW_SUFFIXES}
+        statements = source.execute("""
+            SELECT name, sql FROM sqlite_master
+            WHERE sql IS NOT NULL AND name NOT LIKE 'sqlite_%'
+            ORDER BY type = 'table' DESC, rowid
+        """).fetchall()
+        for name, sql in statements:
+            if name not in shadows:
+                target.execute(sql)
+        if "SchemaMigrations" in {name for name, _ in statements}:
+            target.executemany(
+                "INSERT INTO SchemaMigrations (version, name, appliedAt) VALUES (?, ?, ?)",
+                source.execute("SELECT version, name, appliedAt FROM SchemaMigrations").fetchall(),
+            )
+        target.commit()
+    finally:
+        source.close()
+        target.close()
+
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+class TestClientTransport:
+    """Drives the app in-process through Flask's test client."""
+
+    def __init__(self, app):
+        self.app = app
+        self._local = threading.local()
+
+    def request(self, method, path, body=None, headers=None):
+        client = getattr(self._local, "client", None)
+        if client is None:
+            client = self._local.client = self.app.test_client()
+        response = client.open(path, method=method, json=body, headers=headers or {})
+        return response.status_code, response.headers, response.get_data()
+
+    def close(self):
+        pass
+
+
+class HttpTransport:
+    """Drives the app over real HTTP, through a local threaded server unless a URL is given."""
+
+    def __init__(self, app=None, url=None):
+        self.server = None
+        if url is None:
+            from werkzeug.serving import make_server
+            self.server = make_server("127.0.0.1", 0, app, threaded=True)
+            threading.Thread(target=self.server.serve_forever, daemon=True).start()
+            self.host, self.port = "127.0.0.1", self.server.server_port
+        else:
+            host, _, port = url.split("://", 1)[-1].rstrip("/").partition(":")
+            self.host, self.port = host, int(port or 80)
+
+    def request(self, method, path, body=None, headers=None):
+        headers = dict(headers or {})
+        payload = None
+        if body is not None:
+            payload = json.dumps(body).encode()
+            headers["Content-Type"] = "application/json"
+        conn = http.client.HTTPConnection(self.host, self.port, timeout=60)
+        try:
+            conn.request(method, path, body=payload, headers=headers)
+            response = conn.getresponse()
+            return response.status, response.headers, response.read()
+        finally:
+            conn.close()
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+
+
+class Recorder:
+    """Thread-safe latency and outcome collection per endpoint."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(lambda: defaultdict(int))
+        self.db_errors = defaultdict(int)
+
+    def record(self, endpoint, status, seconds, body):
+        with self._lock:
+            self.latencies[endpoint].append(seconds)
+            self.statuses[endpoint][status] += 1
+            if status >= 500:
+                text = body.decode(errors="replace").lower()
+                if "locked" in text:
+                    self.db_errors["locked"] += 1
+                elif "busy" in text:
+                    self.db_errors["busy"] += 1
+                elif "no database connection available" in text:
+                    self.db_errors["poolExhausted"] += 1
+                else:
+                    self.db_errors["other5xx"] += 1
+
+    def summary(self, elapsed):
+        endpoints = {}
+        for endpoint, values in self.latencies.items():
+            values = sorted(values)
+            endpoints[endpoint] = {
+                "requests": len(values),
+                "throughputPerSecond": round(len(values) / elapsed, 2),
+                "statuses": {str(code): count for code, count in sorted(self.statuses[endpoint].items())},
+                "p50Ms": round(percentile(values, 0.50) * 1000, 3),
+                "p95Ms": round(percentile(values, 0.95) * 1000, 3),
+                "p99Ms": round(percentile(values, 0.99) * 1000, 3),
+                "maxMs": round(values[-1] * 1000, 3),
+                "meanMs": round(sum(values) / len(values) * 1000, 3),
+            }
+        return endpoints
+
+
+class Buyer(threading.Thread):
+    """Loads the seat map, reserves a few of the best seats left and buys them, until sold out."""
+
+    def __init__(self, index, transport, recorder, event_id, token, args, deadline, rng):
+        super().__init__(name=f"buyer-{index}", daemon=True)
+        self.index = index
+        self.transport = transport
+        self.recorder = recorder
+        self.event_id = event_id
+        self.auth = {"Authorization": f"Bearer {token}"}
+        self.args = args
+        self.deadline = deadline
+        self.rng = rng
+        self.purchased = []
+        self.orders = 0
+        self.conflicts = 0
+        self._etag = None
+        self._available = []
+
+    def call(self, endpoint, method, path, body=None, headers=None):
+        started = time.perf_counter()
+        status, response_headers, data = self.transport.request(method, path, body, headers)
+        self.recorder.record(endpoint, status, time.perf_counter() - started, data)
+        return status, response_headers, data
+
+    def load_seat_map(self):
+        headers = {"If-None-Match": self._etag} if self._etag else {}
+        status, response_headers, data = self.call(
+            "GET seats-with-prices", "GET", f"/events/{self.event_id}/seats-with-prices", headers=headers)
+        if status == 200:
+            self._etag = response_headers.get("ETag")
+            seat_map = json.loads(data)
+            self._available = [
+                (row, seat["seatNumber"])
+                for row, seats in seat_map.items()
+                for seat in seats
+                if seat["status"] == "AVAILABLE"
+            ]
+
+    def pick_seats(self):
+        # Everyone goes for the best seats left, so buyers collide like a real on-sale
+        candidates = self._available[:self.args.hotspot]
+        count = min(self.args.seats_per_order, len(candidates))
+        return self.rng.sample(candidates, count) if count else []
+
+    def run(self):
+        while time.perf_counter() < self.deadline:
+            self.load_seat_map()
+            seats = self.pick_seats()
+            if not seats:
+                return
+            body = {
+                "event_id": self.event_id,
+                "seats": [{"rowName": row, "seatNumber": number} for row, number in seats],
+            }
+            status, _, _ = self.call("POST reserve_seats", "POST", "/reserve_seats", body, self.auth)
+            if status != 200:
+                self.conflicts += 1
+                continue
+            status, _, _ = self.call("POST purchase_seats", "POST", "/purchase_seats", body, self.auth)
+            if status == 200:
+                self.orders += 1
+                self.purchased.extend(seats)
+
+
+def check_integrity(db_path, event_id, buyers):
+    """Compare what buyers were told they bought with what the database recorded."""
+    conn = sqlite3.connect(db_path)
+    try:
+        duplicate_sales = conn.execute("""
+            SELECT COUNT(*) FROM (
+                SELECT 1 FROM TicketSales WHERE event_id = ?
+                GROUP BY rowName, seatNumber HAVING COUNT(*) > 1
+            )
+        """, (event_id,)).fetchone()[0]
+        sales = {
+            (row, seat): user_id
+            for row, seat, user_id in conn.execute(
+                "SELECT rowName, seatNumber, userId FROM TicketSales WHERE event_id = ?", (event_id,))
+        }
+        not_marked_sold = conn.execute("""
+            SELECT COUNT(*) FROM TicketSales ts
+            JOIN Tickets t ON t.event_id = ts.event_id AND t.rowName = ts.rowName
+                AND t.seatNumber = ts.seatNumber
+            WHERE ts.event_id = ? AND t.status != 'SOLD'
+        """, (event_id,)).fetchone()[0]
+    finally:
+        conn.close()
+
+    confirmed = defaultdict(list)
+    for buyer in buyers:
+        for seat in buyer.purchased:
+            confirmed[seat].append(buyer.index)
+
+    oversold = sum(1 for owners in confirmed.values() if len(owners) > 1)
+    wrong_owner = sum(
+        1 for seat, owners in confirmed.items() if sales.get(seat) not in [owner + 1 for owner in owners]
+    )
+    return {
+        "confirmedSeats": sum(len(owners) for owners in confirmed.values()),
+        "recordedSales": len(sales),
+        "oversoldSeats": oversold,
+        "duplicateSales": duplicate_sales,
+        "confirmedButNotRecorded": wrong_owner,
+        "salesNotMarkedSold": not_marked_sold,
+        "ok": oversold == 0 and duplicate_sales == 0 and wrong_owner == 0 and not_marked_sold == 0
+              and len(sales) == sum(len(owners) for owners in confirmed.values()),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    from dotenv import load_dotenv
+    from flask import Flask
+    from flask_jwt_extended import JWTManager, create_access_token
+    from provisioning import grid_layout, provision_event
+    from script import connect
+
+    workdir = None
+    if args.url:
+        # The server owns its database; the benchmark event goes into it and is checked there
+        db_path = args.db
+        load_dotenv()
+        app = Flask(__name__)
+        app.config["JWT_SECRET_KEY"] = os.getenv("JWT_SECRET_KEY")
+        JWTManager(app)
+    else:
+        from app import create_app
+        workdir = tempfile.mkdtemp(prefix="tessera-bench-")
+        db_path = os.path.join(workdir, "tessera.db")
+        clone_schema(args.schema_from, db_path)
+        # Migrates the copy, so it must come before provisioning. Buyers all come from one
+        # address and buy far faster than people do, so the rate limits are off.
+        app = create_app({"TESSERA_DB_PATH": db_path,
+                          "ARCHIVE_DB_PATH": os.path.join(workdir, "tessera-archive.db"),
+                          "DB_POOL_SIZE": args.pool_size,
+                          "RATE_LIMIT_USER_PER_SECOND": 0, "RATE_LIMIT_IP_PER_SECOND": 0})
+
+    if args.layout:
+        with open(args.layout) as f:
+            layout = json.load(f)
+    else:
+        layout = grid_layout(args.rows, args.seats_per_row)
+
+    conn = connect(db_path)
+    conn.execute("BEGIN IMMEDIATE")
+    provisioned = provision_event(conn, {"name": "Benchmark On-Sale"}, layout)
+    conn.commit()
+    conn.close()
+    event_id = provisioned["event_id"]
+
+    with app.app_context():
+        tokens = [create_access_token(identity=i + 1, additional_claims={"admin": 0})
+                  for i in range(args.buyers)]
+
+    if args.transport == "http":
+        transport = HttpTransport(app, url=args.url)
+    else:
+        transport = TestClientTransport(app)
+
+    recorder = Recorder()
+    rng = random.Random(args.seed)
+    started = time.perf_counter()
+    deadline = started + args.duration
+    buyers = [
+        Buyer(i, transport, recorder, event_id, tokens[i], args, deadline, random.Random(rng.random()))
+        for i in range(args.buyers)
+    ]
+    for buyer in buyers:
+        buyer.start()
+    for buyer in buyers:
+        buyer.join()
+    elapsed = time.perf_counter() - started
+    transport.close()
+
+    endpoints = recorder.summary(elapsed)
+    integrity = check_integrity(db_path, event_id, buyers)
+    if workdir and not args.keep_db:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    total_requests = sum(endpoint["requests"] for endpoint in endpoints.values())
+    return {
+        "startedAt": datetime.now(timezone.utc).isoformat(),
+        "revision": git_revision(),
+        "config": {
+            "transport": args.transport,
+            "buyers": args.buyers,
+            "durationLimitSeconds": args.duration,
+            "seatsPerOrder": args.seats_per_order,
+            "hotspot": args.hotspot,
+            "poolSize": args.pool_size,
+            "seats": provisioned["tickets"],
+            "layout": args.layout or f"{args.rows}x{args.seats_per_row} grid",
+            "seed": args.seed,
+        },
+        "elapsedSeconds": round(elapsed, 3),
+        "requests": total_requests,
+        "requestsPerSecond": round(total_requests / elapsed, 2),
+        "ordersCompleted": sum(buyer.orders for buyer in buyers),
+        "ordersPerSecond": round(sum(buyer.orders for buyer in buyers) / elapsed, 2),
+        "reservationConflicts": sum(buyer.conflicts for buyer in buyers),
+        "databaseErrors": dict(recorder.db_errors),
+        "endpoints": endpoints,
+        "database": db_path if args.keep_db or args.url else None,
+        "integrity": integrity,
+    }
+
+
+def compare(before_path, after_path):
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    def line(label, old, new):
+        if old is None or new is None:
+            change = ""
+        elif old:
+            change = f"{(new - old) / old * 100:+.1f}%"
+        else:
+            change = ""
+        print(f"  {label:<32} {old!s:>12} {new!s:>12} {change:>9}")
+
+    print(f"  {'':<32} {before.get('revision') or 'before':>12} {after.get('revision') or 'after':>12}")
+    line("requests/s", before["requestsPerSecond"], after["requestsPerSecond"])
+    line("orders/s", before["ordersPerSecond"], after["ordersPerSecond"])
+    line("database errors", sum(before["databaseErrors"].values()), sum(after["databaseErrors"].values()))
+    for endpoint in sorted(set(before["endpoints"]) | set(after["endpoints"])):
+        for stat in ("p50Ms", "p95Ms", "p99Ms"):
+            line(f"{endpoint} {stat}",
+                 before["endpoints"].get(endpoint, {}).get(stat),
+                 after["endpoints"].get(endpoint, {}).get(stat))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tessera on-sale load test")
+    parser.add_argument("--buyers", type=int, default=50, help="concurrent simulated buyers")
+    parser.add_argument("--duration", type=float, default=20, help="stop after this many seconds")
+    parser.add_argument("--seats-per-order", type=int, default=4)
+    parser.add_argument("--hotspot", type=int, default=200,
+                        help="buyers pick among this many best available seats")
+    parser.add_argument("--rows", type=int, default=40)
+    parser.add_argument("--seats-per-row", type=int, default=50)
+    parser.add_argument("--layout", help="venue layout JSON file instead of a grid")
+    parser.add_argument("--transport", choices=("client", "http"), default="client",
+                        help="Flask test client in-process, or real HTTP to a local server")
+    parser.add_argument("--url", help="with --transport http, drive this already running server")
+    parser.add_argument("--db", help="with --url, the database that server uses")
+    parser.add_argument("--pool-size", type=int, default=8)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--schema-from", default=SCHEMA_SOURCE, help="database to copy the schema from")
+    parser.add_argument("--keep-db", action="store_true", help="keep the benchmark database for inspection")
+    parser.add_argument("--out", help="write the JSON results here instead of stdout")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files")
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+    if args.url and (args.transport != "http" or not args.db):
+        parser.error("--url needs --transport http and --db")
+
+    results = run(args)
+    output = json.dumps(results, indent=2)
+    if args.out:
+        with open(args.out, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+
+    integrity = results["integrity"]
+    print(f"{results['requestsPerSecond']} req/s, {results['ordersPerSecond']} orders/s, "
+          f"{sum(results['databaseErrors'].values())} database errors, "
+          f"integrity {'ok' if integrity['ok'] else 'FAILED'}", file=sys.stderr)
+    return 0 if integrity["ok"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,164 @@
+import bisect
+from collections import namedtuple
+
+# Blocks larger than this aren't searched for; groups that size book through the seat map
+MAX_BLOCK_SIZE = 20
+
+SeatBlock = namedtuple("SeatBlock", "row_name seat_numbers tier price_cents")
+
+
+class RowSegment:
+    """A run of consecutively numbered seats in one row that share a price tier.
+
+    Available seats are kept as sorted, disjoint intervals in two parallel
+    lists, so taking or freeing a seat is a bisect plus at most one list
+    insert or delete.
+    """
+
+    __slots__ = ("row_name", "rank", "center", "first", "last", "tier", "price_cents",
+                 "starts", "ends", "_longest")
+
+    def __init__(self, row_name, rank, center, first, last, tier, price_cents):
+        self.row_name = row_name
+        self.rank = rank
+        self.center = center
+        self.first = first
+        self.last = last
+        self.tier = tier
+        self.price_cents = price_cents
+        self.starts = []
+        self.ends = []
+        self._longest = 0
+
+    def take(self, seat_number):
+        i = bisect.bisect_right(self.starts, seat_number) - 1
+        if i < 0 or self.ends[i] < seat_number:
+            return
+        start, end = self.starts[i], self.ends[i]
+        if start == end:
+            del self.starts[i]
+            del self.ends[i]
+        elif seat_number == start:
+            self.starts[i] = seat_number + 1
+        elif seat_number == end:
+            self.ends[i] = seat_number - 1
+        else:
+            self.ends[i] = seat_number - 1
+            self.starts.insert(i + 1, seat_number + 1)
+            self.ends.insert(i + 1, end)
+        self._longest = None
+
+    def free(self, seat_number):
+        i = bisect.bisect_right(self.starts, seat_number)
+        if i > 0 and self.ends[i - 1] >= seat_number:
+            return
+        joins_left = i > 0 and self.ends[i - 1] == seat_number - 1
+        joins_right = i < len(self.starts) and self.starts[i] == seat_number + 1
+        if joins_left and joins_right:
+            self.ends[i - 1] = self.ends[i]
+            del self.starts[i]
+            del self.ends[i]
+        elif joins_left:
+            self.ends[i - 1] = seat_number
+        elif joins_right:
+            self.starts[i] = seat_number
+        else:
+            self.starts.insert(i, seat_number)
+            self.ends.insert(i, seat_number)
+            if self._longest is not None:
+                self._longest = max(self._longest, 1)
+            return
+        self._longest = None
+
+    def longest(self):
+        # Recomputed lazily: a burst of changes costs one pass when next searched
+        if self._longest is None:
+            self._longest = max((end - start + 1 for start, end in zip(self.starts, self.ends)), default=0)
+        return self._longest
+
+    def place(self, count):
+        """Return (distance from the row's middle, first seat) for the best block, or None."""
+        best = None
+        for start, end in zip(self.starts, self.ends):
+            if end - start + 1 < count:
+                continue
+            ideal = round(self.center - (count - 1) / 2)
+            first = min(max(ideal, start), end - count + 1)
+            distance = abs(first + (count - 1) / 2 - self.center)
+            if best is None or distance < best[0]:
+                best = (distance, first)
+        return best
+
+
+class FreeSeatIndex:
+    """Free-interval index over an event's available seats, for best-available search.
+
+    Rows are split into ``RowSegment``s wherever the seat numbering has a
+    gap or the price tier changes, so a block never spans an aisle or two
+    prices. Segments are ranked by the order their rows were provisioned
+    in, which follows the layout from the front of the venue to the back.
+    """
+
+    def __init__(self, segments):
+        self.segments = sorted(segments, key=lambda segment: (segment.rank, segment.first))
+        self._by_row = {}
+        for segment in self.segments:
+            self._by_row.setdefault(segment.row_name, []).append(segment)
+
+    def _segment(self, row_name, seat_number):
+        for segment in self._by_row.get(row_name, ()):
+            if segment.first <= seat_number <= segment.last:
+                return segment
+        return None
+
+    def take(self, row_name, seat_number):
+        segment = self._segment(row_name, seat_number)
+        if segment is not None:
+            segment.take(seat_number)
+
+    def free(self, row_name, seat_number):
+        segment = self._segment(row_name, seat_number)
+        if segment is not None:
+            segment.free(seat_number)
+
+    def find(self, count, max_price_cents=None, tiers=None):
+        """Return the best ``SeatBlock`` of ``count`` adjacent available seats, or None.
+
+        Best means the front-most row with room, and within it the block
+        closest to the middle of the row. ``tiers`` restricts the search to
+        those tier names and ranks them in the order given, ahead of rows.
+        """
+        segments = self.segments
+        if tiers:
+            preference = {name: position for position, name in enumerate(tiers)}
+            segments = sorted(
+                (segment for segment in segments if segment.tier in preference),
+                key=lambda segment: preference[segment.tier],
+            )
+
+        best = None
+        best_group = None
+        for segment in segments:
+            group = (segment.tier if tiers else None, segment.rank)
+            if best is not None and group != best_group:
+                # Every segment of the winning row has been considered
+                break
+            if max_price_cents is not None and segment.price_cents > max_price_cents:
+                continue
+            if segment.longest() < count:
+                continue
+            placed = segment.place(count)
+            if best is None or placed[0] < best[0]:
+                best = (placed[0], placed[1], segment)
+                best_group = group
+
+        if best is None:
+            return None
+        _, first, segment = best
+        return SeatBlock(segment.row_name, list(range(first, first + count)), segment.tier, segment.price_cents)
+
+    def stats(self):
+        return {
+            "segments": len(self.segments),
+            "freeIntervals": sum(len(segment.starts) for segment in self.segments),
+        }
@@ -0,0 +1,179 @@
+import base64
+import json
+import re
+
+# Columns clients may ask for with ?fields=. event_id is always returned.
+EVENT_COLUMNS = ("event_id", "name", "description", "date", "time", "location", "imageUrl")
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+DEFAULT_SEARCH_PAGE_SIZE = 20
+MAX_SEARCH_TERMS = 8
+
+_SEARCH_TERM = re.compile(r"\w+")
+
+
+class InvalidQuery(ValueError):
+    pass
+
+
+def encode_cursor(date, event_id):
+    raw = json.dumps([date, event_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        date, event_id = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise InvalidQuery("cursor is not valid")
+    if not isinstance(event_id, int) or not (date is None or isinstance(date, str)):
+        raise InvalidQuery("cursor is not valid")
+    return date, event_id
+
+
+def parse_fields(fields):
+    """Turn ?fields=a,b into the list of columns to return."""
+    if not fields:
+        return list(EVENT_COLUMNS)
+    requested = [field.strip() for field in fields.split(",") if field.strip()]
+    unknown = [field for field in requested if field not in EVENT_COLUMNS]
+    if unknown:
+        raise InvalidQuery(f"unknown fields: {', '.join(unknown)}")
+    return ["event_id"] + [field for field in requested if field != "event_id"]
+
+
+def parse_limit(limit, default=DEFAULT_PAGE_SIZE):
+    if limit is None:
+        return default
+    try:
+        limit = int(limit)
+    except ValueError:
+        raise InvalidQuery("limit must be an integer")
+    if limit < 1:
+        raise InvalidQuery("limit must be positive")
+    return min(limit, MAX_PAGE_SIZE)
+
+
+def events_page_query(columns, after_date=None, location=None, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """Build the SQL for one page of events ordered by (date, event_id).
+
+    One extra row is fetched so the caller can tell whether there is a
+    next page.
+    """
+    selected = list(columns)
+    if "date" not in selected:
+        selected.append("date")
+
+    # Events still being provisioned aren't listed until all their seats are in
+    conditions = ["provisioning = 0"]
+    params = []
+    last_date = last_id = None
+    if cursor:
+        last_date, last_id = decode_cursor(cursor)
+        # Only one lower bound on date can drive the index seek, so keep
+        # whichever of afterDate and the cursor starts later; it implies the other.
+        if after_date and (last_date is None or last_date <= after_date):
+            cursor = None
+        else:
+            after_date = None
+
+    if after_date:
+        conditions.append("date > ?")
+        params.append(after_date)
+    if location:
+        conditions.append("location = ?")
+        params.append(location)
+    if cursor:
+        if last_date is None:
+            # Undated events sort first; move on through them, then everything dated
+            conditions.append("((date IS NULL AND event_id > ?) OR date IS NOT NULL)")
+            params.append(last_id)
+        else:
+            conditions.append("(date, event_id) > (?, ?)")
+            params.extend([last_date, last_id])
+
+    query = f"SELECT {', '.join(selected)} FROM Events WHERE {' AND '.join(conditions)}"
+    query += " ORDER BY date, event_id LIMIT ?"
+    params.append(limit + 1)
+    return query, params
+
+
+def match_expression(q, location=None):
+    """Turn a search box query into an FTS5 MATCH expression, or None if it has no words.
+
+    Every word must match and the last one may be the start of a word, so
+    results keep up while the user is typing: "jazz fest" finds "Jazz
+    Festival". Only the last word is a prefix because FTS5 collects every
+    match of a prefix up front, where whole words are read lazily. Words are
+    quoted, which keeps FTS5 operators and punctuation typed by users from
+    being parsed as query syntax. A one-letter last word matches that word
+    only; as a prefix it would match most events.
+
+    With ``location``, events must also have it as a phrase in their
+    location column, which lets the index narrow them down before the
+    exact ``location = ?`` check.
+    """
+    terms = _SEARCH_TERM.findall((q or "").lower())[:MAX_SEARCH_TERMS]
+    if not terms:
+        return None
+    phrases = [f'"{term}"' for term in terms]
+    if len(terms[-1]) > 1:
+        phrases[-1] += "*"
+    location_terms = _SEARCH_TERM.findall((location or "").lower())
+    if location_terms:
+        phrases.append(f'location : "{" ".join(location_terms)}"')
+    return " ".join(phrases)
+
+
+def encode_search_cursor(offset):
+    return base64.urlsafe_b64encode(json.dumps(["search", offset]).encode()).decode().rstrip("=")
+
+
+def decode_search_cursor(cursor):
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        kind, offset = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise InvalidQuery("cursor is not valid")
+    if kind != "search" or not isinstance(offset, int) or offset < 0:
+        raise InvalidQuery("cursor is not valid")
+    return offset
+
+
+def search_query(columns, q, after_date=None, location=None, cursor=None, limit=DEFAULT_SEARCH_PAGE_SIZE):
+    """Build the SQL for one page of search results, best match first.
+
+    Relevance is bm25 as configured on the EventSearch index, over every
+    event that matches and passes the filters. SQLite keeps only the best
+    ``offset + limit`` of them while it scores, so a page costs one pass
+    over the matches and little memory however broad the query.
+
+    Pages are by offset: ranks shift as events are added, so a keyset on
+    them wouldn't hold still between pages. Returns ``(query, params,
+    offset)``; as with ``events_page_query()``, one extra row is fetched.
+    """
+    expression = match_expression(q, location)
+    if expression is None:
+        raise InvalidQuery("q must contain at least one word")
+    offset = decode_search_cursor(cursor) if cursor else 0
+
+    conditions = ["EventSearch MATCH ?", "e.provisioning = 0"]
+    params = [expression]
+    if after_date:
+        conditions.append("e.date > ?")
+        params.append(after_date)
+    if location:
+        conditions.append("e.location = ?")
+        params.append(location)
+
+    query = f"""
+        SELECT {', '.join('e.' + column for column in columns)} FROM EventSearch
+        JOIN Events e ON e.event_id = EventSearch.rowid
+        WHERE {' AND '.join(conditions)}
+        ORDER BY EventSearch.rank, e.event_id LIMIT ? OFFSET ?
+    """
+    params.extend([limit + 1, offset])
+    return query, params, offset
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+
+# Clients send a fresh key per checkout and reuse it on every retry of that checkout
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+MAX_KEY_LENGTH = 255
+
+# Completed checkouts can be replayed for this long
+DEFAULT_RETENTION = 24 * 60 * 60
+
+# Expired keys are deleted at most this often, on the back of a checkout
+PRUNE_INTERVAL = 60
+
+
+class IdempotencyConflict(ValueError):
+    pass
+
+
+def request_fingerprint(event_id, seats):
+    """Digest of what a checkout asked for, so a key can't be replayed for a different order."""
+    canonical = json.dumps([event_id, sorted(seats)], separators=(",", ":"))
+    return hashlib.sha256(canonical.encode()).hexdigest()
+
+
+class CheckoutLog:
+    """Results of completed checkouts, keyed by (user, idempotency key).
+
+    ``record()`` writes the result to CheckoutRequests inside the checkout's
+    own transaction, so a sale and its replayable result commit together and
+    are shared by every worker. The most recent results are also kept in
+    memory, so most retries are answered without touching the database.
+    Only completed checkouts are recorded; a failed attempt can be retried
+    with the same key.
+    """
+
+    def __init__(self, max_entries=10000, retention=DEFAULT_RETENTION):
+        self.max_entries = max_entries
+        self.retention = retention
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # (user_id, key) -> (fingerprint, status, body, createdAt)
+        self._last_prune = 0.0
+        self._memory_replays = 0
+        self._database_replays = 0
+        self._recorded = 0
+        self._conflicts = 0
+
+    def _result(self, entry, fingerprint):
+        stored_fingerprint, status, body, created_at = entry
+        if created_at < time.time() - self.retention:
+            return None
+        if stored_fingerprint != fingerprint:
+            with self._lock:
+                self._conflicts += 1
+            raise IdempotencyConflict(f"{IDEMPOTENCY_HEADER} was already used for a different order")
+        return status, body
+
+    def cached(self, user_id, key, fingerprint):
+        """Return the (status, body) this process remembers for the key, or None."""
+        with self._lock:
+            entry = self._entries.get((user_id, key))
+            if entry is not None:
+                self._entries.move_to_end((user_id, key))
+        if entry is None:
+            return None
+        result = self._result(entry, fingerprint)
+        if result is not None:
+            with self._lock:
+                self._memory_replays += 1
+        return result
+
+    def lookup(self, conn, user_id, key, fingerprint):
+        """Like ``cached()``, falling back to the CheckoutRequests table."""
+        result = self.cached(user_id, key, fingerprint)
+        if result is not None:
+            return result
+        row = conn.execute("""
+            SELECT requestHash, statusCode, response, createdAt FROM CheckoutRequests
+            WHERE userId = ? AND idempotencyKey = ?
+        """, (user_id, key)).fetchone()
+        if row is None:
+            return None
+        entry = (row[0], row[1], json.loads(row[2]), row[3])
+        result = self._result(entry, fingerprint)
+        if result is not None:
+            self._remember(user_id, key, entry)
+            with self._lock:
+                self._database_replays += 1
+        return result
+
+    def record(self, conn, user_id, key, fingerprint, status, body):
+        """Store a checkout's result in the caller's transaction.
+
+        Call ``remember()`` with the same arguments once it has committed.
+        """
+        now = time.time()
+        # A row already there is one past retention that hasn't been pruned yet (lookup()
+        # ignored it), so the key starts over
+        conn.execute("""
+            INSERT INTO CheckoutRequests (userId, idempotencyKey, requestHash, statusCode, response, createdAt)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (userId, idempotencyKey) DO UPDATE SET
+                requestHash = excluded.requestHash, statusCode = excluded.statusCode,
+                response = excluded.response, createdAt = excluded.createdAt
+        """, (user_id, key, fingerprint, status, json.dumps(body), now))
+        if now - self._last_prune >= PRUNE_INTERVAL:
+            self._last_prune = now
+            conn.execute("DELETE FROM CheckoutRequests WHERE createdAt < ?", (now - self.retention,))
+
+    def remember(self, user_id, key, fingerprint, status, body):
+        self._remember(user_id, key, (fingerprint, status, body, time.time()))
+        with self._lock:
+            self._recorded += 1
+
+    def _remember(self, user_id, key, entry):
+        with self._lock:
+            self._entries[(user_id, key)] = entry
+            self._entries.move_to_end((user_id, key))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "cachedResults": len(self._entries),
+                "maxEntries": self.max_entries,
+                "retentionSeconds": self.retention,
+                "recorded": self._recorded,
+                "memoryReplays": self._memory_replays,
+                "databaseReplays": self._database_replays,
+                "keyConflicts": self._conflicts,
+            }
@@ -0,0 +1,175 @@
+import queue
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+
+# Pragmas applied once to every pooled connection when it is opened.
+# WAL lets readers keep going while a writer holds the lock, and
+# synchronous=NORMAL is durable enough in WAL mode while avoiding an
+# fsync on every commit.
+CONNECTION_PRAGMAS = (
+    "PRAGMA synchronous = NORMAL",
+    "PRAGMA temp_store = MEMORY",
+    "PRAGMA cache_size = -16000",
+    "PRAGMA mmap_size = 134217728",
+)
+
+
+class PoolExhausted(Exception):
+    pass
+
+
+class ConnectionPool:
+    """Fixed-size pool of SQLite connections shared by the request threads.
+
+    Connections are opened lazily up to ``size`` and then reused, so the
+    database file is opened a handful of times per process instead of once
+    per request. Use ``connection()`` to borrow one.
+
+    ``factory`` is the ``sqlite3.Connection`` subclass to open,
+    ``on_open`` is called with each new connection before it is used (to
+    attach databases, say), and ``on_wait`` is called with the seconds
+    spent whenever a caller had to wait for a connection to come back.
+    """
+
+    def __init__(self, db_path, size=8, busy_timeout_ms=5000, acquire_timeout=10.0,
+                 factory=sqlite3.Connection, on_open=None, on_wait=None):
+        self.db_path = db_path
+        self.size = size
+        self.busy_timeout_ms = busy_timeout_ms
+        self.acquire_timeout = acquire_timeout
+        self.factory = factory
+        self.on_open = on_open
+        self.on_wait = on_wait
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        self._in_use = 0
+        self._acquired = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._errors = 0
+        self._closed = False
+
+        # WAL is a property of the database file, so it only needs to be
+        # switched on once rather than for every connection.
+        self._created = 1
+        conn = self._open()
+        conn.execute("PRAGMA journal_mode = WAL")
+        self._idle.put(conn)
+
+    def _open(self):
+        conn = sqlite3.connect(
+            self.db_path,
+            timeout=self.busy_timeout_ms / 1000,
+            check_same_thread=False,
+            factory=self.factory,
+        )
+        conn.row_factory = sqlite3.Row
+        conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+        for pragma in CONNECTION_PRAGMAS:
+            conn.execute(pragma)
+        if self.on_open is not None:
+            self.on_open(conn)
+        return conn
+
+    def _acquire(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        # The slot is taken before the connection is opened, so callers
+        # racing here can't open more than `size` between them.
+        with self._lock:
+            can_open = self._created < self.size
+            if can_open:
+                self._created += 1
+        if can_open:
+            try:
+                return self._open()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        # Every connection is checked out; wait for one to come back.
+        started = time.perf_counter()
+        try:
+            conn = self._idle.get(timeout=self.acquire_timeout)
+        except queue.Empty:
+            raise PoolExhausted(
+                f"no database connection available after {self.acquire_timeout}s"
+            )
+        finally:
+            waited = time.perf_counter() - started
+            with self._lock:
+                self._waits += 1
+                self._wait_time += waited
+            if self.on_wait:
+                self.on_wait(waited)
+        return conn
+
+    def _release(self, conn):
+        # Never hand a connection with an open transaction to the next
+        # request; whatever was not committed is discarded.
+        if conn.in_transaction:
+            conn.rollback()
+        if self._closed:
+            conn.close()
+        else:
+            self._idle.put(conn)
+
+    @contextmanager
+    def connection(self):
+        """Borrow a connection for the duration of a ``with`` block.
+
+        The connection is always returned to the pool, and any transaction
+        left open (including by an exception) is rolled back.
+        """
+        conn = self._acquire()
+        with self._lock:
+            self._in_use += 1
+            self._acquired += 1
+        try:
+            yield conn
+        except Exception:
+            with self._lock:
+                self._errors += 1
+            raise
+        finally:
+            with self._lock:
+                self._in_use -= 1
+            try:
+                self._release(conn)
+            except sqlite3.Error:
+                # A broken connection is dropped so a fresh one can be opened.
+                conn.close()
+                with self._lock:
+                    self._created -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "size": self.size,
+                "created": self._created,
+                "inUse": self._in_use,
+                "idle": self._idle.qsize(),
+                "acquired": self._acquired,
+                "waits": self._waits,
+                "waitSeconds": round(self._wait_time, 6),
+                "errors": self._errors,
+            }
+
+    def close(self):
+        self._closed = True
+        while True:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            conn.close()
+            with self._lock:
+                self._created -= 1
@@ -0,0 +1,164 @@
+"""Per-event seat counts and revenue by price tier, for admin dashboards.
+
+The ``EventTierStats`` table holds one row per event and price tier with
+its available, reserved and sold seat counts and sold revenue. Triggers on
+``Tickets`` (migration 8) update it in the same transaction as every
+reserve, purchase, release and provisioning, so reading it never has to
+count tickets. Once an event is archived (archive.py) its tickets leave
+``Tickets`` but its rows here stay as they were, so checks and rebuilds
+leave archived events alone.
+
+Run from backend/ to check the table against ``Tickets``, or to recompute
+it from scratch:
+
+    python eventstats.py verify               # every event
+    python eventstats.py rebuild --event 22   # recompute, then verify
+"""
+import argparse
+import sys
+
+from script import DB_PATH, connect
+
+COUNTERS = ("available", "reserved", "sold", "revenueCents")
+
+
+def _scope(event_id, column="event_id"):
+    where = f"WHERE {column} NOT IN (SELECT event_id FROM Events WHERE archivedAt IS NOT NULL)"
+    if event_id is None:
+        return where, ()
+    return f"{where} AND {column} = ?", (event_id,)
+
+
+def compute(conn, event_id=None):
+    """Count every ticket: ``{(event_id, tier_id): (available, reserved, sold, revenueCents)}``.
+
+    This is the full scan the summary table exists to avoid; it is only
+    for checking and rebuilding. Revenue uses each tier's current price.
+    """
+    where, params = _scope(event_id, "t.event_id")
+    rows = conn.execute(f"""
+        SELECT t.event_id, t.priceTierId,
+               SUM(t.status = 'AVAILABLE'), SUM(t.status = 'RESERVED'), SUM(t.status = 'SOLD'),
+               SUM(CASE WHEN t.status = 'SOLD' THEN p.priceCents ELSE 0 END)
+        FROM Tickets t
+        LEFT JOIN PriceTiers p ON p.id = t.priceTierId
+        {where}
+        GROUP BY t.event_id, t.priceTierId
+    """, params)
+    return {(row[0], row[1]): tuple(row[2:]) for row in rows}
+
+
+def stored(conn, event_id=None):
+    """What ``EventTierStats`` holds, in the same shape as ``compute()``.
+
+    Rows that have gone back to all zeros, after an event's tickets were
+    deleted, are left out, the same as tiers with no tickets at all.
+    """
+    where, params = _scope(event_id)
+    rows = conn.execute(f"""
+        SELECT event_id, tier_id, {', '.join(COUNTERS)} FROM EventTierStats {where}
+    """, params)
+    return {(row[0], row[1]): tuple(row[2:]) for row in rows if any(row[2:])}
+
+
+def verify(conn, event_id=None):
+    """Compare the summary table with the tickets.
+
+    Returns a list of ``(event_id, tier_id, stored, actual)`` for every
+    tier that is off, where ``stored`` and ``actual`` are counter tuples or
+    None for a missing row. An empty list means the table is correct.
+    """
+    actual = compute(conn, event_id)
+    summary = stored(conn, event_id)
+    return [
+        (key[0], key[1], summary.get(key), actual.get(key))
+        for key in sorted(set(actual) | set(summary))
+        if summary.get(key) != actual.get(key)
+    ]
+
+
+def rebuild(conn, event_id=None):
+    """Recompute the summary rows for one event, or all of them, from ``Tickets``.
+
+    Run it inside a write transaction so no seat changes between the count
+    and the replace. Returns what ``verify()`` found before the rebuild.
+    """
+    mismatches = verify(conn, event_id)
+    actual = compute(conn, event_id)
+    where, params = _scope(event_id)
+    conn.execute(f"DELETE FROM EventTierStats {where}", params)
+    conn.executemany(
+        f"INSERT INTO EventTierStats (event_id, tier_id, {', '.join(COUNTERS)}) VALUES (?, ?, ?, ?, ?, ?)",
+        [key + counters for key, counters in actual.items()],
+    )
+    return mismatches
+
+
+def event_stats(conn, event_id):
+    """The dashboard view of one event: counts and revenue per tier plus totals, or None if there is no such event."""
+    if conn.execute("SELECT 1 FROM Events WHERE event_id = ?", (event_id,)).fetchone() is None:
+        return None
+    rows = conn.execute("""
+        SELECT p.id, p.name, p.priceCents, s.available, s.reserved, s.sold, s.revenueCents
+        FROM PriceTiers p
+        LEFT JOIN EventTierStats s ON s.event_id = p.event_id AND s.tier_id = p.id
+        WHERE p.event_id = ? ORDER BY p.priceCents DESC, p.id
+    """, (event_id,)).fetchall()
+
+    tiers = []
+    totals = dict.fromkeys(("capacity",) + COUNTERS, 0)
+    for tier_id, name, price_cents, *counters in rows:
+        tier = dict(zip(COUNTERS, (value or 0 for value in counters)))
+        tier["capacity"] = tier["available"] + tier["reserved"] + tier["sold"]
+        for key in totals:
+            totals[key] += tier[key]
+        tiers.append({"tierId": tier_id, "name": name, "priceCents": price_cents, **tier})
+    totals["sellThrough"] = round(totals["sold"] / totals["capacity"], 4) if totals["capacity"] else None
+    return {"event_id": event_id, "tiers": tiers, "totals": totals}
+
+
+def _report(mismatches, out=sys.stdout):
+    for event_id, tier_id, summary, actual in mismatches:
+        out.write(f"  event {event_id} tier {tier_id}: stored {summary}, actual {actual}\n")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Check or rebuild per-event sales aggregates")
+    parser.add_argument("command", choices=("verify", "rebuild"))
+    parser.add_argument("--event", type=int, help="only this event")
+    parser.add_argument("--db", default=DB_PATH, help="path to the SQLite database")
+    args = parser.parse_args(argv)
+
+    conn = connect(args.db)
+    try:
+        if args.command == "verify":
+            mismatches = verify(conn, args.event)
+            if mismatches:
+                print(f"{len(mismatches)} tiers out of step with Tickets (columns: {', '.join(COUNTERS)}):")
+                _report(mismatches)
+                return 1
+            print("EventTierStats matches Tickets")
+            return 0
+
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            drift = rebuild(conn, args.event)
+            remaining = verify(conn, args.event)
+            if remaining:
+                raise RuntimeError(f"{len(remaining)} tiers still differ after the rebuild")
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if drift:
+            print(f"Rebuilt; corrected {len(drift)} tiers (columns: {', '.join(COUNTERS)}):")
+            _report(drift)
+        else:
+            print("Rebuilt; nothing had drifted")
+        return 0
+    finally:
+        conn.close()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,177 @@
+"""Streaming bulk exports of whole tables, as NDJSON or CSV.
+
+An export walks a table in key order, ``BATCH_SIZE`` rows at a time, and
+sends each batch as soon as it is read, so memory stays flat however big
+the table is and the first rows go out straight away. Each batch is its
+own keyset query on a connection borrowed for just that query. A slow
+client therefore holds neither a pooled connection nor a read
+transaction, which would keep WAL checkpoints from finishing.
+
+Every row carries its key. Passing the last key received as ``after``
+resumes an export that was cut off. With ``limit``, an export is one page,
+and the response's ``X-Next-Cursor`` header is the ``after`` for the next
+one. An export isn't a snapshot: rows added while it runs are included if
+their key is still ahead of it.
+"""
+import csv
+import io
+import json
+import threading
+import time
+
+from catalog import InvalidQuery
+
+FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+# Rows read and sent at a time
+BATCH_SIZE = 1000
+
+
+class Export:
+    """A table export: ``columns`` of ``table`` in ``key`` order, optionally narrowed by ``where``.
+
+    ``key`` must be unique and the table's rowid or the last column of an
+    index that ``where`` fixes the rest of, so every batch is an index seek.
+    """
+
+    def __init__(self, name, table, columns, key, where=None, params=()):
+        self.name = name
+        self.table = table
+        self.columns = list(columns)
+        self.key = key
+        self.where = where
+        self.params = tuple(params)
+        if key not in self.columns:
+            self.columns.insert(0, key)
+
+    def _conditions(self, after, up_to=None):
+        conditions = [self.where] if self.where else []
+        params = list(self.params)
+        if after is not None:
+            conditions.append(f"{self.key} > ?")
+            params.append(after)
+        if up_to is not None:
+            conditions.append(f"{self.key} <= ?")
+            params.append(up_to)
+        return (" WHERE " + " AND ".join(conditions) if conditions else ""), params
+
+    def batch_query(self, after, up_to=None, size=BATCH_SIZE):
+        where, params = self._conditions(after, up_to)
+        query = f"SELECT {', '.join(self.columns)} FROM {self.table}{where} ORDER BY {self.key} LIMIT ?"
+        return query, params + [size]
+
+    def page_end(self, conn, after, limit):
+        """The last key of a ``limit``-row page after ``after``, if more rows follow it, else None."""
+        where, params = self._conditions(after)
+        rows = conn.execute(f"""
+            SELECT {self.key} FROM {self.table}{where} ORDER BY {self.key} LIMIT 2 OFFSET ?
+        """, params + [limit - 1]).fetchall()
+        return rows[0][0] if len(rows) == 2 else None
+
+
+def parse_format(value):
+    fmt = (value or "ndjson").lower()
+    if fmt not in FORMATS:
+        raise InvalidQuery(f"format must be one of: {', '.join(FORMATS)}")
+    return fmt
+
+
+def parse_position(value, name):
+    """A non-negative integer ``after`` or ``limit`` from the query string, or None."""
+    if value is None:
+        return None
+    try:
+        number = int(value)
+    except ValueError:
+        raise InvalidQuery(f"{name} must be an integer")
+    if number < 0 or (name == "limit" and number == 0):
+        raise InvalidQuery(f"{name} must be positive")
+    return number
+
+
+def _encoder(fmt, columns):
+    if fmt == "ndjson":
+        def encode(rows):
+            return "".join(json.dumps(dict(zip(columns, row)), separators=(",", ":")) + "\n" for row in rows)
+        return None, encode
+
+    def encode(rows):
+        out = io.StringIO()
+        csv.writer(out, lineterminator="\n").writerows(rows)
+        return out.getvalue()
+    header = io.StringIO()
+    csv.writer(header, lineterminator="\n").writerow(columns)
+    return header.getvalue(), encode
+
+
+def stream(pool, export, fmt, after=None, up_to=None, batch_size=BATCH_SIZE, stats=None):
+    """Yield an export as text chunks, one per batch, stopping after the key ``up_to`` if given."""
+    started = time.perf_counter()
+    first_byte = None
+    rows = sent = 0
+    key_index = export.columns.index(export.key)
+    header, encode = _encoder(fmt, export.columns)
+    try:
+        if header:
+            first_byte = time.perf_counter() - started
+            sent += len(header)
+            yield header
+        while True:
+            query, params = export.batch_query(after, up_to, batch_size)
+            with pool.connection() as conn:
+                batch = conn.execute(query, params).fetchall()
+            if not batch:
+                break
+            chunk = encode(batch)
+            rows += len(batch)
+            sent += len(chunk)
+            if first_byte is None:
+                first_byte = time.perf_counter() - started
+            yield chunk
+            if len(batch) < batch_size:
+                break
+            after = batch[-1][key_index]
+    finally:
+        # Also reached when the client goes away part way through
+        if stats is not None:
+            stats.record(export.name, rows, sent, first_byte, time.perf_counter() - started)
+
+
+class ExportStats:
+    """Rows, bytes, time to first byte and throughput per export, for /admin/exports."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._exports = {}
+
+    def record(self, name, rows, sent, first_byte, seconds):
+        with self._lock:
+            totals = self._exports.setdefault(name, {
+                "exports": 0, "rows": 0, "bytes": 0, "seconds": 0.0, "firstByteSeconds": 0.0, "last": None,
+            })
+            totals["exports"] += 1
+            totals["rows"] += rows
+            totals["bytes"] += sent
+            totals["seconds"] += seconds
+            totals["firstByteSeconds"] += first_byte or 0.0
+            totals["last"] = {
+                "rows": rows,
+                "bytes": sent,
+                "firstByteMs": round(first_byte * 1000, 3) if first_byte is not None else None,
+                "seconds": round(seconds, 3),
+                "rowsPerSecond": round(rows / seconds) if seconds else None,
+            }
+
+    def stats(self):
+        with self._lock:
+            return {
+                name: {
+                    "exports": totals["exports"],
+                    "rows": totals["rows"],
+                    "bytes": totals["bytes"],
+                    "avgFirstByteMs": round(totals["firstByteSeconds"] / totals["exports"] * 1000, 3),
+                    "rowsPerSecond": round(totals["rows"] / totals["seconds"]) if totals["seconds"] else None,
+                    "last": totals["last"],
+                }
+                for name, totals in self._exports.items()
+            }
@@ -0,0 +1,107 @@
+import contextlib
+import logging
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Seconds a reserved seat stays held when the event doesn't set its own holdTtlSeconds
+DEFAULT_HOLD_TTL = 600
+
+
+def hold_ttl(conn, event_id, default=DEFAULT_HOLD_TTL):
+    row = conn.execute(
+        "SELECT holdTtlSeconds FROM Events WHERE event_id = ?", (event_id,)
+    ).fetchone()
+    if row is None or not row["holdTtlSeconds"]:
+        return default
+    return row["holdTtlSeconds"]
+
+
+class HoldSweeper(threading.Thread):
+    """Background thread that hands expired seat holds back to AVAILABLE.
+
+    Each pass releases expired holds in batches of ``batch_size``, one short
+    write transaction per batch so buyers are never locked out for long.
+    ``on_release`` is called after each committed batch with the list of
+    ``(event_id, rowName, seatNumber)`` tuples that were released, while
+    ``write_lock`` (if given) is still held.
+    """
+
+    def __init__(self, pool, interval=5.0, batch_size=500, on_release=None, write_lock=None):
+        super().__init__(name="hold-sweeper", daemon=True)
+        self.pool = pool
+        self.interval = interval
+        self.batch_size = batch_size
+        self.on_release = on_release
+        self.write_lock = write_lock or contextlib.nullcontext()
+
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._sweeps = 0
+        self._released_total = 0
+        self._last_released = 0
+        self._last_duration = 0.0
+        self._last_sweep_at = None
+        self._errors = 0
+
+    def sweep(self, now=None):
+        now = time.time() if now is None else now
+        started = time.perf_counter()
+        released = 0
+
+        while True:
+            with self.write_lock, self.pool.connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                rows = conn.execute("""
+                    UPDATE Tickets
+                    SET status = 'AVAILABLE', heldBy = NULL, holdExpiresAt = NULL
+                    WHERE rowid IN (
+                        SELECT rowid FROM Tickets
+                        WHERE status = 'RESERVED' AND holdExpiresAt <= ?
+                        LIMIT ?
+                    )
+                    RETURNING event_id, rowName, seatNumber
+                """, (now, self.batch_size)).fetchall()
+                conn.commit()
+                if rows and self.on_release:
+                    self.on_release([tuple(row) for row in rows])
+
+            released += len(rows)
+            if len(rows) < self.batch_size:
+                break
+
+        duration = time.perf_counter() - started
+        with self._lock:
+            self._sweeps += 1
+            self._released_total += released
+            self._last_released = released
+            self._last_duration = duration
+            self._last_sweep_at = now
+        return released, duration
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                released, duration = self.sweep()
+                if released:
+                    logger.info("hold sweeper released %d seats in %.1fms", released, duration * 1000)
+            except Exception:
+                with self._lock:
+                    self._errors += 1
+                logger.exception("hold sweeper failed")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "intervalSeconds": self.interval,
+                "sweeps": self._sweeps,
+                "releasedTotal": self._released_total,
+                "lastReleased": self._last_released,
+                "lastDurationMs": round(self._last_duration * 1000, 3),
+                "lastSweepAt": self._last_sweep_at,
+                "errors": self._errors,
+            }
@@ -0,0 +1,187 @@
+import json
+import logging
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+
+class JobQueueFull(Exception):
+    pass
+
+
+class _Job:
+    __slots__ = ("id", "kind", "fn", "progress")
+
+    def __init__(self, job_id, kind, fn):
+        self.id = job_id
+        self.kind = kind
+        self.fn = fn
+        self.progress = None
+
+
+class JobRunner(threading.Thread):
+    """Runs long admin tasks in the background, one at a time, and records them in the Jobs table.
+
+    A job is a function taking a ``progress(message)`` callback and
+    returning a JSON-serializable result. Its status, result or error are
+    kept in the Jobs table, so any worker can report on it; the latest
+    progress message is only known to the worker running it.
+
+    ``write`` runs a seat writer operation and waits for it (``run_write``
+    in app.py), so recording a job's status queues behind the seat writes
+    rather than competing with them for SQLite's write lock.
+    """
+
+    def __init__(self, pool, write, max_queue=100):
+        super().__init__(name="job-runner", daemon=True)
+        self.pool = pool
+        self.write = write
+        self.max_queue = max_queue
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._current = None
+        self._finished = 0
+        self._failed = 0
+
+    def _update(self, job_id, **columns):
+        def operation(conn):
+            assignments = ", ".join(f"{column} = ?" for column in columns)
+            conn.execute(f"UPDATE Jobs SET {assignments} WHERE id = ?", (*columns.values(), job_id))
+            return None, None
+        self.write(operation)
+
+    def submit(self, kind, fn, details=None):
+        """Queue a job and return its id. ``details`` is stored with it for the status endpoint."""
+        if self._queue.full():
+            raise JobQueueFull(f"{self.max_queue} jobs are already queued")
+        job = _Job(uuid.uuid4().hex, kind, fn)
+
+        def operation(conn):
+            conn.execute("""
+                INSERT INTO Jobs (id, kind, status, details, worker, createdAt)
+                VALUES (?, ?, ?, ?, ?, ?)
+            """, (job.id, kind, QUEUED, json.dumps(details) if details is not None else None,
+                  self.worker, time.time()))
+            return None, None
+        self.write(operation)
+        self._queue.put(job)
+        return job.id
+
+    def get(self, job_id):
+        """The job's status as stored, plus progress if this worker is running it, or None."""
+        with self.pool.connection() as conn:
+            row = conn.execute("SELECT * FROM Jobs WHERE id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        return self._describe(row)
+
+    def recent(self, limit=50):
+        with self.pool.connection() as conn:
+            rows = conn.execute("SELECT * FROM Jobs ORDER BY createdAt DESC LIMIT ?", (limit,)).fetchall()
+        return [self._describe(row) for row in rows]
+
+    def _describe(self, row):
+        job = {
+            "jobId": row["id"],
+            "kind": row["kind"],
+            "status": row["status"],
+            "details": json.loads(row["details"]) if row["details"] else None,
+            "result": json.loads(row["result"]) if row["result"] else None,
+            "error": row["error"],
+            "createdAt": row["createdAt"],
+            "startedAt": row["startedAt"],
+            "finishedAt": row["finishedAt"],
+        }
+        with self._lock:
+            current = self._current
+        if current is not None and current.id == row["id"]:
+            job["progress"] = current.progress
+        return job
+
+    def _abandon_orphans(self):
+        # Jobs a stopped process on this host had queued or started will never finish
+        host = self.worker.partition(":")[0]
+        with self.pool.connection() as conn:
+            rows = conn.execute(
+                "SELECT id, worker FROM Jobs WHERE status IN (?, ?) AND worker LIKE ?",
+                (QUEUED, RUNNING, f"{host}:%"),
+            ).fetchall()
+        for row in rows:
+            pid = int(row["worker"].rpartition(":")[2])
+            if pid != os.getpid() and not _alive(pid):
+                self._update(row["id"], status=FAILED, error="the worker running this job stopped",
+                             finishedAt=time.time())
+
+    def run(self):
+        try:
+            self._abandon_orphans()
+        except Exception:
+            logger.exception("job runner could not check for orphaned jobs")
+
+        while not self._stop_event.is_set():
+            try:
+                job = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+            self._run_job(job)
+
+    def _run_job(self, job):
+        def progress(message):
+            job.progress = message.strip()
+
+        with self._lock:
+            self._current = job
+        try:
+            self._update(job.id, status=RUNNING, startedAt=time.time())
+            result = job.fn(progress)
+            self._update(job.id, status=DONE, result=json.dumps(result), finishedAt=time.time())
+            with self._lock:
+                self._finished += 1
+        except Exception as e:
+            with self._lock:
+                self._failed += 1
+            logger.exception("job %s %s failed", job.kind, job.id)
+            try:
+                self._update(job.id, status=FAILED, error=str(e), finishedAt=time.time())
+            except Exception:
+                logger.exception("job %s: could not record the failure", job.id)
+        finally:
+            with self._lock:
+                self._current = None
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self):
+        with self._lock:
+            current = self._current
+            return {
+                "queued": self._queue.qsize(),
+                "maxQueue": self.max_queue,
+                "running": current.id if current is not None else None,
+                "finished": self._finished,
+                "failed": self._failed,
+            }
+
+
+def _alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,312 @@
+"""Request latency, SQL and lock-wait metrics in Prometheus text format.
+
+Each request gets a ``RequestStats`` in a context variable. Pooled
+connections are opened as ``InstrumentedConnection`` and add every
+statement they run to it, and ``TimedLock`` and the pool add the time spent
+waiting for locks and connections. Seat writer operations run in a copy
+of the submitting request's context (writer.py), so the statements of a
+request's writes count toward it even though the writer thread runs them.
+When the request finishes, ``Metrics`` folds the stats into per-route
+histograms and counters, and logs the request with its SQL if it was slow.
+
+Recording costs a couple of ``perf_counter()`` calls per statement and a
+short critical section per request, so it is meant to stay on.
+"""
+import bisect
+import contextvars
+import re
+import sqlite3
+import threading
+import time
+
+# Upper bounds in seconds for request, SQL and lock-wait histograms
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+# Upper bounds for the number of SQL statements a request runs
+STATEMENT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+# Statements kept per request for the slow-request log
+MAX_LOGGED_STATEMENTS = 50
+
+INF_BOUND = 'le="+Inf"'
+
+_WHITESPACE = re.compile(r"\s+")
+
+_current = contextvars.ContextVar("request_stats", default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram; observe() is not thread-safe on its own."""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class RequestStats:
+    """What one request spent its time on."""
+
+    __slots__ = ("started", "statements", "sql_seconds", "lock_waits", "log")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.statements = 0
+        self.sql_seconds = 0.0
+        self.lock_waits = {}  # lock name -> seconds waited
+        self.log = []  # (sql, seconds) for the slow-request log
+
+
+def record_statement(sql, seconds):
+    stats = _current.get()
+    if stats is None:
+        return
+    stats.statements += 1
+    stats.sql_seconds += seconds
+    if len(stats.log) < MAX_LOGGED_STATEMENTS:
+        stats.log.append((sql, seconds))
+
+
+def record_fetch(seconds):
+    stats = _current.get()
+    if stats is not None:
+        stats.sql_seconds += seconds
+
+
+def record_lock_wait(lock, seconds):
+    """Add time the current request spent waiting for ``lock``."""
+    stats = _current.get()
+    if stats is not None:
+        stats.lock_waits[lock] = stats.lock_waits.get(lock, 0.0) + seconds
+
+
+class InstrumentedCursor(sqlite3.Cursor):
+    """Times statements and fetches for the current request.
+
+    Rows read by iterating the cursor directly are not timed; per-row
+    timing would cost more than it tells us.
+    """
+
+    def execute(self, sql, parameters=()):
+        started = time.perf_counter()
+        try:
+            return super().execute(sql, parameters)
+        finally:
+            seconds = time.perf_counter() - started
+            record_statement(sql, seconds)
+            # BEGIN IMMEDIATE is where SQLite's busy handler waits for the write lock
+            if sql.startswith("BEGIN IMMEDIATE"):
+                record_lock_wait("sqlite_write", seconds)
+
+    def executemany(self, sql, seq_of_parameters):
+        started = time.perf_counter()
+        try:
+            return super().executemany(sql, seq_of_parameters)
+        finally:
+            record_statement(sql, time.perf_counter() - started)
+
+    def fetchone(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchone()
+        finally:
+            record_fetch(time.perf_counter() - started)
+
+    def fetchmany(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return super().fetchmany(*args, **kwargs)
+        finally:
+            record_fetch(time.perf_counter() - started)
+
+    def fetchall(self):
+        started = time.perf_counter()
+        try:
+            return super().fetchall()
+        finally:
+            record_fetch(time.perf_counter() - started)
+
+
+class InstrumentedConnection(sqlite3.Connection):
+    """sqlite3 connection factory whose statements go through ``InstrumentedCursor``."""
+
+    def cursor(self, factory=InstrumentedCursor):
+        return super().cursor(factory)
+
+    def execute(self, sql, parameters=()):
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+    def commit(self):
+        started = time.perf_counter()
+        try:
+            return super().commit()
+        finally:
+            record_statement("COMMIT", time.perf_counter() - started)
+
+
+class TimedLock:
+    """Wraps a lock to record how long the current request waited for it."""
+
+    def __init__(self, name, lock=None):
+        self.name = name
+        self._lock = lock or threading.Lock()
+
+    def __enter__(self):
+        started = time.perf_counter()
+        self._lock.acquire()
+        record_lock_wait(self.name, time.perf_counter() - started)
+        return self
+
+    def __exit__(self, *exc_info):
+        self._lock.release()
+        return False
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values, extra=""):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_bound(bound):
+    return f"{bound:g}"
+
+
+class Metrics:
+    """Per-route request metrics, rendered in Prometheus text format.
+
+    ``slow_request_seconds`` turns on the slow-request log: requests that
+    take at least that long are logged to ``logger`` with the SQL they ran.
+    """
+
+    def __init__(self, slow_request_seconds=None, logger=None):
+        self.slow_request_seconds = slow_request_seconds
+        self.logger = logger
+
+        self._lock = threading.Lock()
+        self._requests = {}  # (method, route, status) -> Histogram of seconds
+        self._statements = {}  # route -> Histogram of statements per request
+        self._sql_seconds = {}  # route -> Histogram of SQL seconds per request
+        self._lock_waits = {}  # (route, lock) -> Histogram of seconds waited
+        self._slow = {}  # route -> count
+
+    def start_request(self):
+        stats = RequestStats()
+        _current.set(stats)
+        return stats
+
+    def finish_request(self, method, route, status):
+        stats = _current.get()
+        if stats is None:
+            return
+        _current.set(None)
+        seconds = time.perf_counter() - stats.started
+        slow = self.slow_request_seconds is not None and seconds >= self.slow_request_seconds
+
+        with self._lock:
+            key = (method, route, status)
+            if key not in self._requests:
+                self._requests[key] = Histogram(LATENCY_BUCKETS)
+                self._statements.setdefault(route, Histogram(STATEMENT_BUCKETS))
+                self._sql_seconds.setdefault(route, Histogram(LATENCY_BUCKETS))
+            self._requests[key].observe(seconds)
+            self._statements[route].observe(stats.statements)
+            self._sql_seconds[route].observe(stats.sql_seconds)
+            for lock, waited in stats.lock_waits.items():
+                histogram = self._lock_waits.get((route, lock))
+                if histogram is None:
+                    histogram = self._lock_waits[(route, lock)] = Histogram(LATENCY_BUCKETS)
+                histogram.observe(waited)
+            if slow:
+                self._slow[route] = self._slow.get(route, 0) + 1
+
+        if slow and self.logger is not None:
+            self._log_slow(method, route, status, seconds, stats)
+
+    def _log_slow(self, method, route, status, seconds, stats):
+        waits = ", ".join(f"{lock} {waited * 1000:.1f}ms" for lock, waited in stats.lock_waits.items())
+        lines = [
+            f"slow request {method} {route} {status} {seconds * 1000:.1f}ms: "
+            f"{stats.statements} SQL statements in {stats.sql_seconds * 1000:.1f}ms"
+            + (f", waited for {waits}" if waits else "")
+        ]
+        for sql, statement_seconds in stats.log:
+            sql = _WHITESPACE.sub(" ", sql).strip()
+            lines.append(f"  {statement_seconds * 1000:8.2f}ms  {sql}")
+        if stats.statements > len(stats.log):
+            lines.append(f"  ... {stats.statements - len(stats.log)} more")
+        self.logger.warning("\n".join(lines))
+
+    def _histogram_lines(self, name, label_names, histograms):
+        lines = []
+        for label_values, histogram in sorted(histograms, key=lambda item: item[0]):
+            cumulative = 0
+            for bound, count in zip(histogram.buckets, histogram.counts):
+                cumulative += count
+                le = f'le="{_format_bound(bound)}"'
+                lines.append(f"{name}_bucket{_labels(label_names, label_values, le)} {cumulative}")
+            lines.append(f"{name}_bucket{_labels(label_names, label_values, INF_BOUND)} {histogram.count}")
+            lines.append(f"{name}_sum{_labels(label_names, label_values)} {histogram.sum:.6f}")
+            lines.append(f"{name}_count{_labels(label_names, label_values)} {histogram.count}")
+        return lines
+
+    def render(self, gauges=()):
+        """Prometheus text exposition of everything recorded so far.
+
+        ``gauges`` adds ``(name, type, help, value)`` samples from elsewhere
+        in the app, such as the connection pool. ``value`` may also be a
+        list of ``(labels, value)`` pairs, with ``labels`` a dict.
+        """
+        with self._lock:
+            sections = [
+                ("tessera_http_request_duration_seconds", "histogram",
+                 "Time to handle a request, by route and status.",
+                 self._histogram_lines("tessera_http_request_duration_seconds", ("method", "route", "status"),
+                                       list(self._requests.items()))),
+                ("tessera_http_request_sql_statements", "histogram",
+                 "SQL statements run per request.",
+                 self._histogram_lines("tessera_http_request_sql_statements", ("route",),
+                                       [((route,), h) for route, h in self._statements.items()])),
+                ("tessera_http_request_sql_seconds", "histogram",
+                 "Time per request spent executing SQL and fetching rows.",
+                 self._histogram_lines("tessera_http_request_sql_seconds", ("route",),
+                                       [((route,), h) for route, h in self._sql_seconds.items()])),
+                ("tessera_http_request_lock_wait_seconds", "histogram",
+                 "Time per request spent waiting for a pooled connection (pool), the seat write "
+                 "lock (seat_write), SQLite's write lock (sqlite_write) or the seat writer to "
+                 "commit its write (seat_writer).",
+                 self._histogram_lines("tessera_http_request_lock_wait_seconds", ("route", "lock"),
+                                       list(self._lock_waits.items()))),
+                ("tessera_http_slow_requests_total", "counter",
+                 "Requests slower than the slow-request threshold.",
+                 [f"tessera_http_slow_requests_total{_labels(('route',), (route,))} {count}"
+                  for route, count in sorted(self._slow.items())]),
+            ]
+
+        out = []
+        for name, kind, help_text, lines in sections:
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            out.extend(lines)
+        for name, kind, help_text, value in gauges:
+            out.append(f"# HELP {name} {help_text}")
+            out.append(f"# TYPE {name} {kind}")
+            if isinstance(value, list):
+                out.extend(f"{name}{_labels(labels.keys(), labels.values())} {sample}" for labels, sample in value)
+            else:
+                out.append(f"{name} {value}")
+        return "\n".join(out) + "\n"
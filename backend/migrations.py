@@ -0,0 +1,585 @@
+"""Versioned schema migrations for the Tessera database.
+
+The app runs ``migrate()`` at startup. Each migration runs once, in its
+own transaction, and is recorded in the SchemaMigrations table. Migrations
+must be safe to run against a database whose schema was edited by hand,
+so they check before they create.
+
+Run from backend/:
+
+    python migrations.py              # apply pending migrations
+    python migrations.py status       # show applied and pending migrations
+    python migrations.py explain      # EXPLAIN QUERY PLAN for each endpoint's SQL
+"""
+import argparse
+import logging
+import sqlite3
+import sys
+import time
+
+import archive
+from catalog import search_query
+from exports import Export
+from tickethistory import past_query, upcoming_query
+
+DB_PATH = "../database/tessera.db"
+
+logger = logging.getLogger(__name__)
+
+
+def column_names(conn, table):
+    return {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+
+
+def has_unique_index(conn, table, columns):
+    """True if some unique index (or key) on ``table`` covers exactly ``columns``."""
+    for index in conn.execute(f"PRAGMA index_list({table})"):
+        if not index[2]:
+            continue
+        indexed = [row[2] for row in conn.execute(f"PRAGMA index_info('{index[1]}')")]
+        if indexed == list(columns):
+            return True
+    return False
+
+
+def add_seat_holds(conn):
+    ticket_columns = column_names(conn, "Tickets")
+    if "heldBy" not in ticket_columns:
+        conn.execute("ALTER TABLE Tickets ADD COLUMN heldBy INTEGER")
+    if "holdExpiresAt" not in ticket_columns:
+        conn.execute("ALTER TABLE Tickets ADD COLUMN holdExpiresAt REAL")
+        # Reservations made before holds existed have no owner and would never
+        # expire; let the first sweep hand them back.
+        conn.execute(
+            "UPDATE Tickets SET holdExpiresAt = ? WHERE status = 'RESERVED'",
+            (time.time(),),
+        )
+    if "holdTtlSeconds" not in column_names(conn, "Events"):
+        conn.execute("ALTER TABLE Events ADD COLUMN holdTtlSeconds INTEGER")
+
+    # Only held seats carry an expiry, so the partial index stays small
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_tickets_hold_expiry
+        ON Tickets(holdExpiresAt)
+        WHERE holdExpiresAt IS NOT NULL
+    """)
+
+
+def add_event_listing_indexes(conn):
+    # The rowid (event_id) is implicitly the last column of every index, so
+    # these also serve the (date, event_id) keyset order.
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_date ON Events(date)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_events_location_date ON Events(location, date)")
+
+
+def add_hot_path_indexes(conn):
+    # Every seat lookup is by (event_id, rowName, seatNumber), and a seat must
+    # never be sold twice. Both are usually the tables' own keys already.
+    if not has_unique_index(conn, "Tickets", ("event_id", "rowName", "seatNumber")):
+        conn.execute("""
+            CREATE UNIQUE INDEX idx_tickets_seat
+            ON Tickets(event_id, rowName, seatNumber)
+        """)
+    if not has_unique_index(conn, "TicketSales", ("event_id", "rowName", "seatNumber")):
+        conn.execute("""
+            CREATE UNIQUE INDEX idx_ticketsales_seat
+            ON TicketSales(event_id, rowName, seatNumber)
+        """)
+    # /profile looks sales up by buyer and joins them to Events
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ticketsales_user ON TicketSales(userId, event_id)")
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_pricetiers_event ON PriceTiers(event_id)")
+
+
+def add_checkout_requests(conn):
+    # One row per completed checkout that carried an Idempotency-Key, so a
+    # retried request gets the original result back
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS CheckoutRequests (
+            userId INTEGER NOT NULL,
+            idempotencyKey TEXT NOT NULL,
+            requestHash TEXT NOT NULL,
+            statusCode INTEGER NOT NULL,
+            response TEXT NOT NULL,
+            createdAt REAL NOT NULL,
+            PRIMARY KEY (userId, idempotencyKey)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_checkoutrequests_created ON CheckoutRequests(createdAt)")
+
+
+def add_seat_versions(conn):
+    # A counter per event that moves on every ticket status change, whoever
+    # makes it, so each app process can tell when another one changed seats
+    # it holds in memory. Seeded with the seats already taken, which also
+    # ranks events by activity for warm-up.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS SeatVersions (
+            event_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO SeatVersions (event_id, version)
+        SELECT event_id, COUNT(*) FROM Tickets WHERE status != 'AVAILABLE' GROUP BY event_id
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_seat_version
+        AFTER UPDATE OF status ON Tickets
+        WHEN OLD.status IS NOT NEW.status
+        BEGIN
+            INSERT INTO SeatVersions (event_id, version) VALUES (NEW.event_id, 1)
+            ON CONFLICT (event_id) DO UPDATE SET version = version + 1;
+        END
+    """)
+
+
+def add_waiting_room(conn):
+    # Buyers admitted per second from the event's waiting room; NULL means no waiting room
+    if "waitingRoomRate" not in column_names(conn, "Events"):
+        conn.execute("ALTER TABLE Events ADD COLUMN waitingRoomRate REAL")
+
+
+def add_event_search(conn):
+    # Full-text index over the searchable event columns. It reads the text
+    # from Events itself (external content), so it only stores the index,
+    # and the triggers keep it in step with every insert, update and delete.
+    exists = conn.execute(
+        "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'EventSearch'"
+    ).fetchone()
+    if not exists:
+        # Prefixes of two to four letters get their own index entries, so the
+        # short prefixes typed first don't merge every term that starts with them
+        conn.execute("""
+            CREATE VIRTUAL TABLE EventSearch USING fts5(
+                name, description, location,
+                content='Events', content_rowid='event_id',
+                tokenize='unicode61 remove_diacritics 2',
+                prefix='2 3 4'
+            )
+        """)
+        conn.execute("INSERT INTO EventSearch(EventSearch) VALUES ('rebuild')")
+        # A match in the name counts most, then the location, then the description
+        conn.execute("INSERT INTO EventSearch(EventSearch, rank) VALUES ('rank', 'bm25(10.0, 1.0, 4.0)')")
+
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_events_search_insert
+        AFTER INSERT ON Events
+        BEGIN
+            INSERT INTO EventSearch (rowid, name, description, location)
+            VALUES (NEW.event_id, NEW.name, NEW.description, NEW.location);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_events_search_delete
+        AFTER DELETE ON Events
+        BEGIN
+            INSERT INTO EventSearch (EventSearch, rowid, name, description, location)
+            VALUES ('delete', OLD.event_id, OLD.name, OLD.description, OLD.location);
+        END
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_events_search_update
+        AFTER UPDATE OF event_id, name, description, location ON Events
+        BEGIN
+            INSERT INTO EventSearch (EventSearch, rowid, name, description, location)
+            VALUES ('delete', OLD.event_id, OLD.name, OLD.description, OLD.location);
+            INSERT INTO EventSearch (rowid, name, description, location)
+            VALUES (NEW.event_id, NEW.name, NEW.description, NEW.location);
+        END
+    """)
+
+
+def tier_stats_delta(row, sign):
+    # Trigger statement that adds (sign +1) or removes (-1) one seat of
+    # ``row`` (NEW or OLD) in EventTierStats
+    return f"""
+        INSERT INTO EventTierStats (event_id, tier_id, available, reserved, sold, revenueCents)
+        VALUES (
+            {row}.event_id, {row}.priceTierId,
+            {sign} * ({row}.status = 'AVAILABLE'),
+            {sign} * ({row}.status = 'RESERVED'),
+            {sign} * ({row}.status = 'SOLD'),
+            CASE WHEN {row}.status = 'SOLD'
+                 THEN {sign} * (SELECT priceCents FROM PriceTiers WHERE id = {row}.priceTierId)
+                 ELSE 0 END
+        )
+        ON CONFLICT (event_id, tier_id) DO UPDATE SET
+            available = available + excluded.available,
+            reserved = reserved + excluded.reserved,
+            sold = sold + excluded.sold,
+            revenueCents = revenueCents + excluded.revenueCents;
+    """
+
+
+def add_event_tier_stats(conn):
+    # Seat counts and revenue per event and price tier, kept current by
+    # triggers on Tickets so they change in the same transaction as the
+    # seats do, whoever changes them. Admin dashboards read these instead
+    # of counting Tickets. Revenue is added at the tier's price when a seat
+    # is sold and taken back out if it ever stops being sold.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS EventTierStats (
+            event_id INTEGER NOT NULL,
+            tier_id INTEGER NOT NULL,
+            available INTEGER NOT NULL DEFAULT 0,
+            reserved INTEGER NOT NULL DEFAULT 0,
+            sold INTEGER NOT NULL DEFAULT 0,
+            revenueCents INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (event_id, tier_id)
+        ) WITHOUT ROWID
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO EventTierStats (event_id, tier_id, available, reserved, sold, revenueCents)
+        SELECT t.event_id, t.priceTierId,
+               SUM(t.status = 'AVAILABLE'), SUM(t.status = 'RESERVED'), SUM(t.status = 'SOLD'),
+               SUM(CASE WHEN t.status = 'SOLD' THEN p.priceCents ELSE 0 END)
+        FROM Tickets t
+        LEFT JOIN PriceTiers p ON p.id = t.priceTierId
+        GROUP BY t.event_id, t.priceTierId
+    """)
+
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_stats_insert
+        AFTER INSERT ON Tickets
+        BEGIN {tier_stats_delta("NEW", 1)} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_stats_delete
+        AFTER DELETE ON Tickets
+        BEGIN {tier_stats_delta("OLD", -1)} END
+    """)
+    conn.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_tickets_stats_update
+        AFTER UPDATE OF event_id, status, priceTierId ON Tickets
+        WHEN OLD.status IS NOT NEW.status OR OLD.event_id IS NOT NEW.event_id
+             OR OLD.priceTierId IS NOT NEW.priceTierId
+        BEGIN {tier_stats_delta("OLD", -1)} {tier_stats_delta("NEW", 1)} END
+    """)
+
+
+def add_ticket_admission(conn):
+    # When and at which gate each ticket was scanned in; NULL until then
+    sale_columns = column_names(conn, "TicketSales")
+    if "admittedAt" not in sale_columns:
+        conn.execute("ALTER TABLE TicketSales ADD COLUMN admittedAt REAL")
+    if "admittedGate" not in sale_columns:
+        conn.execute("ALTER TABLE TicketSales ADD COLUMN admittedGate TEXT")
+    # Gate scanners load an event's sales, and later only the ones after the
+    # last sale they have; the implicit rowid makes this (event_id, id)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_ticketsales_event ON TicketSales(event_id)")
+
+
+def add_jobs(conn):
+    # Long-running admin tasks run in the background; any worker can report on them from here
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS Jobs (
+            id TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            status TEXT NOT NULL,
+            details TEXT,
+            result TEXT,
+            error TEXT,
+            worker TEXT NOT NULL,
+            createdAt REAL NOT NULL,
+            startedAt REAL,
+            finishedAt REAL
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_jobs_created ON Jobs(createdAt)")
+
+
+def add_event_archiving(conn):
+    # When an event's tickets and sales started moving to the archive database (archive.py)
+    if "archivedAt" not in column_names(conn, "Events"):
+        conn.execute("ALTER TABLE Events ADD COLUMN archivedAt REAL")
+    # Archiving deletes the event's tickets from Tickets; its seat counts and
+    # revenue stay as they were when it was archived
+    conn.execute("DROP TRIGGER IF EXISTS trg_tickets_stats_delete")
+    conn.execute(f"""
+        CREATE TRIGGER trg_tickets_stats_delete
+        AFTER DELETE ON Tickets
+        WHEN (SELECT archivedAt FROM Events WHERE event_id = OLD.event_id) IS NULL
+        BEGIN {tier_stats_delta("OLD", -1)} END
+    """)
+
+
+def add_ticket_history(conn):
+    # /profile pages through a buyer's tickets by event date (tickethistory.py).
+    # Each sale carries its event's date, '' if it has none, so one index
+    # holds them in page order and covers the page without the table.
+    if "eventDate" not in column_names(conn, "TicketSales"):
+        conn.execute("ALTER TABLE TicketSales ADD COLUMN eventDate TEXT NOT NULL DEFAULT ''")
+    conn.execute("""
+        UPDATE TicketSales
+        SET eventDate = COALESCE((SELECT date FROM Events e WHERE e.event_id = TicketSales.event_id), '')
+    """)
+    conn.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_events_sale_date
+        AFTER UPDATE OF date ON Events
+        WHEN OLD.date IS NOT NEW.date
+        BEGIN
+            UPDATE TicketSales SET eventDate = COALESCE(NEW.date, '') WHERE event_id = NEW.event_id;
+        END
+    """)
+    conn.execute("""
+        CREATE INDEX IF NOT EXISTS idx_ticketsales_history
+        ON TicketSales(userId, eventDate, event_id, rowName, seatNumber, barcode, purchasedAt)
+    """)
+    # Only /profile used the old (userId, event_id) index
+    conn.execute("DROP INDEX IF EXISTS idx_ticketsales_user")
+
+    # A counter per buyer that moves whenever one of their sales is added or
+    # removed, whoever does it, so cached /profile pages can be checked with
+    # one lookup. Seeded with the sales already made.
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS UserSaleVersions (
+            userId INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL
+        )
+    """)
+    conn.execute("""
+        INSERT OR IGNORE INTO UserSaleVersions (userId, version)
+        SELECT userId, COUNT(*) FROM TicketSales GROUP BY userId
+    """)
+    for name, event, row in (("insert", "INSERT", "NEW"), ("delete", "DELETE", "OLD")):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_ticketsales_user_version_{name}
+            AFTER {event} ON TicketSales
+            BEGIN
+                INSERT INTO UserSaleVersions (userId, version) VALUES ({row}.userId, 1)
+                ON CONFLICT (userId) DO UPDATE SET version = version + 1;
+            END
+        """)
+
+
+def add_event_provisioning(conn):
+    # 1 while provision_event_in_batches() is still writing the event's tickets.
+    # Buyers can't see or book the event until it is cleared.
+    if "provisioning" not in column_names(conn, "Events"):
+        conn.execute("ALTER TABLE Events ADD COLUMN provisioning INTEGER NOT NULL DEFAULT 0")
+
+
+# (version, name, function). Append only; never renumber or edit a migration
+# that has shipped.
+MIGRATIONS = [
+    (1, "seat_holds", add_seat_holds),
+    (2, "event_listing_indexes", add_event_listing_indexes),
+    (3, "hot_path_indexes", add_hot_path_indexes),
+    (4, "checkout_requests", add_checkout_requests),
+    (5, "seat_versions", add_seat_versions),
+    (6, "waiting_room", add_waiting_room),
+    (7, "event_search", add_event_search),
+    (8, "event_tier_stats", add_event_tier_stats),
+    (9, "ticket_admission", add_ticket_admission),
+    (10, "jobs", add_jobs),
+    (11, "event_archiving", add_event_archiving),
+    (12, "ticket_history", add_ticket_history),
+    (13, "event_provisioning", add_event_provisioning),
+]
+
+
+def ensure_migrations_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS SchemaMigrations (
+            version INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            appliedAt DATETIME NOT NULL DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    conn.commit()
+
+
+def applied_versions(conn):
+    return {row[0] for row in conn.execute("SELECT version FROM SchemaMigrations")}
+
+
+def current_version(conn):
+    ensure_migrations_table(conn)
+    row = conn.execute("SELECT MAX(version) FROM SchemaMigrations").fetchone()
+    return row[0] or 0
+
+
+def migrate(conn, log=logger.info):
+    """Apply every pending migration. Returns the list of versions applied.
+
+    Each one is reported through ``log``; the app logs them, the command line prints them.
+    """
+    ensure_migrations_table(conn)
+    applied = []
+    for version, name, function in MIGRATIONS:
+        # Another worker may be migrating the same file; the write lock
+        # serializes us, and the version is re-checked once we hold it.
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            if version in applied_versions(conn):
+                conn.rollback()
+                continue
+            started = time.perf_counter()
+            function(conn)
+            conn.execute(
+                "INSERT INTO SchemaMigrations (version, name) VALUES (?, ?)",
+                (version, name),
+            )
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        applied.append(version)
+        if log:
+            log(f"applied migration {version} {name} in {(time.perf_counter() - started) * 1000:.1f}ms")
+    return applied
+
+
+# The SQL behind each endpoint's hot path, with sample parameters, so the
+# plans can be checked after a schema change. Keep in step with app.py.
+ENDPOINT_QUERIES = [
+    ("GET /events?afterDate", """
+        SELECT event_id, name, date FROM Events WHERE date > ? AND provisioning = 0
+        ORDER BY date, event_id LIMIT ?
+    """, ("2026-01-01", 101)),
+    ("GET /events?afterDate&location", """
+        SELECT event_id, name, date FROM Events WHERE date > ? AND location = ? AND provisioning = 0
+        ORDER BY date, event_id LIMIT ?
+    """, ("2026-01-01", "Downtown", 101)),
+    ("GET /events?cursor", """
+        SELECT event_id, name, date FROM Events WHERE (date, event_id) > (?, ?) AND provisioning = 0
+        ORDER BY date, event_id LIMIT ?
+    """, ("2026-01-01", 1, 101)),
+    ("GET /events/search", *search_query(
+        ["event_id", "name", "date"], "jazz", after_date="2026-01-01",
+    )[:2]),
+    ("GET /events/<id>", """
+        SELECT * FROM Events WHERE event_id = ? AND provisioning = 0
+    """, (1,)),
+    ("GET /admin/events/<id>/stats", """
+        SELECT p.id, p.name, p.priceCents, s.available, s.reserved, s.sold, s.revenueCents
+        FROM PriceTiers p
+        LEFT JOIN EventTierStats s ON s.event_id = p.event_id AND s.tier_id = p.id
+        WHERE p.event_id = ? ORDER BY p.priceCents DESC, p.id
+    """, (1,)),
+    ("GET /events/<id>/seats-with-prices", """
+        SELECT rowName, seatNumber, status, priceTierId FROM Tickets
+        WHERE event_id = ? ORDER BY length(rowName), rowName, seatNumber
+    """, (1,)),
+    ("GET /events/<id>/seats-with-prices (tiers)", """
+        SELECT id, name, priceCents FROM PriceTiers WHERE event_id = ?
+    """, (1,)),
+    ("GET /events/<id>/seats-with-prices (sold)", """
+        SELECT rowName, seatNumber FROM TicketSales WHERE event_id = ?
+    """, (1,)),
+    ("seat state load", """
+        SELECT rowName, MIN(seatNumber), MAX(seatNumber) FROM Tickets
+        WHERE event_id = ? GROUP BY rowName ORDER BY rowName
+    """, (1,)),
+    ("POST /reserve_seats", """
+        UPDATE Tickets SET status = 'RESERVED', heldBy = ?, holdExpiresAt = ?
+        WHERE event_id = ? AND status = 'AVAILABLE' AND (rowName, seatNumber) IN (VALUES (?, ?))
+    """, (1, 0, 1, "A", 1)),
+    ("POST /purchase_seats", """
+        UPDATE Tickets SET status = 'SOLD', heldBy = NULL, holdExpiresAt = NULL
+        WHERE event_id = ? AND status = 'RESERVED' AND heldBy = ? AND holdExpiresAt > ?
+          AND (rowName, seatNumber) IN (VALUES (?, ?))
+    """, (1, 1, 0, "A", 1)),
+    ("POST /purchase_seats (replay)", """
+        SELECT requestHash, statusCode, response, createdAt FROM CheckoutRequests
+        WHERE userId = ? AND idempotencyKey = ?
+    """, (1, "key")),
+    ("POST /purchase_seats (prune)", """
+        DELETE FROM CheckoutRequests WHERE createdAt < ?
+    """, (0,)),
+    ("POST /events/<id>/scan (load)", """
+        SELECT id, barcode, rowName, seatNumber, admittedAt, admittedGate FROM TicketSales
+        WHERE event_id = ? AND id > ? ORDER BY id
+    """, (1, 0)),
+    ("POST /events/<id>/scan (admit)", """
+        UPDATE TicketSales SET admittedAt = ?, admittedGate = ? WHERE barcode = ? AND admittedAt IS NULL
+    """, (0, "North 1", "T1-1-X-Y")),
+    ("GET /admin/jobs/<id>", """
+        SELECT * FROM Jobs WHERE id = ?
+    """, ("0" * 32,)),
+    ("GET /admin/jobs", """
+        SELECT * FROM Jobs ORDER BY createdAt DESC LIMIT ?
+    """, (50,)),
+    ("seat version sync", """
+        SELECT event_id, version FROM SeatVersions WHERE event_id IN (?, ?)
+    """, (1, 2)),
+    ("hold sweeper", """
+        SELECT rowid FROM Tickets WHERE status = 'RESERVED' AND holdExpiresAt <= ? LIMIT ?
+    """, (0, 500)),
+    ("GET /profile (upcoming)", *upcoming_query(1, "2026-01-01", None, 51)),
+    ("GET /profile (upcoming, cursor)", *upcoming_query(1, "2026-01-01", ("2026-02-01", 1, "A", 1), 51)),
+    ("GET /profile (past)", *past_query(1, "2026-01-01", None, 51)),
+    ("GET /profile (past, cursor)", *past_query(1, "2026-01-01", ("2025-12-01", 1, "A", 1), 51)),
+    ("GET /emails (batch)", *Export("emails", "Users", ["email"], key="user_id").batch_query(1000)),
+    ("GET /admin/export/sales (batch)", *Export(
+        "sales", "TicketSales", ["event_id", "userId", "barcode", "purchasedAt"], key="id",
+    ).batch_query(1000)),
+    ("GET /admin/events/<id>/barcodes (batch)", *Export(
+        "barcodes", "TicketSales", ["barcode", "rowName", "seatNumber", "admittedAt"], key="id",
+        where="event_id = ?", params=(1,),
+    ).batch_query(1000)),
+    ("POST /login", """
+        SELECT password_hash, user_id, admin FROM Users WHERE username = ?
+    """, ("admin",)),
+]
+
+
+def explain(conn, out=sys.stdout):
+    """Print the query plan for every endpoint query. Returns the names of
+    queries that full-scan a table."""
+    scans = []
+    for name, sql, params in ENDPOINT_QUERIES:
+        out.write(f"{name}\n")
+        try:
+            plan = conn.execute("EXPLAIN QUERY PLAN " + sql, params).fetchall()
+        except sqlite3.OperationalError as e:
+            out.write(f"    error: {e} (run migrations first?)\n")
+            continue
+        subqueries = set()
+        for row in plan:
+            detail = row[3]
+            out.write(f"    {detail}\n")
+            if detail.startswith(("MATERIALIZE ", "CO-ROUTINE ")):
+                subqueries.add(detail.split()[1])
+            # "SCAN t USING [COVERING] INDEX" walks an index, a constant row
+            # is the VALUES list, and a materialized subquery or co-routine was
+            # already bounded when it was built, so none of them reads a whole table
+            if (detail.startswith("SCAN") and "INDEX" not in detail and "CONSTANT ROW" not in detail
+                    and detail.split()[1] not in subqueries):
+                scans.append(name)
+    return scans
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Tessera schema migrations")
+    parser.add_argument("command", nargs="?", default="migrate", choices=("migrate", "status", "explain"))
+    parser.add_argument("--db", default=DB_PATH, help="path to the SQLite database")
+    args = parser.parse_args(argv)
+
+    conn = sqlite3.connect(args.db)
+    try:
+        if args.command == "migrate":
+            if not migrate(conn, log=print):
+                print(f"already at version {current_version(conn)}")
+        elif args.command == "status":
+            version = current_version(conn)
+            applied = applied_versions(conn)
+            print(f"schema version {version}")
+            for number, name, _ in MIGRATIONS:
+                print(f"  {number:>3} {name:<30} {'applied' if number in applied else 'pending'}")
+        else:
+            # An empty archive with the same tables, so queries that read it can be planned
+            archive.attach(conn, ":memory:")
+            archive.create_schema(conn)
+            scans = explain(conn)
+            if scans:
+                print(f"full table scans in: {', '.join(sorted(set(scans)))}")
+                return 1
+            print("no full table scans")
+    finally:
+        conn.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
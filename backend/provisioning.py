@@ -0,0 +1,268 @@
+import itertools
+import string
+import time
+
+# Tickets are written in executemany batches of this many rows
+DEFAULT_CHUNK_SIZE = 10000
+
+# Tickets written per seat writer transaction by provision_event_in_batches()
+WRITE_BATCH_SIZE = 2000
+
+
+class LayoutError(ValueError):
+    pass
+
+
+def row_label(index):
+    """Spreadsheet-style row name for a zero-based index: A..Z, AA..AZ, BA..."""
+    label = ""
+    index += 1
+    while index:
+        index, remainder = divmod(index - 1, 26)
+        label = string.ascii_uppercase[remainder] + label
+    return label
+
+
+def row_index(label):
+    """Inverse of ``row_label``."""
+    if not label or not all(char in string.ascii_uppercase for char in label):
+        raise LayoutError(f"row label {label!r} must be uppercase letters")
+    index = 0
+    for char in label:
+        index = index * 26 + string.ascii_uppercase.index(char) + 1
+    return index - 1
+
+
+def grid_layout(num_rows, seats_per_row, tier="Middle", price_cents=10000):
+    """The single-section, single-tier layout the original script created."""
+    return {
+        "tiers": {tier: price_cents},
+        "sections": [{"name": "Main", "tier": tier, "rows": num_rows, "seatsPerRow": seats_per_row}],
+    }
+
+
+def _section_rows(section):
+    """Return [(rowName, first seat, seat count)] for one section of a layout."""
+    name = section.get("name", "?")
+    prefix = section.get("rowPrefix", "")
+    first_seat = section.get("firstSeat", 1)
+    rows = section.get("rows")
+
+    if isinstance(rows, int):
+        start = row_index(section.get("firstRow", "A"))
+        labels = [prefix + row_label(start + i) for i in range(rows)]
+    elif isinstance(rows, list) and all(isinstance(row, str) and row for row in rows):
+        labels = [prefix + row for row in rows]
+    else:
+        raise LayoutError(f"section {name}: rows must be a count or a list of row names")
+    if not labels:
+        raise LayoutError(f"section {name}: has no rows")
+
+    seats = section.get("seatsPerRow")
+    if isinstance(seats, int):
+        seats = [seats] * len(labels)
+    if not isinstance(seats, list) or len(seats) != len(labels):
+        raise LayoutError(f"section {name}: seatsPerRow must be a count or one count per row")
+    if not isinstance(first_seat, int) or first_seat < 1:
+        raise LayoutError(f"section {name}: firstSeat must be a positive integer")
+    if any(not isinstance(count, int) or count < 1 for count in seats):
+        raise LayoutError(f"section {name}: seat counts must be positive integers")
+
+    return [(label, first_seat, count) for label, count in zip(labels, seats)]
+
+
+def plan_layout(layout):
+    """Validate a venue layout and expand it into its rows.
+
+    A layout looks like::
+
+        {
+          "tiers": {"Floor": 15000, "Upper": 6000},
+          "sections": [
+            {"name": "Floor", "tier": "Floor", "rows": 30, "seatsPerRow": 40},
+            {"name": "Upper", "tier": "Upper", "rows": 40, "firstRow": "AE",
+             "seatsPerRow": [20, 22, 24], "firstSeat": 101, "rowPrefix": "U"}
+          ]
+        }
+
+    ``rows`` is a count (named A, B, ... Z, AA, AB ... from ``firstRow``) or
+    an explicit list of names, optionally prefixed with ``rowPrefix``.
+    ``seatsPerRow`` is one count for every row or one count per row. Seats
+    are numbered from ``firstSeat``.
+
+    Returns ``(tiers, rows)`` where ``rows`` is a list of
+    ``(tier name, rowName, first seat, seat count)``.
+    """
+    tiers = layout.get("tiers")
+    if not isinstance(tiers, dict) or not tiers:
+        raise LayoutError("layout needs a tiers map of tier name to priceCents")
+    for tier, price in tiers.items():
+        if not isinstance(price, int) or price <= 0:
+            raise LayoutError(f"tier {tier}: priceCents must be a positive integer")
+
+    sections = layout.get("sections")
+    if not isinstance(sections, list) or not sections:
+        raise LayoutError("layout needs at least one section")
+
+    rows = []
+    taken = {}  # rowName -> [(first, last)] so sections can share a row without overlapping
+    for section in sections:
+        tier = section.get("tier")
+        if tier not in tiers:
+            raise LayoutError(f"section {section.get('name', '?')}: unknown tier {tier!r}")
+        for row_name, first, count in _section_rows(section):
+            last = first + count - 1
+            for other_first, other_last in taken.get(row_name, []):
+                if first <= other_last and other_first <= last:
+                    raise LayoutError(f"row {row_name}: seats {first}-{last} overlap another section")
+            taken.setdefault(row_name, []).append((first, last))
+            rows.append((tier, row_name, first, count))
+    return tiers, rows
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(itertools.islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _insert_event(conn, event, tiers):
+    cursor = conn.execute("""
+        INSERT INTO Events (name, description, date, time, location, imageUrl, holdTtlSeconds)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (
+        event["name"],
+        event.get("description"),
+        event.get("date"),
+        event.get("time"),
+        event.get("location"),
+        event.get("imageUrl") or "",
+        event.get("holdTtlSeconds"),
+    ))
+    event_id = cursor.lastrowid
+
+    tier_ids = {}
+    for tier, price_cents in tiers.items():
+        cursor = conn.execute(
+            "INSERT INTO PriceTiers (event_id, name, priceCents) VALUES (?, ?, ?)",
+            (event_id, tier, price_cents),
+        )
+        tier_ids[tier] = cursor.lastrowid
+    return event_id, tier_ids
+
+
+def _tickets(event_id, rows, tier_ids):
+    return (
+        (event_id, row_name, seat, "AVAILABLE", tier_ids[tier])
+        for tier, row_name, first, count in rows
+        for seat in range(first, first + count)
+    )
+
+
+def _insert_tickets(conn, chunk):
+    conn.executemany("""
+        INSERT INTO Tickets (event_id, rowName, seatNumber, status, priceTierId)
+        VALUES (?, ?, ?, ?, ?)
+    """, chunk)
+
+
+def _result(event_id, tier_ids, created, started):
+    seconds = time.perf_counter() - started
+    return {
+        "event_id": event_id,
+        "priceTiers": tier_ids,
+        "tickets": created,
+        "seconds": round(seconds, 3),
+        "rowsPerSecond": round(created / seconds) if seconds else None,
+    }
+
+
+def provision_event(conn, event, layout, chunk_size=DEFAULT_CHUNK_SIZE, log=None):
+    """Create an event with its price tiers and every ticket in ``layout``.
+
+    Runs inside the caller's transaction and does not commit. Tickets are
+    generated lazily and written in ``chunk_size`` batches, so memory use
+    doesn't grow with the size of the venue.
+    """
+    tiers, rows = plan_layout(layout)
+    started = time.perf_counter()
+    event_id, tier_ids = _insert_event(conn, event, tiers)
+
+    created = 0
+    for chunk in _chunks(_tickets(event_id, rows, tier_ids), chunk_size):
+        _insert_tickets(conn, chunk)
+        created += len(chunk)
+        if log:
+            log(f"  {created} tickets written")
+    return _result(event_id, tier_ids, created, started)
+
+
+def provision_event_in_batches(write, event, layout, batch_size=WRITE_BATCH_SIZE, on_published=None, log=None):
+    """Like ``provision_event()``, as a series of short seat writer transactions.
+
+    ``write`` runs an operation on the seat writer and waits for it
+    (``run_write`` in app.py). The event and its tiers are created first,
+    marked as provisioning, then its tickets ``batch_size`` at a time, so
+    reservations and purchases for other events queue behind one batch at
+    most rather than the whole venue. Until the last batch is in, the
+    event isn't listed and its seats can't be reserved or bought; the
+    transaction that clears the flag calls ``on_published(event_id)`` once
+    it commits, with the seat write lock held.
+
+    If a batch fails, the event and the tickets written so far are removed
+    again, in batches too, and the error is raised.
+    """
+    tiers, rows = plan_layout(layout)
+    started = time.perf_counter()
+
+    def create(conn):
+        event_id, tier_ids = _insert_event(conn, event, tiers)
+        conn.execute("UPDATE Events SET provisioning = 1 WHERE event_id = ?", (event_id,))
+        return (event_id, tier_ids), None
+    event_id, tier_ids = write(create)
+
+    created = 0
+    try:
+        for chunk in _chunks(_tickets(event_id, rows, tier_ids), batch_size):
+            # The chunk is bound now, so a batch the writer has to run again writes the same seats
+            write(lambda conn, chunk=chunk: (_insert_tickets(conn, chunk), None))
+            created += len(chunk)
+            if log:
+                log(f"  {created} tickets written")
+
+        def publish(conn):
+            conn.execute("UPDATE Events SET provisioning = 0 WHERE event_id = ?", (event_id,))
+            return None, (lambda: on_published(event_id)) if on_published is not None else None
+        write(publish)
+    except Exception:
+        while write(lambda conn: (remove_event(conn, event_id, batch_size), None)):
+            pass
+        raise
+    return _result(event_id, tier_ids, created, started)
+
+
+def remove_event(conn, event_id, limit):
+    """Delete up to ``limit`` of an unsold event's tickets, and the event itself once they are gone.
+
+    Returns how many tickets were deleted; 0 means there are none left to
+    delete. Sold tickets are never deleted, and an event with sales is
+    kept along with its tiers, so its buyers keep their seats.
+    """
+    deleted = conn.execute("""
+        DELETE FROM Tickets WHERE rowid IN (
+            SELECT rowid FROM Tickets t
+            WHERE event_id = ? AND NOT EXISTS (
+                SELECT 1 FROM TicketSales s
+                WHERE s.event_id = t.event_id AND s.rowName = t.rowName AND s.seatNumber = t.seatNumber
+            )
+            LIMIT ?
+        )
+    """, (event_id, limit)).rowcount
+    if not deleted and conn.execute("SELECT 1 FROM TicketSales WHERE event_id = ?", (event_id,)).fetchone() is None:
+        conn.execute("DELETE FROM EventTierStats WHERE event_id = ?", (event_id,))
+        conn.execute("DELETE FROM PriceTiers WHERE event_id = ?", (event_id,))
+        conn.execute("DELETE FROM Events WHERE event_id = ?", (event_id,))
+    return deleted
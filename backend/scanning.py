@@ -0,0 +1,219 @@
+"""Signed ticket barcodes and the in-memory index gates scan them against.
+
+A barcode reads ``T1-<event_id>-<serial>-<mac>``: a random serial, so codes
+can't be guessed from the seat, and an HMAC over the rest, so a forged or
+mistyped code is turned away without looking anything up. The event id is
+part of the code, so a ticket for another event is recognised as such.
+
+Each worker loads an event's barcodes the first time a gate scans for it
+and answers every scan from memory after that. Barcodes issued before this
+format (``<event_id><row><seat>``) are still accepted for their own event,
+since the event comes from the scan URL.
+"""
+import base64
+import hashlib
+import hmac
+import secrets
+import threading
+import time
+
+BARCODE_VERSION = "T1"
+
+# Scan outcomes, as reported to the gate
+ADMITTED = "admitted"
+ALREADY_ADMITTED = "already_admitted"
+WRONG_EVENT = "wrong_event"
+INVALID = "invalid"
+UNKNOWN = "unknown"
+RESULTS = (ADMITTED, ALREADY_ADMITTED, WRONG_EVENT, INVALID, UNKNOWN)
+
+# An event nobody has scanned for this long is over; its barcodes are dropped from memory
+DEFAULT_MAX_IDLE = 6 * 60 * 60
+
+
+def _b32(raw):
+    return base64.b32encode(raw).decode().rstrip("=")
+
+
+class BarcodeSigner:
+    """Issues and checks signed barcodes.
+
+    Base32 keeps codes to the characters a QR code stores most compactly.
+    """
+
+    def __init__(self, secret):
+        self._key = (secret or "").encode()
+
+    def _mac(self, body):
+        return _b32(hmac.new(self._key, body.encode(), hashlib.sha256).digest()[:8])
+
+    def issue(self, event_id):
+        body = f"{BARCODE_VERSION}-{event_id}-{_b32(secrets.token_bytes(8))}"
+        return f"{body}-{self._mac(body)}"
+
+    def event_of(self, code):
+        """The event a signed barcode is for, None for a code in the old format, or False if it doesn't verify."""
+        if not code.startswith(BARCODE_VERSION + "-"):
+            return None
+        body, _, mac = code.rpartition("-")
+        parts = body.split("-")
+        if len(parts) != 3 or not parts[1].isdigit() or not hmac.compare_digest(mac, self._mac(body)):
+            return False
+        return int(parts[1])
+
+
+class _EventBarcodes:
+    __slots__ = ("tickets", "admitted", "last_sale_id", "last_scan")
+
+    def __init__(self):
+        self.tickets = {}  # barcode -> (rowName, seatNumber)
+        self.admitted = {}  # barcode -> (admittedAt, gate)
+        self.last_sale_id = 0
+        self.last_scan = time.monotonic()
+
+
+class ScanIndex:
+    """Per-event barcode index that answers gate scans without reading the database.
+
+    ``load_sales(event_id, after_sale_id)`` returns the event's sales with a
+    higher id as ``(id, barcode, rowName, seatNumber, admittedAt, gate)``.
+    It is called once when an event is first scanned, and again only when a
+    correctly signed barcode isn't in the index, which happens for tickets
+    another worker sold after the load.
+
+    An event is dropped once it hasn't been scanned for ``max_idle``
+    seconds, or when ``forget()`` is called after it was archived.
+    Admissions are saved to the database, so an event scanned again later
+    is simply loaded again.
+    """
+
+    def __init__(self, signer, load_sales, max_idle=DEFAULT_MAX_IDLE):
+        self.signer = signer
+        self.load_sales = load_sales
+        self.max_idle = max_idle
+        self._lock = threading.Lock()
+        self._load_lock = threading.Lock()
+        self._events = {}
+        self._loads = 0
+        self._evictions = 0
+        self._last_eviction = time.monotonic()
+        self._results = dict.fromkeys(RESULTS, 0)
+
+    def _apply(self, barcodes, sales):
+        for sale_id, code, row_name, seat_number, admitted_at, gate in sales:
+            barcodes.tickets[code] = (row_name, seat_number)
+            if admitted_at is not None:
+                barcodes.admitted.setdefault(code, (admitted_at, gate))
+            barcodes.last_sale_id = max(barcodes.last_sale_id, sale_id)
+
+    def _refresh(self, event_id, barcodes=None):
+        # One load at a time, so a gate rush on a cold event loads it once
+        with self._load_lock:
+            with self._lock:
+                current = self._events.get(event_id)
+            if barcodes is None and current is not None:
+                return current
+            target = current or _EventBarcodes()
+            sales = self.load_sales(event_id, target.last_sale_id)
+            with self._lock:
+                self._apply(target, sales)
+                self._events[event_id] = target
+                self._loads += 1
+            return target
+
+    def preload(self, event_id):
+        self._refresh(event_id)
+
+    def forget(self, event_id):
+        """Drop an event's barcodes, after it was archived."""
+        with self._lock:
+            if self._events.pop(event_id, None) is not None:
+                self._evictions += 1
+
+    def _evict_idle(self, now):
+        # Called with the lock held; looks at most once a minute
+        if now - self._last_eviction < 60:
+            return
+        self._last_eviction = now
+        for event_id in [event_id for event_id, barcodes in self._events.items()
+                         if now - barcodes.last_scan > self.max_idle]:
+            del self._events[event_id]
+            self._evictions += 1
+
+    def _count(self, result):
+        with self._lock:
+            self._results[result] += 1
+
+    def scan(self, event_id, code, gate=None, now=None):
+        """Check a scanned barcode and admit its holder if it is good.
+
+        Returns ``(result, ticket)``. ``ticket`` has the seat and, for a
+        repeat scan, when and where it was first admitted. An admitted scan
+        is marked in memory before this returns, so the same ticket at two
+        gates at once is only let in once.
+        """
+        signed_for = self.signer.event_of(code)
+        if signed_for is False:
+            self._count(INVALID)
+            return INVALID, None
+        if signed_for is not None and signed_for != event_id:
+            self._count(WRONG_EVENT)
+            return WRONG_EVENT, {"event_id": signed_for}
+
+        barcodes = self._refresh(event_id)
+        with self._lock:
+            seat = barcodes.tickets.get(code)
+        if seat is None and signed_for is not None:
+            # Genuine but not loaded yet: sold on another worker since the load
+            self._refresh(event_id, barcodes)
+
+        with self._lock:
+            barcodes.last_scan = time.monotonic()
+            self._evict_idle(barcodes.last_scan)
+            seat = barcodes.tickets.get(code)
+            if seat is None:
+                self._results[UNKNOWN] += 1
+                return UNKNOWN, None
+            ticket = {"rowName": seat[0], "seatNumber": seat[1]}
+            first = barcodes.admitted.get(code)
+            if first is not None:
+                self._results[ALREADY_ADMITTED] += 1
+                return ALREADY_ADMITTED, {**ticket, "admittedAt": first[0], "gate": first[1]}
+            now = time.time() if now is None else now
+            barcodes.admitted[code] = (now, gate)
+            self._results[ADMITTED] += 1
+            return ADMITTED, {**ticket, "admittedAt": now, "gate": gate}
+
+    def undo(self, event_id, code):
+        """Take back an admission that couldn't be saved, so the ticket can be scanned again."""
+        with self._lock:
+            barcodes = self._events.get(event_id)
+            if barcodes is not None:
+                barcodes.admitted.pop(code, None)
+            self._results[ADMITTED] -= 1
+
+    def admitted_elsewhere(self, event_id, code):
+        """Record that the database already had the ticket admitted, through another worker."""
+        with self._lock:
+            self._results[ADMITTED] -= 1
+            self._results[ALREADY_ADMITTED] += 1
+
+    def add(self, event_id, sales):
+        """Add ``(barcode, rowName, seatNumber)`` for tickets this worker just sold, if the event is loaded."""
+        with self._lock:
+            barcodes = self._events.get(event_id)
+            if barcodes is not None:
+                for code, row_name, seat_number in sales:
+                    barcodes.tickets[code] = (row_name, seat_number)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "events": {
+                    str(event_id): {"tickets": len(barcodes.tickets), "admitted": len(barcodes.admitted)}
+                    for event_id, barcodes in self._events.items()
+                },
+                "loads": self._loads,
+                "evictions": self._evictions,
+                "scans": dict(self._results),
+            }
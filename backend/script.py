@@ -1,64 +1,28 @@
+import argparse
+import json
 import sqlite3
-import string
+import sys
+
+from provisioning import DEFAULT_CHUNK_SIZE, LayoutError, grid_layout, provision_event
 
 DB_PATH = "../database/tessera.db"
 
-def create_event_with_tickets(event_name, num_rows, seats_per_row):
-    conn = sqlite3.connect(DB_PATH)
+
+def connect(db_path=DB_PATH):
+    conn = sqlite3.connect(db_path, timeout=30)
     conn.execute("PRAGMA foreign_keys = ON;")
-    curr = conn.cursor()
+    conn.execute("PRAGMA journal_mode = WAL;")
+    conn.execute("PRAGMA synchronous = NORMAL;")
+    return conn
 
-    try:
-        # 1. Create the event
-        curr.execute(
-            """
-            INSERT INTO Events (name)
-            VALUES (?);
-            """,
-            (event_name,)
-        )
-
-        event_id = curr.lastrowid
-        print(f"Created event '{event_name}' with event_id = {event_id}")
-
-        # 2. Create a default price tier
-        curr.execute(
-            """
-            INSERT INTO PriceTiers (event_id, name, priceCents)
-            VALUES (?, ?, ?);
-            """,
-            (event_id, "Middle", 10000)
-        )
-
-        price_tier_id = curr.lastrowid
-        print(f"Created default price tier with id = {price_tier_id}")
-
-        # 3. Generate tickets
-        rows = string.ascii_uppercase[:num_rows]
-
-        tickets = []
-        for row in rows:
-            for seat in range(1, seats_per_row + 1):
-                tickets.append(
-                    (event_id, row, seat, "AVAILABLE", price_tier_id)
-                )
-
-        curr.executemany(
-            """
-            INSERT INTO Tickets (
-                event_id,
-                rowName,
-                seatNumber,
-                status,
-                priceTierId
-            )
-            VALUES (?, ?, ?, ?, ?);
-            """,
-            tickets
-        )
-
-        print(f"Created {len(tickets)} tickets")
 
+def provision(event, layout, db_path=DB_PATH, chunk_size=DEFAULT_CHUNK_SIZE, progress=print):
+    conn = connect(db_path)
+
+    try:
+        # One transaction for the event, its tiers and every ticket
+        conn.execute("BEGIN IMMEDIATE")
+        result = provision_event(conn, event, layout, chunk_size=chunk_size, log=progress)
         conn.commit()
 
     except Exception as e:
@@ -68,10 +32,64 @@ def create_event_with_tickets(event_name, num_rows, seats_per_row):
     finally:
         conn.close()
 
+    print(f"Created event '{event['name']}' with event_id = {result['event_id']}")
+    for tier, tier_id in result["priceTiers"].items():
+        print(f"Created price tier '{tier}' with id = {tier_id}")
+    print(f"Created {result['tickets']} tickets in {result['seconds']}s "
+          f"({result['rowsPerSecond']} rows/s)")
+    return result
 
-if __name__ == "__main__":
-    event_name = input("Event name: ")
-    num_rows = int(input("Number of rows: "))
-    seats_per_row = int(input("Seats per row: "))
 
-    create_event_with_tickets(event_name, num_rows, seats_per_row)
\ No newline at end of file
+def create_event_with_tickets(event_name, num_rows, seats_per_row):
+    return provision({"name": event_name}, grid_layout(num_rows, seats_per_row))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Create an event with its price tiers and tickets.",
+        epilog="Give either --layout or both --rows and --seats-per-row.",
+    )
+    parser.add_argument("--name", required=True, help="event name")
+    parser.add_argument("--description")
+    parser.add_argument("--date", help="YYYY-MM-DD")
+    parser.add_argument("--time", help="HH:MM:SS")
+    parser.add_argument("--location")
+    parser.add_argument("--image-url", default="")
+    parser.add_argument("--hold-ttl", type=int, help="seconds a reservation is held")
+    parser.add_argument("--layout", help="venue layout JSON file with tiers and sections")
+    parser.add_argument("--rows", type=int, help="rows for a simple single-tier grid")
+    parser.add_argument("--seats-per-row", type=int, help="seats per row for a simple grid")
+    parser.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    parser.add_argument("--db", default=DB_PATH, help="path to the SQLite database")
+    parser.add_argument("--quiet", action="store_true", help="don't report progress per chunk")
+    args = parser.parse_args(argv)
+
+    if args.layout:
+        with open(args.layout) as f:
+            layout = json.load(f)
+    elif args.rows and args.seats_per_row:
+        layout = grid_layout(args.rows, args.seats_per_row)
+    else:
+        parser.error("give --layout, or --rows and --seats-per-row")
+
+    event = {
+        "name": args.name,
+        "description": args.description,
+        "date": args.date,
+        "time": args.time,
+        "location": args.location,
+        "imageUrl": args.image_url,
+        "holdTtlSeconds": args.hold_ttl,
+    }
+
+    try:
+        provision(event, layout, db_path=args.db, chunk_size=args.chunk_size,
+                  progress=None if args.quiet else print)
+    except LayoutError as e:
+        print(f"Invalid layout: {e}", file=sys.stderr)
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,119 @@
+import os
+import threading
+from collections import OrderedDict
+
+
+class SeatMapCache:
+    """Serialized seat maps keyed by a per-event version counter.
+
+    Every write that changes a seat bumps the event's version, which makes
+    the cached map stale without having to rebuild it on the spot. Entries
+    are evicted least-recently-used once either ``max_events`` or
+    ``max_bytes`` is exceeded.
+
+    Each event keeps one body per variant (format and content coding) of
+    its current version; they all go stale together.
+
+    Versions only live in this process, so ETags and stream cursors carry a
+    per-process token to keep a restarted server from matching ones handed
+    out before.
+    """
+
+    def __init__(self, max_events=256, max_bytes=64 * 1024 * 1024):
+        self.max_events = max_events
+        self.max_bytes = max_bytes
+
+        self.token = os.urandom(4).hex()
+        self._lock = threading.Lock()
+        self._versions = {}
+        self._entries = OrderedDict()  # event_id -> (version, {variant: body})
+        self._bytes = 0
+        self._hits = 0
+        self._misses = 0
+        self._not_modified = 0
+        self._evictions = 0
+
+    def version(self, event_id):
+        with self._lock:
+            return self._versions.get(event_id, 0)
+
+    def bump(self, event_id):
+        with self._lock:
+            version = self._versions.get(event_id, 0) + 1
+            self._versions[event_id] = version
+            return version
+
+    def etag(self, event_id, version):
+        return f"{self.token}-{event_id}-{version}"
+
+    def cursor(self, version):
+        """Opaque position in an event's change stream, valid for this process only."""
+        return f"{self.token}.{version}"
+
+    def parse_cursor(self, cursor):
+        """Return the version in a cursor from ``cursor()``, or None if it can't be resumed."""
+        token, _, version = (cursor or "").partition(".")
+        if token != self.token or not version.isdigit():
+            return None
+        return int(version)
+
+    def not_modified(self):
+        with self._lock:
+            self._not_modified += 1
+
+    def get(self, event_id, version, variant="json"):
+        """Return the cached body for this version and variant of the seat map, or None."""
+        with self._lock:
+            entry = self._entries.get(event_id)
+            body = entry[1].get(variant) if entry is not None and entry[0] == version else None
+            if body is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(event_id)
+            self._hits += 1
+            return body
+
+    def put(self, event_id, version, body, variant="json"):
+        with self._lock:
+            # A write landed while this map was being built; it is already stale
+            if version != self._versions.get(event_id, 0):
+                return
+            if len(body) > self.max_bytes:
+                return
+            entry = self._entries.get(event_id)
+            if entry is None or entry[0] != version:
+                self._evict(event_id)
+                entry = self._entries[event_id] = (version, {})
+            old = entry[1].pop(variant, None)
+            if old is not None:
+                self._bytes -= len(old)
+            entry[1][variant] = body
+            self._bytes += len(body)
+            self._entries.move_to_end(event_id)
+            while len(self._entries) > self.max_events or self._bytes > self.max_bytes:
+                self._evict(next(iter(self._entries)))
+                self._evictions += 1
+
+    def _evict(self, event_id):
+        entry = self._entries.pop(event_id, None)
+        if entry is not None:
+            self._bytes -= sum(len(body) for body in entry[1].values())
+
+    def event_ids(self):
+        with self._lock:
+            return list(self._entries)
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "events": len(self._entries),
+                "bytes": self._bytes,
+                "maxEvents": self.max_events,
+                "maxBytes": self.max_bytes,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hitRatio": round(self._hits / lookups, 4) if lookups else None,
+                "notModified": self._not_modified,
+                "evictions": self._evictions,
+            }
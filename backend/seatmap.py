@@ -0,0 +1,177 @@
+"""Seat map wire formats and response compression.
+
+The default ``json`` format sends one object per seat::
+
+    {"A": [{"seatNumber": 1, "status": "AVAILABLE", "priceCents": 15000}, ...]}
+
+The compact ``runs`` format sends each row as runs of consecutive seats
+that share a status and price tier, flattened four numbers to a run::
+
+    {"format": "runs",
+     "fields": ["seatNumber", "count", "status", "tierId"],
+     "statuses": ["AVAILABLE", "RESERVED", "SOLD"],
+     "tiers": [{"id": 7, "name": "Floor", "priceCents": 15000}],
+     "rows": {"A": [1, 12, 0, 7, 13, 2, 2, 7, ...]}}
+
+``status`` indexes ``statuses``. A mostly unsold row is a handful of runs
+instead of one object per seat. Payloads without prices leave out
+``tierId`` and ``tiers``.
+
+Run ``python seatmap.py --layout layouts/arena.json`` to compare the size
+and encoding time of both formats, plain and compressed.
+"""
+import argparse
+import gzip
+import json
+import random
+import time
+
+try:
+    import brotli
+except ImportError:  # optional; without it only gzip is offered
+    brotli = None
+
+FORMATS = ("json", "runs")
+COMPACT_MEDIA_TYPE = "application/vnd.tessera.seat-runs+json"
+
+STATUSES = ("AVAILABLE", "RESERVED", "SOLD")
+_STATUS_INDEX = {status: index for index, status in enumerate(STATUSES)}
+
+# Responses smaller than this go out uncompressed; the headers would eat most of the gain
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+COMPRESSIBLE_MIMETYPES = ("application/json", "text/csv", "text/plain", COMPACT_MEDIA_TYPE)
+
+
+def encodings():
+    """Content codings this process can produce, most preferred first."""
+    return ("br", "gzip") if brotli is not None else ("gzip",)
+
+
+def compress(body, encoding):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    if encoding == "gzip":
+        # mtime=0 keeps the output identical for identical input
+        return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+    raise ValueError(f"unsupported content coding: {encoding}")
+
+
+def negotiate_format(format_arg, accept_mimetypes):
+    """Pick the seat map format from ``?format=`` or the Accept header.
+
+    Returns None for an unknown ``format``. Only an explicit Accept of
+    ``COMPACT_MEDIA_TYPE`` selects ``runs``, so ``*/*`` keeps getting json.
+    """
+    if format_arg:
+        return format_arg if format_arg in FORMATS else None
+    if COMPACT_MEDIA_TYPE in accept_mimetypes.values():
+        return "runs"
+    return "json"
+
+
+def seat_objects(seats, tiers):
+    """The ``json`` format from ``(rowName, seatNumber, status, tierId)`` in row and seat order.
+
+    ``tiers`` maps a tier id to ``(name, priceCents)``.
+    """
+    rows = {}
+    for row_name, seat_number, status, tier_id in seats:
+        seat = {"seatNumber": seat_number, "status": status}
+        if tiers is not None:
+            seat["priceCents"] = tiers[tier_id][1]
+        rows.setdefault(row_name, []).append(seat)
+    return rows
+
+
+def seat_runs(seats, tiers):
+    """The ``runs`` format from the same input as ``seat_objects()``.
+
+    With ``tiers`` None the runs carry no tier and only break on status.
+    """
+    rows = {}
+    run = None  # [rowName, first seat, count, status index, tierId]
+    for row_name, seat_number, status, tier_id in seats:
+        status_index = _STATUS_INDEX[status]
+        if (run is not None and run[0] == row_name and run[1] + run[2] == seat_number
+                and run[3] == status_index and run[4] == tier_id):
+            run[2] += 1
+            continue
+        if run is not None:
+            rows.setdefault(run[0], []).extend(run[1:] if tiers is not None else run[1:4])
+        run = [row_name, seat_number, 1, status_index, tier_id]
+    if run is not None:
+        rows.setdefault(run[0], []).extend(run[1:] if tiers is not None else run[1:4])
+
+    payload = {
+        "format": "runs",
+        "fields": ["seatNumber", "count", "status", "tierId"] if tiers is not None else ["seatNumber", "count", "status"],
+        "statuses": list(STATUSES),
+    }
+    if tiers is not None:
+        payload["tiers"] = [
+            {"id": tier_id, "name": name, "priceCents": price_cents}
+            for tier_id, (name, price_cents) in sorted(tiers.items())
+        ]
+    payload["rows"] = rows
+    return payload
+
+
+def encode(seats, tiers, seat_format):
+    if seat_format == "runs":
+        return seat_runs(seats, tiers)
+    return seat_objects(seats, tiers)
+
+
+def _sample_seats(layout, sold, seed):
+    """Seats for a layout with about ``sold`` of them sold in blocks of 1-6, as buyers would."""
+    from provisioning import plan_layout
+    from seatstate import row_order
+
+    tier_prices, rows = plan_layout(layout)
+    tier_ids = {name: index + 1 for index, name in enumerate(tier_prices)}
+    tiers = {tier_ids[name]: (name, price) for name, price in tier_prices.items()}
+    rng = random.Random(seed)
+    seats = []
+    for tier, row_name, first, count in sorted(rows, key=lambda row: row_order(row[1])):
+        seat_number = first
+        while seat_number < first + count:
+            block = min(rng.randint(1, 6), first + count - seat_number)
+            status = "SOLD" if rng.random() < sold else "AVAILABLE"
+            for number in range(seat_number, seat_number + block):
+                seats.append((row_name, number, status, tier_ids[tier]))
+            seat_number += block
+    return seats, tiers
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare seat map wire formats")
+    parser.add_argument("--layout", default="layouts/arena.json", help="venue layout file")
+    parser.add_argument("--sold", type=float, default=0.3, help="fraction of seats sold")
+    parser.add_argument("--repeat", type=int, default=5, help="encodings timed per format; the best is kept")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    with open(args.layout) as f:
+        seats, tiers = _sample_seats(json.load(f), args.sold, args.seed)
+    print(f"{len(seats)} seats, {args.sold:.0%} sold")
+    print(f"{'format':<8}{'coding':<10}{'bytes':>12}{'encode ms':>12}")
+    for seat_format in FORMATS:
+        best = None
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            body = json.dumps(encode(seats, tiers, seat_format), separators=(",", ":")).encode()
+            seconds = time.perf_counter() - started
+            best = seconds if best is None else min(best, seconds)
+        print(f"{seat_format:<8}{'identity':<10}{len(body):>12,}{best * 1000:>12.1f}")
+        for encoding in encodings():
+            started = time.perf_counter()
+            compressed = compress(body, encoding)
+            seconds = time.perf_counter() - started
+            print(f"{seat_format:<8}{encoding:<10}{len(compressed):>12,}{(best + seconds) * 1000:>12.1f}")
+
+
+if __name__ == "__main__":
+    main()
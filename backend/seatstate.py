@@ -0,0 +1,292 @@
+import sys
+import threading
+import time
+from array import array
+
+from bestseats import FreeSeatIndex, RowSegment
+
+# One byte per seat. NO_SEAT marks gaps in a row's seat numbering.
+NO_SEAT = 0
+STATUS_CODES = {"AVAILABLE": 1, "RESERVED": 2, "SOLD": 3}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+AVAILABLE = STATUS_CODES["AVAILABLE"]
+
+
+def row_order(row_name):
+    """Sort key that puts rows in venue order: A-Z, then AA, AB and so on."""
+    return len(row_name), row_name
+
+
+class EventSeatState:
+    """Status of every seat in one event, packed into a bytearray.
+
+    Each row occupies a contiguous slice of ``states`` covering its lowest
+    to highest seat number, so a seat is found with one dict lookup and an
+    offset. Per-status counts are kept up to date on every change.
+    """
+
+    def __init__(self, event_id, row_bounds):
+        self.event_id = event_id
+        self.rows = {}  # rowName -> (offset, first seat number, seat count)
+        offset = 0
+        for row_name, first, last in row_bounds:
+            width = last - first + 1
+            self.rows[row_name] = (offset, first, width)
+            offset += width
+        self.states = bytearray(offset)
+        self.counts = [0] * (len(STATUS_NAMES) + 1)
+        self.load_seconds = 0.0
+        self.version = 0  # the event's SeatVersions version when it was loaded
+        self.free_seats = None
+
+    def index_free_seats(self, row_ranks, seat_tiers, tiers):
+        """Build ``free_seats`` from the loaded statuses.
+
+        ``row_ranks`` maps a row to its position front to back, ``seat_tiers``
+        holds each seat's price tier id at its index in ``states``, and
+        ``tiers`` maps a tier id to (name, priceCents). Seats without a tier
+        in ``tiers`` are left out.
+        """
+        segments = []
+        for row_name, (offset, first, width) in self.rows.items():
+            rank = row_ranks[row_name]
+            center = first + (width - 1) / 2
+            segment = None
+            for position in range(width):
+                index = offset + position
+                code = self.states[index]
+                if code == NO_SEAT:
+                    segment = None
+                    continue
+                seat_number = first + position
+                tier_id = seat_tiers[index]
+                if tier_id not in tiers:
+                    # No known price, so it can't be offered; the seat map leaves it out too
+                    segment = None
+                    continue
+                if segment is None or segment_tier != tier_id:
+                    name, price_cents = tiers[tier_id]
+                    segment = RowSegment(row_name, rank, center, seat_number, seat_number, name, price_cents)
+                    segment_tier = tier_id
+                    segments.append(segment)
+                segment.last = seat_number
+                if code == AVAILABLE:
+                    segment.free(seat_number)
+        self.free_seats = FreeSeatIndex(segments)
+
+    def _index(self, row_name, seat_number):
+        row = self.rows.get(row_name)
+        if row is None or not isinstance(seat_number, int):
+            return None
+        offset, first, width = row
+        position = seat_number - first
+        if position < 0 or position >= width:
+            return None
+        return offset + position
+
+    def status(self, row_name, seat_number):
+        """Return the seat's status name, or None if the seat doesn't exist."""
+        index = self._index(row_name, seat_number)
+        if index is None:
+            return None
+        return STATUS_NAMES.get(self.states[index])
+
+    def set(self, row_name, seat_number, status):
+        index = self._index(row_name, seat_number)
+        if index is None:
+            return
+        code = STATUS_CODES[status]
+        old = self.states[index]
+        self.states[index] = code
+        self.counts[old] -= 1
+        self.counts[code] += 1
+        if self.free_seats is not None and (old == AVAILABLE) != (code == AVAILABLE):
+            if code == AVAILABLE:
+                self.free_seats.free(row_name, seat_number)
+            else:
+                self.free_seats.take(row_name, seat_number)
+
+    def row_statuses(self, row_name):
+        """Yield (seatNumber, status) for every seat in the row, in seat order."""
+        offset, first, width = self.rows[row_name]
+        for position in range(width):
+            code = self.states[offset + position]
+            if code != NO_SEAT:
+                yield first + position, STATUS_NAMES[code]
+
+    def count(self, status):
+        return self.counts[STATUS_CODES[status]]
+
+    def summary(self):
+        counts = {name: self.counts[code] for code, name in STATUS_NAMES.items()}
+        counts["total"] = sum(counts.values())
+        return counts
+
+    def memory_bytes(self):
+        index_bytes = sys.getsizeof(self.rows) + sum(
+            sys.getsizeof(name) + sys.getsizeof(bounds) for name, bounds in self.rows.items()
+        )
+        return {"states": len(self.states), "index": index_bytes}
+
+
+class SeatStateStore:
+    """Lazily loaded ``EventSeatState`` per event, kept in step with the DB.
+
+    The first lookup for an event builds its state from Tickets and
+    TicketSales. After that, writers call ``apply`` with every committed
+    change so availability can be answered without querying SQLite. Since
+    nothing is persisted here, a restart simply reloads from the database.
+    """
+
+    def __init__(self, pool):
+        self.pool = pool
+        self._lock = threading.Lock()
+        self._events = {}
+        self._loading = {}  # event_id -> (changes committed during the load, done event)
+        self._stale_loads = set()  # loads in progress that were invalidated
+
+    def get(self, event_id):
+        with self._lock:
+            state = self._events.get(event_id)
+            if state is not None:
+                return state
+            loading = self._loading.get(event_id)
+            if loading is None:
+                pending, done = [], threading.Event()
+                self._loading[event_id] = (pending, done)
+
+        if loading is not None:
+            # Another thread is already building this event; wait for it
+            loading[1].wait()
+            with self._lock:
+                return self._events.get(event_id)
+
+        try:
+            state = self._load(event_id)
+            with self._lock:
+                # No tickets yet means nothing is stored, so the next lookup
+                # tries again in case some have been provisioned since. A load
+                # invalidated halfway may have read old data, so it isn't kept either.
+                if state is not None and event_id not in self._stale_loads:
+                    # Replay anything that committed after our snapshot was taken
+                    for seats, status in pending:
+                        for row_name, seat_number in seats:
+                            state.set(row_name, seat_number, status)
+                    self._events[event_id] = state
+            return state
+        finally:
+            with self._lock:
+                del self._loading[event_id]
+                self._stale_loads.discard(event_id)
+            done.set()
+
+    def _load(self, event_id):
+        started = time.perf_counter()
+        with self.pool.connection() as conn:
+            # Read both tables from one snapshot
+            conn.execute("BEGIN")
+            # An event still being provisioned has no seats as far as buyers are concerned
+            provisioning = conn.execute(
+                "SELECT provisioning FROM Events WHERE event_id = ?", (event_id,)
+            ).fetchone()
+            if provisioning and provisioning[0]:
+                return None
+            bounds = conn.execute("""
+                SELECT rowName, MIN(seatNumber), MAX(seatNumber), MIN(rowid)
+                FROM Tickets
+                WHERE event_id = ?
+                GROUP BY rowName
+                ORDER BY rowName
+            """, (event_id,)).fetchall()
+            if not bounds:
+                return None
+            state = EventSeatState(event_id, [tuple(row[:3]) for row in bounds])
+            # Rows are provisioned front to back, so insertion order ranks them
+            row_ranks = {row[0]: rank for rank, row in enumerate(sorted(bounds, key=lambda row: row[3]))}
+            tiers = {tier_id: (name, price_cents) for tier_id, name, price_cents in conn.execute(
+                "SELECT id, name, priceCents FROM PriceTiers WHERE event_id = ?", (event_id,)
+            )}
+            seat_tiers = array("q", bytes(8 * len(state.states)))
+            version = conn.execute(
+                "SELECT version FROM SeatVersions WHERE event_id = ?", (event_id,)
+            ).fetchone()
+            state.version = version[0] if version else 0
+
+            for row_name, seat_number, status, tier_id in conn.execute("""
+                SELECT rowName, seatNumber, status, priceTierId FROM Tickets WHERE event_id = ?
+            """, (event_id,)):
+                state.set(row_name, seat_number, status)
+                seat_tiers[state._index(row_name, seat_number)] = tier_id or 0
+
+            # A recorded sale wins over whatever the ticket row says
+            for row_name, seat_number in conn.execute("""
+                SELECT rowName, seatNumber FROM TicketSales WHERE event_id = ?
+            """, (event_id,)):
+                state.set(row_name, seat_number, "SOLD")
+            conn.rollback()
+
+        state.index_free_seats(row_ranks, seat_tiers, tiers)
+
+        state.load_seconds = time.perf_counter() - started
+        return state
+
+    def apply(self, event_id, seats, status):
+        """Record a committed change to ``seats`` in an event, if it is loaded."""
+        with self._lock:
+            if event_id in self._loading:
+                self._loading[event_id][0].append((list(seats), status))
+                return
+            state = self._events.get(event_id)
+            if state is None:
+                return
+            for row_name, seat_number in seats:
+                state.set(row_name, seat_number, status)
+
+    def best_available(self, event_id, count, max_price_cents=None, tiers=None):
+        """Find adjacent available seats with ``FreeSeatIndex.find``.
+
+        Returns None if the event has no seats, else a ``SeatBlock`` or
+        False when no block fits.
+        """
+        state = self.get(event_id)
+        if state is None:
+            return None
+        # apply() changes the index under the same lock
+        with self._lock:
+            return state.free_seats.find(count, max_price_cents, tiers) or False
+
+    def loaded(self, event_id):
+        """Return the event's state if it is already in memory, without loading it."""
+        with self._lock:
+            return self._events.get(event_id)
+
+    def event_ids(self):
+        with self._lock:
+            return list(self._events)
+
+    def invalidate(self, event_id):
+        """Drop an event's state so the next lookup reloads it from the database."""
+        with self._lock:
+            self._events.pop(event_id, None)
+            if event_id in self._loading:
+                self._stale_loads.add(event_id)
+
+    def stats(self):
+        with self._lock:
+            events = dict(self._events)
+        per_event = {}
+        total = 0
+        for event_id, state in events.items():
+            if state is None:
+                continue
+            memory = state.memory_bytes()
+            total += memory["states"] + memory["index"]
+            per_event[str(event_id)] = {
+                "seats": len(state.states),
+                "rows": len(state.rows),
+                "stateBytes": memory["states"],
+                "indexBytes": memory["index"],
+                "loadMs": round(state.load_seconds * 1000, 3),
+                "freeSeatIndex": state.free_seats.stats() if state.free_seats else None,
+            }
+        return {"events": len(per_event), "totalBytes": total, "perEvent": per_event}
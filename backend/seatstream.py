@@ -0,0 +1,140 @@
+import json
+import threading
+from collections import OrderedDict, deque
+
+
+class SubscriberLimitReached(Exception):
+    pass
+
+
+class _EventLog:
+    def __init__(self, lock, floor, max_changes):
+        self.changes = deque(maxlen=max_changes)  # (version, rowName, seatNumber, status)
+        self.floor = floor  # cursors older than this have lost changes
+        self.latest = floor
+        self.subscribers = 0
+        self.condition = threading.Condition(lock)
+
+
+class SeatChangeLog:
+    """Recent seat status changes per event, for streaming deltas to clients.
+
+    Each event keeps a bounded ring of its latest changes tagged with the
+    event's seat map version. Subscribers only hold a cursor (the last
+    version they have seen) and sleep on the event's condition, so an idle
+    subscriber costs a blocked thread and nothing else. A cursor that has
+    fallen out of the ring gets a reset and must refetch the full map.
+    """
+
+    def __init__(self, max_changes_per_event=2048, max_events=1024, max_subscribers_per_event=1000):
+        self.max_changes_per_event = max_changes_per_event
+        self.max_events = max_events
+        self.max_subscribers_per_event = max_subscribers_per_event
+
+        self._lock = threading.Lock()
+        self._events = OrderedDict()
+        self._published = 0
+        self._evictions = 0
+
+    def _log(self, event_id, floor):
+        log = self._events.get(event_id)
+        if log is None:
+            log = _EventLog(self._lock, floor, self.max_changes_per_event)
+            self._events[event_id] = log
+            self._evict()
+        else:
+            self._events.move_to_end(event_id)
+        return log
+
+    def _evict(self):
+        while len(self._events) > self.max_events:
+            for event_id, log in self._events.items():
+                # Never drop a log somebody is listening to
+                if log.subscribers == 0:
+                    del self._events[event_id]
+                    self._evictions += 1
+                    break
+            else:
+                return
+
+    def publish(self, event_id, version, seats, status):
+        """Record that ``seats`` changed to ``status`` as of ``version``."""
+        with self._lock:
+            log = self._log(event_id, version - 1)
+            for row_name, seat_number in seats:
+                if len(log.changes) == log.changes.maxlen:
+                    log.floor = log.changes[0][0]
+                log.changes.append((version, row_name, seat_number, status))
+            log.latest = version
+            self._published += len(seats)
+            log.condition.notify_all()
+
+    def reset(self, event_id, version):
+        """Drop an event's buffered changes; every subscriber gets a reset at ``version``."""
+        with self._lock:
+            log = self._events.get(event_id)
+            if log is None:
+                return
+            log.changes.clear()
+            log.floor = log.latest = version
+            log.condition.notify_all()
+
+    def event_ids(self):
+        with self._lock:
+            return list(self._events)
+
+    def subscribe(self, event_id, current_version):
+        with self._lock:
+            log = self._log(event_id, current_version)
+            if log.subscribers >= self.max_subscribers_per_event:
+                raise SubscriberLimitReached(f"event {event_id} already has {log.subscribers} subscribers")
+            log.subscribers += 1
+
+    def is_full(self, event_id):
+        """Whether the event already has as many subscribers as it may have."""
+        with self._lock:
+            log = self._events.get(event_id)
+            return log is not None and log.subscribers >= self.max_subscribers_per_event
+
+    def unsubscribe(self, event_id):
+        with self._lock:
+            log = self._events.get(event_id)
+            if log is not None:
+                log.subscribers -= 1
+
+    def wait(self, event_id, since, timeout):
+        """Block until there are changes after ``since`` or ``timeout`` passes.
+
+        Returns ``(changes, latest)`` where ``changes`` is a list of
+        ``(version, rowName, seatNumber, status)``, or ``(None, latest)`` if
+        ``since`` is too old to be resumed from.
+        """
+        with self._lock:
+            log = self._events[event_id]
+            if since < log.floor or since > log.latest:
+                return None, log.latest
+            if log.latest == since:
+                log.condition.wait(timeout)
+                if since < log.floor:
+                    return None, log.latest
+            return [change for change in log.changes if change[0] > since], log.latest
+
+    def stats(self):
+        with self._lock:
+            return {
+                "events": len(self._events),
+                "subscribers": sum(log.subscribers for log in self._events.values()),
+                "bufferedChanges": sum(len(log.changes) for log in self._events.values()),
+                "published": self._published,
+                "evictions": self._evictions,
+            }
+
+
+def format_event(event, data, event_id=None):
+    """Format one server-sent event frame."""
+    lines = []
+    if event_id is not None:
+        lines.append(f"id: {event_id}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {json.dumps(data, separators=(',', ':'))}")
+    return "\n".join(lines) + "\n\n"
@@ -0,0 +1,103 @@
+import contextlib
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Events are looked up in chunks so the IN list stays under SQLite's bound-parameter limit
+_CHUNK_SIZE = 500
+
+
+class SeatVersionSync(threading.Thread):
+    """Notices seat changes committed by other processes sharing the database.
+
+    Every status change to a ticket bumps its event's row in SeatVersions (a
+    trigger does it, so every writer is counted). This process knows how
+    many changes it made itself through ``local_change()``, so each pass can
+    tell whether an event's version moved further than that. Events that
+    did are handed to ``on_stale`` to be dropped from memory.
+
+    ``tracked`` returns the ids of events this process holds state for, and
+    ``baseline`` the SeatVersions version an event's state was loaded at, or
+    None if unknown. An event seen for the first time without a baseline is
+    treated as stale, which costs at most one extra reload.
+    """
+
+    def __init__(self, pool, interval=1.0, tracked=None, baseline=None, on_stale=None, write_lock=None):
+        super().__init__(name="seat-version-sync", daemon=True)
+        self.pool = pool
+        self.interval = interval
+        self.tracked = tracked or (lambda: ())
+        self.baseline = baseline or (lambda event_id: None)
+        self.on_stale = on_stale
+        self.write_lock = write_lock or contextlib.nullcontext()
+
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._expected = {}  # event_id -> SeatVersions version our in-memory state reflects
+        self._syncs = 0
+        self._stale_total = 0
+        self._errors = 0
+
+    def local_change(self, event_id, count):
+        """Record that this process committed ``count`` status changes in an event."""
+        with self._lock:
+            if event_id in self._expected:
+                self._expected[event_id] += count
+
+    def sync(self):
+        """Compare tracked events with the database. Returns the ids found stale."""
+        # Holding the write lock means none of our own writes is between commit and local_change()
+        with self.write_lock, self.pool.connection() as conn:
+            event_ids = list(set(self.tracked()))
+            versions = {}
+            for i in range(0, len(event_ids), _CHUNK_SIZE):
+                chunk = event_ids[i:i + _CHUNK_SIZE]
+                rows = conn.execute(
+                    f"SELECT event_id, version FROM SeatVersions "
+                    f"WHERE event_id IN ({', '.join(['?'] * len(chunk))})", chunk
+                ).fetchall()
+                versions.update((row[0], row[1]) for row in rows)
+
+            stale = []
+            with self._lock:
+                expected = {}
+                for event_id in event_ids:
+                    version = versions.get(event_id, 0)
+                    known = self._expected.get(event_id)
+                    if known is None:
+                        known = self.baseline(event_id)
+                    if known != version:
+                        stale.append(event_id)
+                    expected[event_id] = version
+                # Forget events we no longer hold anything for
+                self._expected = expected
+                self._syncs += 1
+                self._stale_total += len(stale)
+
+            if self.on_stale:
+                for event_id in stale:
+                    self.on_stale(event_id)
+        return stale
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            try:
+                self.sync()
+            except Exception:
+                with self._lock:
+                    self._errors += 1
+                logger.exception("seat version sync failed")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self):
+        with self._lock:
+            return {
+                "intervalSeconds": self.interval,
+                "trackedEvents": len(self._expected),
+                "syncs": self._syncs,
+                "staleEvents": self._stale_total,
+                "errors": self._errors,
+            }
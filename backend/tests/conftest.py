@@ -0,0 +1,60 @@
+import os
+import sys
+
+import pytest
+
+BACKEND_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND_DIR)
+
+import app as tessera  # noqa: E402
+from bench import clone_schema  # noqa: E402
+from flask_jwt_extended import create_access_token  # noqa: E402
+
+# The bundled database; tests run against an empty copy of its schema
+SCHEMA_DB_PATH = os.path.join(BACKEND_DIR, "..", "database", "tessera.db")
+
+
+@pytest.fixture
+def flask_app(tmp_path):
+    db_path = str(tmp_path / "tessera.db")
+    clone_schema(SCHEMA_DB_PATH, db_path)
+    flask_app = tessera.create_app({
+        "TESTING": True,
+        "JWT_SECRET_KEY": "tessera-test-secret-key-0123456789",
+        "TESSERA_DB_PATH": db_path,
+        "RATE_LIMIT_USER_PER_SECOND": 0,
+        "RATE_LIMIT_IP_PER_SECOND": 0,
+    })
+    yield flask_app
+    tessera.shutdown()
+
+
+@pytest.fixture
+def client(flask_app):
+    return flask_app.test_client()
+
+
+def auth_headers(flask_app, user_id, admin=False):
+    with flask_app.app_context():
+        claims = {"admin": 1} if admin else {}
+        token = create_access_token(identity=user_id, additional_claims=claims)
+    return {"Authorization": f"Bearer {token}"}
+
+
+@pytest.fixture
+def admin_headers(flask_app):
+    return auth_headers(flask_app, 1, admin=True)
+
+
+@pytest.fixture
+def buyer_headers(flask_app):
+    return auth_headers(flask_app, 2)
+
+
+@pytest.fixture
+def query(flask_app):
+    """Run a query on the app's database and return its rows."""
+    def query(sql, params=()):
+        with tessera.get_db_connection() as conn:
+            return conn.execute(sql, params).fetchall()
+    return query
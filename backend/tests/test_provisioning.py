@@ -0,0 +1,161 @@
+import time
+
+import pytest
+
+import app as tessera
+import provisioning
+
+
+def layout(rows, seats_per_row):
+    return {
+        "tiers": {"Front": 9000, "Back": 4000},
+        "sections": [
+            {"name": "Front", "tier": "Front", "rows": 2, "seatsPerRow": seats_per_row},
+            {"name": "Back", "tier": "Back", "rows": rows - 2, "seatsPerRow": seats_per_row, "firstRow": "C"},
+        ],
+    }
+
+
+def wait_for_job(client, headers, location, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = client.get(location, headers=headers).get_json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.05)
+    pytest.fail(f"job at {location} did not finish")
+
+
+def event_rows(query, name):
+    """Events, PriceTiers and Tickets rows left for the events called ``name``."""
+    events = [row[0] for row in query("SELECT event_id FROM Events WHERE name = ?", (name,))]
+    marks = ", ".join("?" * len(events)) or "NULL"
+    return (
+        len(events),
+        query(f"SELECT COUNT(*) FROM PriceTiers WHERE event_id IN ({marks})", events)[0][0],
+        query(f"SELECT COUNT(*) FROM Tickets WHERE event_id IN ({marks})", events)[0][0],
+    )
+
+
+def orphaned_sales(query):
+    return query("""
+        SELECT COUNT(*) FROM TicketSales s
+        WHERE NOT EXISTS (SELECT 1 FROM Events e WHERE e.event_id = s.event_id)
+           OR NOT EXISTS (SELECT 1 FROM Tickets t WHERE t.event_id = s.event_id
+                          AND t.rowName = s.rowName AND t.seatNumber = s.seatNumber)
+    """)[0][0]
+
+
+def test_small_layout_is_created_during_the_request(client, admin_headers, query):
+    response = client.post("/admin/events", headers=admin_headers,
+                           json={"name": "Club Night", "layout": layout(5, 20)})
+
+    assert response.status_code == 201
+    body = response.get_json()
+    assert body["tickets"] == 100
+    assert set(body["priceTiers"]) == {"Front", "Back"}
+    assert event_rows(query, "Club Night") == (1, 2, 100)
+
+    event_id = body["event_id"]
+    assert client.get(f"/events/{event_id}").status_code == 200
+    seat_map = client.get(f"/events/{event_id}/seats-with-prices").get_json()
+    assert list(seat_map) == ["A", "B", "C", "D", "E"]
+    assert client.get(f"/events/{event_id}/availability").get_json()["AVAILABLE"] == 100
+
+
+def test_large_layout_runs_as_a_job(client, admin_headers, query):
+    seats = tessera.DEFAULT_CONFIG["PROVISION_ASYNC_SEATS"] + 1000
+    response = client.post("/admin/events", headers=admin_headers,
+                           json={"name": "Arena Night", "layout": layout(seats // 100, 100)})
+
+    assert response.status_code == 202
+    assert response.get_json()["seats"] == seats
+    job = wait_for_job(client, admin_headers, response.headers["Location"])
+    assert job["status"] == "done", job["error"]
+    assert job["result"]["tickets"] == seats
+    assert event_rows(query, "Arena Night") == (1, 2, seats)
+    assert client.get(f"/events/{job['result']['event_id']}").status_code == 200
+
+
+def test_event_is_hidden_until_its_last_batch(client, buyer_headers, query):
+    checked = []
+
+    def write(operation):
+        result = tessera.run_write(operation)
+        if not checked and query("SELECT COUNT(*) FROM Tickets")[0][0]:
+            event_id = query("SELECT event_id FROM Events WHERE name = 'Hidden Show'")[0][0]
+            seat = {"rowName": "A", "seatNumber": 1}
+            checked.extend([
+                client.get("/events").get_json(),
+                client.get("/events/search?q=hidden").get_json(),
+                client.get(f"/events/{event_id}").status_code,
+                client.get(f"/events/{event_id}/seats-with-prices").get_json(),
+                client.post("/reserve_seats", headers=buyer_headers,
+                            json={"event_id": event_id, "seats": [seat]}).status_code,
+                client.post(f"/events/{event_id}/best-available", headers=buyer_headers,
+                            json={"count": 2, "reserve": True}).status_code,
+                client.post("/purchase_seats", headers=buyer_headers,
+                            json={"event_id": event_id, "seats": [seat]}).status_code,
+            ])
+        return result
+
+    result = provisioning.provision_event_in_batches(write, {"name": "Hidden Show"}, layout(50, 100),
+                                                     batch_size=1000, on_published=tessera.seats_stale)
+
+    assert checked == [[], [], 404, {}, 404, 404, 404]
+    assert client.get(f"/events/{result['event_id']}").status_code == 200
+    assert client.post("/reserve_seats", headers=buyer_headers, json={
+        "event_id": result["event_id"], "seats": [{"rowName": "A", "seatNumber": 1}],
+    }).status_code == 200
+
+
+def test_failed_batch_removes_the_event(client, admin_headers, query, monkeypatch):
+    insert_tickets = provisioning._insert_tickets
+    batches = []
+
+    def failing_insert(conn, chunk):
+        batches.append(len(chunk))
+        if len(batches) == 3:
+            raise RuntimeError("disk full")
+        insert_tickets(conn, chunk)
+
+    monkeypatch.setattr(provisioning, "_insert_tickets", failing_insert)
+    response = client.post("/admin/events", headers=admin_headers,
+                           json={"name": "Doomed Tour", "layout": layout(100, 100), "background": True})
+
+    job = wait_for_job(client, admin_headers, response.headers["Location"])
+    assert job["status"] == "failed"
+    assert job["error"] == "disk full"
+    assert len(batches) == 3
+    assert event_rows(query, "Doomed Tour") == (0, 0, 0)
+    assert query("SELECT COUNT(*) FROM EventTierStats s WHERE NOT EXISTS "
+                 "(SELECT 1 FROM Events e WHERE e.event_id = s.event_id)")[0][0] == 0
+    assert orphaned_sales(query) == 0
+
+
+def test_failed_batch_keeps_sold_tickets(query):
+    writes = []
+
+    def write(operation):
+        writes.append(operation)
+        if len(writes) == 3:
+            raise RuntimeError("writer stopped")
+        result = tessera.run_write(operation)
+        if len(writes) == 2:
+            # A sale that got in while the event was still being written
+            def sell(conn):
+                conn.execute("""
+                    INSERT INTO TicketSales (event_id, rowName, seatNumber, userId, barcode, purchasedAt)
+                    SELECT event_id, 'A', 1, 2, 'test-barcode', '2026-01-01 00:00:00' FROM Events
+                    WHERE name = 'Half Sold'
+                """)
+                return None, None
+            tessera.run_write(sell)
+        return result
+
+    with pytest.raises(RuntimeError, match="writer stopped"):
+        provisioning.provision_event_in_batches(write, {"name": "Half Sold"}, layout(30, 100), batch_size=1000)
+
+    assert event_rows(query, "Half Sold") == (1, 2, 1)
+    assert [tuple(row) for row in query("SELECT rowName, seatNumber FROM Tickets")] == [("A", 1)]
+    assert orphaned_sales(query) == 0
@@ -0,0 +1,212 @@
+"""Paged ticket history for /profile, and a per-user cache of its pages.
+
+A buyer's tickets come upcoming events first, soonest first, then past
+events, most recent first; undated events come last. Within an event they
+are in seat order. Pages are keyset-paged on
+``(eventDate, event_id, rowName, seatNumber)``, which the covering index
+``idx_ticketsales_history`` (migration 12) and its twin in the archive
+keep in order, so a page costs the same for a buyer with ten tickets or
+ten thousand. ``TicketSales.eventDate`` is the event's date (or ``''``),
+copied onto each sale so the index can be ordered by it.
+
+Past tickets are read from the live ``TicketSales`` and from the archive
+(archive.py) at once, and merged.
+"""
+import base64
+import json
+import threading
+from collections import OrderedDict
+
+from catalog import InvalidQuery
+
+DEFAULT_PAGE_SIZE = 50
+
+UPCOMING = "upcoming"
+PAST = "past"
+
+# The keyset, in page order. Each sale has a unique (event_id, rowName, seatNumber).
+KEY_COLUMNS = ("eventDate", "event_id", "rowName", "seatNumber")
+
+# What /profile returns for each ticket
+TICKET_COLUMNS = ("id", "event_id", "rowName", "seatNumber", "barcode", "purchasedAt",
+                  "name", "date", "time", "location", "description", "imageUrl")
+
+_SALE_COLUMNS = "id, event_id, rowName, seatNumber, barcode, purchasedAt, eventDate"
+_KEY = ", ".join(KEY_COLUMNS)
+_KEY_DESC = ", ".join(f"{column} DESC" for column in KEY_COLUMNS)
+
+
+def encode_cursor(section, today, key):
+    """``today`` is where upcoming ended for the first page, so later pages split the same way."""
+    raw = json.dumps([section, today, *key], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor):
+    """Returns ``(section, today, key)``."""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        section, today, *key = json.loads(base64.urlsafe_b64decode(padded))
+    except (ValueError, TypeError):
+        raise InvalidQuery("cursor is not valid")
+    if (section not in (UPCOMING, PAST) or not isinstance(today, str) or len(key) != len(KEY_COLUMNS)
+            or not all(isinstance(value, str) for value in key[::2])
+            or not all(isinstance(value, int) for value in key[1::2])):
+        raise InvalidQuery("cursor is not valid")
+    return section, today, tuple(key)
+
+
+def _with_events(page_sql):
+    # Event details are looked up for the page's rows only
+    return f"""
+        WITH page AS ({page_sql})
+        SELECT page.*, e.name, e.date, e.time, e.location, e.description, e.imageUrl
+        FROM page CROSS JOIN Events e ON e.event_id = page.event_id
+    """
+
+
+def upcoming_query(user_id, today, after, limit):
+    """Tickets for events on or after ``today``, soonest first, after the key ``after`` if given."""
+    conditions = ["userId = ?"]
+    params = [user_id]
+    if after is None:
+        conditions.append("eventDate >= ?")
+        params.append(today)
+    else:
+        # A key from this section is already past `today`. On its own, the
+        # row value is what SQLite seeks the index to.
+        conditions.append(f"({_KEY}) > (?, ?, ?, ?)")
+        params.extend(after)
+    page = f"""
+        SELECT {_SALE_COLUMNS} FROM main.TicketSales
+        WHERE {' AND '.join(conditions)}
+        ORDER BY {_KEY} LIMIT ?
+    """
+    return _with_events(page) + f" ORDER BY {_KEY}", params + [limit]
+
+
+def past_query(user_id, today, after, limit):
+    """Tickets for events before ``today``, live and archived, most recent first.
+
+    Each side is read in key order through its index and cut to ``limit``
+    before they are merged. A sale in both, because archiving it was cut
+    short, comes from the live table.
+    """
+    conditions = ["userId = ?"]
+    params = [user_id]
+    if after is None:
+        conditions.append("eventDate < ?")
+        params.append(today)
+    else:
+        conditions.append(f"({_KEY}) < (?, ?, ?, ?)")
+        params.extend(after)
+    where = " AND ".join(conditions)
+    page = f"""
+        SELECT * FROM (
+            SELECT {_SALE_COLUMNS} FROM main.TicketSales
+            WHERE {where} ORDER BY {_KEY_DESC} LIMIT ?
+        )
+        UNION ALL
+        SELECT * FROM (
+            SELECT {_SALE_COLUMNS} FROM archive.TicketSales a
+            WHERE {where} AND NOT EXISTS (SELECT 1 FROM main.TicketSales m WHERE m.barcode = a.barcode)
+            ORDER BY {_KEY_DESC} LIMIT ?
+        )
+        ORDER BY {_KEY_DESC} LIMIT ?
+    """
+    return (_with_events(page) + f" ORDER BY {_KEY_DESC}",
+            params + [limit] + params + [limit, limit])
+
+
+def _key(row):
+    return tuple(row[column] for column in KEY_COLUMNS)
+
+
+def ticket_page(conn, user_id, today, cursor=None, limit=DEFAULT_PAGE_SIZE):
+    """One page of a user's tickets: ``(tickets, next_cursor)``, with None once there are no more.
+
+    A page that uses up the upcoming tickets carries on with the past ones.
+    """
+    section, after = UPCOMING, None
+    if cursor:
+        section, today, after = decode_cursor(cursor)
+
+    rows = []
+    if section == UPCOMING:
+        query, params = upcoming_query(user_id, today, after, limit + 1)
+        rows = conn.execute(query, params).fetchall()
+        if len(rows) > limit:
+            return rows[:limit], encode_cursor(UPCOMING, today, _key(rows[limit - 1]))
+        after = None
+
+    query, params = past_query(user_id, today, after, limit + 1 - len(rows))
+    rows += conn.execute(query, params).fetchall()
+    if len(rows) > limit:
+        return rows[:limit], encode_cursor(PAST, today, _key(rows[limit - 1]))
+    return rows, None
+
+
+def sales_version(conn, user_id):
+    """The user's ``UserSaleVersions`` counter, which moves whenever one of their sales is added or removed."""
+    row = conn.execute("SELECT version FROM UserSaleVersions WHERE userId = ?", (user_id,)).fetchone()
+    return row[0] if row is not None else 0
+
+
+class TicketHistoryCache:
+    """Rendered /profile pages per user, keyed by the user's sales version.
+
+    A purchase, whichever worker makes it, bumps the buyer's version in
+    ``UserSaleVersions`` through a trigger, so their cached pages are never
+    served again. Checking the version is a single primary key read. Users
+    are evicted least-recently-used beyond ``max_users``, and a user's pages
+    are dropped together.
+    """
+
+    def __init__(self, max_users=10000, max_pages_per_user=20):
+        self.max_users = max_users
+        self.max_pages_per_user = max_pages_per_user
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # user_id -> (version, {page: (body, next_cursor)})
+        self._hits = 0
+        self._misses = 0
+        self._evictions = 0
+
+    def get(self, user_id, version, page):
+        """Return ``(body, next_cursor)`` for this page at this version, or None."""
+        with self._lock:
+            entry = self._entries.get(user_id)
+            cached = entry[1].get(page) if entry is not None and entry[0] == version else None
+            if cached is None:
+                self._misses += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self._hits += 1
+            return cached
+
+    def put(self, user_id, version, page, body, next_cursor):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] > version:
+                return
+            if entry is None or entry[0] != version:
+                entry = self._entries[user_id] = (version, {})
+            if len(entry[1]) < self.max_pages_per_user:
+                entry[1][page] = (body, next_cursor)
+            self._entries.move_to_end(user_id)
+            while len(self._entries) > self.max_users:
+                self._entries.popitem(last=False)
+                self._evictions += 1
+
+    def stats(self):
+        with self._lock:
+            lookups = self._hits + self._misses
+            return {
+                "users": len(self._entries),
+                "pages": sum(len(pages) for _, pages in self._entries.values()),
+                "maxUsers": self.max_users,
+                "hits": self._hits,
+                "misses": self._misses,
+                "hitRatio": round(self._hits / lookups, 4) if lookups else None,
+                "evictions": self._evictions,
+            }
@@ -0,0 +1,292 @@
+import concurrent.futures
+import contextlib
+import contextvars
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+logger = logging.getLogger(__name__)
+
+# Batch sizes are counted in these buckets for stats()
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+# Times an operation may ask to run again before it is resolved with its fallback result
+MAX_RETRIES = 3
+
+
+class Rollback(Exception):
+    """Raised by an operation to undo its own writes and resolve its future with ``result``."""
+
+    def __init__(self, result):
+        super().__init__()
+        self.result = result
+
+
+class Retry(Exception):
+    """Raised by an operation to undo its own writes and run again after the batch commits.
+
+    Useful when the operation read in-memory state that the rest of the
+    batch has not updated yet. After ``MAX_RETRIES`` the future resolves
+    with ``result`` instead.
+    """
+
+    def __init__(self, result=None):
+        super().__init__()
+        self.result = result
+
+
+class WriterBusy(Exception):
+    pass
+
+
+class WriterStopped(Exception):
+    pass
+
+
+class WriterTimeout(Exception):
+    pass
+
+
+class _Operation:
+    __slots__ = ("fn", "future", "attempts", "context")
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.future = Future()
+        self.attempts = 0
+        # The submitter's context variables, so per-request metrics count the statements it runs
+        self.context = contextvars.copy_context()
+
+
+class SeatWriter(threading.Thread):
+    """Single writer thread that applies queued writes with group commit.
+
+    An operation is a function taking a connection inside an open write
+    transaction and returning ``(result, on_commit)``. The writer drains
+    whatever is queued, up to ``max_batch`` operations, runs them one after
+    another in a single ``BEGIN IMMEDIATE`` transaction and commits once.
+    Each operation runs inside its own savepoint, so one that fails or
+    raises ``Rollback`` leaves the rest of the batch alone and behaves as
+    it would in a transaction of its own.
+
+    Operations run in the context of the thread that submitted them, so the
+    statements they run are counted in that request's SQL metrics.
+
+    After the commit, each ``on_commit`` is called in order while
+    ``write_lock`` is still held, then the futures are resolved. If the
+    transaction can't start or commit, every operation in the batch fails
+    with that error and none of their writes are kept; ``on_abort`` is
+    called if any of them had already run, for operations that updated
+    in-memory state ahead of the commit.
+
+    ``execute()`` gives up on an operation that is still queued after
+    ``timeout`` seconds; one that has started is always waited for.
+    """
+
+    def __init__(self, pool, max_batch=64, max_queue=1000, write_lock=None, on_abort=None, timeout=None):
+        super().__init__(name="seat-writer", daemon=True)
+        self.pool = pool
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.write_lock = write_lock or contextlib.nullcontext()
+        self.on_abort = on_abort
+
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._deferred = []  # operations that asked to retry, run first in the next batch
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+        self._batches = 0
+        self._operations = 0
+        self._rolled_back = 0
+        self._retries = 0
+        self._failed_batches = 0
+        self._timed_out = 0
+        self._batch_sizes = [0] * (len(BATCH_SIZE_BUCKETS) + 1)
+        self._max_batch_seen = 0
+        self._max_depth_seen = 0
+        self._commit_seconds = 0.0
+        self._busy_seconds = 0.0
+
+    def submit(self, fn):
+        """Queue an operation and return the Future its result will be set on."""
+        if self._stop_event.is_set():
+            raise WriterStopped("the seat writer has stopped")
+        operation = _Operation(fn)
+        try:
+            self._queue.put_nowait(operation)
+        except queue.Full:
+            raise WriterBusy(f"{self.max_queue} writes are already queued") from None
+        depth = self._queue.qsize()
+        with self._lock:
+            self._max_depth_seen = max(self._max_depth_seen, depth)
+        return operation.future
+
+    def execute(self, fn):
+        """Queue an operation and wait for its result.
+
+        Raises ``WriterTimeout`` if it hasn't started within ``timeout``
+        seconds. It is then taken out of the queue, so it never runs.
+        """
+        future = self.submit(fn)
+        try:
+            return future.result(self.timeout)
+        except concurrent.futures.TimeoutError:
+            if not future.cancel():
+                # Already running; it won't be long
+                return future.result()
+            with self._lock:
+                self._timed_out += 1
+            raise WriterTimeout(f"the write waited more than {self.timeout}s for the seat writer") from None
+
+    def _next_batch(self):
+        batch, self._deferred = self._deferred, []
+        if not batch:
+            try:
+                batch.append(self._queue.get(timeout=0.5))
+            except queue.Empty:
+                return batch
+        while len(batch) < self.max_batch:
+            try:
+                batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def run(self):
+        while not self._stop_event.is_set():
+            batch = self._next_batch()
+            if batch:
+                self._run_batch(batch)
+        # Nothing will run what is still queued; let the callers know
+        self._fail(self._deferred + self._drain(), WriterStopped("the seat writer has stopped"))
+
+    def _drain(self):
+        operations = []
+        while True:
+            try:
+                operations.append(self._queue.get_nowait())
+            except queue.Empty:
+                return operations
+
+    def _fail(self, operations, error):
+        for operation in operations:
+            if not operation.future.done():
+                operation.future.set_exception(error)
+
+    def _run_batch(self, batch):
+        started = time.perf_counter()
+        done = []  # (operation, result, on_commit) in the order they ran
+        ran = False
+        try:
+            with self.write_lock, self.pool.connection() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                ran = True
+                for operation in batch:
+                    outcome = self._run_operation(conn, operation)
+                    if outcome is not None:
+                        done.append(outcome)
+
+                commit_started = time.perf_counter()
+                conn.commit()
+                commit_seconds = time.perf_counter() - commit_started
+
+                for operation, result, on_commit in done:
+                    if on_commit is not None:
+                        try:
+                            on_commit()
+                        except Exception:
+                            # The write is committed, so the caller still gets its result
+                            logger.exception("seat writer on_commit failed")
+        except Exception as e:
+            with self._lock:
+                self._failed_batches += 1
+            # Nothing in the batch was kept, retries included
+            self._deferred = [operation for operation in self._deferred if operation not in batch]
+            if ran and self.on_abort is not None:
+                self.on_abort()
+            self._fail(batch, e)
+            return
+
+        for operation, result, _ in done:
+            operation.future.set_result(result)
+
+        with self._lock:
+            self._batches += 1
+            self._operations += len(done)
+            self._batch_sizes[_bucket(len(batch))] += 1
+            self._max_batch_seen = max(self._max_batch_seen, len(batch))
+            self._commit_seconds += commit_seconds
+            self._busy_seconds += time.perf_counter() - started
+
+    def _run_operation(self, conn, operation):
+        """Run one operation in a savepoint. Returns (operation, result, on_commit) or None."""
+        # A caller that gave up waiting has cancelled it; from here on it can't be
+        if operation.attempts == 0 and not operation.future.set_running_or_notify_cancel():
+            return None
+        conn.execute("SAVEPOINT seat_write")
+        try:
+            result, on_commit = operation.context.run(operation.fn, conn)
+        except Rollback as rollback:
+            self._undo(conn)
+            with self._lock:
+                self._rolled_back += 1
+            return operation, rollback.result, None
+        except Retry as retry:
+            self._undo(conn)
+            operation.attempts += 1
+            if operation.attempts > MAX_RETRIES:
+                return operation, retry.result, None
+            with self._lock:
+                self._retries += 1
+            self._deferred.append(operation)
+            return None
+        except Exception as e:
+            self._undo(conn)
+            # A failed statement can leave the whole transaction unusable; stop using it
+            if isinstance(e, sqlite3.OperationalError) and not conn.in_transaction:
+                raise
+            operation.future.set_exception(e)
+            return None
+        conn.execute("RELEASE seat_write")
+        return operation, result, on_commit
+
+    def _undo(self, conn):
+        if conn.in_transaction:
+            conn.execute("ROLLBACK TO seat_write")
+            conn.execute("RELEASE seat_write")
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stats(self):
+        depth = self._queue.qsize()
+        with self._lock:
+            labels = [str(bound) for bound in BATCH_SIZE_BUCKETS] + [f">{BATCH_SIZE_BUCKETS[-1]}"]
+            return {
+                "queueDepth": depth,
+                "maxQueueDepth": self._max_depth_seen,
+                "maxQueue": self.max_queue,
+                "maxBatch": self.max_batch,
+                "batches": self._batches,
+                "operations": self._operations,
+                "rolledBack": self._rolled_back,
+                "retries": self._retries,
+                "failedBatches": self._failed_batches,
+                "timedOut": self._timed_out,
+                "avgBatchSize": round(self._operations / self._batches, 2) if self._batches else None,
+                "largestBatch": self._max_batch_seen,
+                "batchSizes": dict(zip(labels, self._batch_sizes)),
+                "avgCommitMs": round(self._commit_seconds / self._batches * 1000, 3) if self._batches else None,
+                "avgBatchMs": round(self._busy_seconds / self._batches * 1000, 3) if self._batches else None,
+            }
+
+
+def _bucket(size):
+    for index, bound in enumerate(BATCH_SIZE_BUCKETS):
+        if size <= bound:
+            return index
+    return len(BATCH_SIZE_BUCKETS)
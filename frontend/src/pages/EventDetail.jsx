@@ -1,8 +1,27 @@
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { useParams, useNavigate } from 'react-router-dom';
 import { Container, Heading, Text, Button, Spinner, Box } from '@chakra-ui/react';
 const BASE_URL = process.env.REACT_APP_BASE_URL;
 
+// Expands the compact seat map (each row as flat [seatNumber, count, status, tierId] runs)
+// into the per-seat objects the page works with
+function decodeSeatRuns({ fields, statuses, tiers = [], rows }) {
+  const width = fields.length;
+  const prices = Object.fromEntries(tiers.map(tier => [tier.id, tier.priceCents]));
+  const seatsByRow = {};
+  Object.entries(rows).forEach(([rowName, runs]) => {
+    const seats = [];
+    for (let i = 0; i < runs.length; i += width) {
+      const [first, count, status, tierId] = runs.slice(i, i + width);
+      for (let n = 0; n < count; n++) {
+        seats.push({ seatNumber: first + n, status: statuses[status], priceCents: prices[tierId] });
+      }
+    }
+    seatsByRow[rowName] = seats;
+  });
+  return seatsByRow;
+}
+
 function EventDetail() {
   const { id } = useParams();
   const navigate = useNavigate();
@@ -10,9 +29,54 @@ function EventDetail() {
   const [seats, setSeats] = useState({});
   const [selected, setSelected] = useState([]);
   const [loading, setLoading] = useState(true);
+  // One key per checkout, reused on retries so a purchase that went through isn't made twice
+  const checkoutKey = useRef(null);
   const BASE_URL = process.env.REACT_APP_BASE_URL;
 
   useEffect(() => {
+    let stream = null;
+    let cancelled = false;
+
+    // The server tags the seat map with an ETag; revalidate so an unchanged map comes back as a 304.
+    // The compact format keeps large venues to a fraction of the per-seat JSON.
+    const fetchSeats = async () => {
+      const seatsRes = await fetch(`${BASE_URL}/events/${id}/seats-with-prices?format=runs`, { cache: 'no-cache' });
+      const seatsData = decodeSeatRuns(await seatsRes.json());
+      setSeats(seatsData);
+      return seatsRes.headers.get('X-Seat-Map-Cursor');
+    };
+
+    // Apply seat status changes as they happen instead of refetching the whole map
+    const watchSeats = (cursor) => {
+      if (cancelled) return;
+      const query = cursor ? `?since=${encodeURIComponent(cursor)}` : '';
+      stream = new EventSource(`${BASE_URL}/events/${id}/seats/stream${query}`);
+
+      stream.addEventListener('seats', (e) => {
+        const changes = JSON.parse(e.data);
+        setSeats(prev => {
+          const next = { ...prev };
+          changes.forEach(({ rowName, seatNumber, status }) => {
+            if (!next[rowName]) return;
+            next[rowName] = next[rowName].map(seat =>
+              seat.seatNumber === seatNumber ? { ...seat, status } : seat
+            );
+          });
+          return next;
+        });
+      });
+
+      // Our position in the stream was lost, so start over from a fresh map
+      stream.addEventListener('reset', async () => {
+        stream.close();
+        try {
+          watchSeats(await fetchSeats());
+        } catch (err) {
+          console.error('Error:', err);
+        }
+      });
+    };
+
     const fetchData = async () => {
       const token = localStorage.getItem('access_token');
       if (!token) {
@@ -21,15 +85,12 @@ function EventDetail() {
       }
 
       try {
-        const eventRes = await fetch(`${BASE_URL}/events`);
-        const events = await eventRes.json();
-        const eventData = events.find(e => e.event_id === parseInt(id));
-        setEvent(eventData);
-
-        const seatsRes = await fetch(`${BASE_URL}/events/${id}/seats-with-prices`);
-        const seatsData = await seatsRes.json();
-        setSeats(seatsData);
+        const eventRes = await fetch(`${BASE_URL}/events/${id}`);
+        if (eventRes.ok) setEvent(await eventRes.json());
+
+        const cursor = await fetchSeats();
         setLoading(false);
+        watchSeats(cursor);
       } catch (err) {
         console.error('Error:', err);
         setLoading(false);
@@ -37,10 +98,16 @@ function EventDetail() {
     };
 
     fetchData();
+
+    return () => {
+      cancelled = true;
+      if (stream) stream.close();
+    };
   }, [id, navigate]);
 
   const toggleSeat = async (rowName, seatNumber) => {
     const seatId = `${rowName}${seatNumber}`;
+    checkoutKey.current = null;
     
     if (selected.includes(seatId)) {
       setSelected(selected.filter(s => s !== seatId));
@@ -89,17 +156,33 @@ function EventDetail() {
       return { rowName: match[1], seatNumber: parseInt(match[2]) };
     });
 
+    if (!checkoutKey.current) checkoutKey.current = crypto.randomUUID();
+
     try {
-      const res = await fetch(`${BASE_URL}/purchase_seats`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'Authorization': `Bearer ${token}`
-        },
-        body: JSON.stringify({ event_id: parseInt(id), seats: seatsToPurchase })
-      });
+      let res;
+      for (let attempt = 1; ; attempt++) {
+        try {
+          res = await fetch(`${BASE_URL}/purchase_seats`, {
+            method: 'POST',
+            headers: {
+              'Content-Type': 'application/json',
+              'Authorization': `Bearer ${token}`,
+              'Idempotency-Key': checkoutKey.current
+            },
+            body: JSON.stringify({ event_id: parseInt(id), seats: seatsToPurchase })
+          });
+          break;
+        } catch (err) {
+          // The request may have gone through; retrying with the same key is safe
+          if (attempt === 3) throw err;
+          await new Promise(resolve => setTimeout(resolve, 500 * attempt));
+        }
+      }
 
-      if (res.ok) navigate('/profile');
+      if (res.ok) {
+        checkoutKey.current = null;
+        navigate('/profile');
+      }
     } catch (err) {
       console.error('Error:', err);
     } finally {
@@ -1,26 +1,40 @@
-import React, { useEffect, useState } from 'react';
+import React, { useEffect, useRef, useState } from 'react';
 import { SimpleGrid, Container } from '@chakra-ui/react';
 import { Box, Flex, Text, Button, Spacer, Input } from '@chakra-ui/react';
 import EventCard from '../components/EventCard';
 
 function EventsPage() {
   const [events, setEvents] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
   const [searchInput, setSearchInput] = useState('');
+  const latestRequest = useRef(0);
   const BASE_URL = process.env.REACT_APP_BASE_URL;
 
-  // Fill the events array with events from the backend
-  useEffect(() => {
+  // Fetch a page of upcoming events, or of search results when there is a query; the backend
+  // returns the cursor for the next page in a header
+  const fetchEvents = (cursor, search = searchInput.trim()) => {
     const today = new Date().toISOString().split('T')[0];
-    fetch(`${BASE_URL}/events?afterDate=${today}`)
-      .then(response => response.json())
-      .then(setEvents)
+    const fields = 'name,date,time,location,imageUrl';
+    const path = search ? `/events/search?q=${encodeURIComponent(search)}&` : '/events?';
+    const query = `afterDate=${today}&fields=${fields}` + (cursor ? `&cursor=${encodeURIComponent(cursor)}` : '');
+    // Results for an older query can arrive after newer ones; only the latest request is shown
+    const request = ++latestRequest.current;
+    fetch(`${BASE_URL}${path}${query}`)
+      .then(response => response.json().then(page => {
+        if (request !== latestRequest.current) return;
+        // A query with no words in it is rejected; show it as no results
+        const results = response.ok ? page : [];
+        setNextCursor(response.headers.get('X-Next-Cursor'));
+        setEvents(prev => cursor ? [...prev, ...results] : results);
+      }))
       .catch(error => console.error('Error fetching events:', error));
-  }, []);
+  };
 
-  // Filter events based on search input
-  const filteredEvents = events.filter(event =>
-    event.name.toLowerCase().includes(searchInput.toLowerCase())
-  );
+  // Load the first page, and search again once the user pauses typing
+  useEffect(() => {
+    const timer = setTimeout(() => fetchEvents(null), searchInput ? 250 : 0);
+    return () => clearTimeout(timer);
+  }, [searchInput]);
 
   return (
     <Container maxW="container.xl" centerContent>
@@ -33,7 +47,7 @@ function EventsPage() {
         mb={5}
       />
       <SimpleGrid columns={{ sm: 1, md: 2, lg: 3 }} spacing={10} py={5}>
-        {filteredEvents.map(event => (
+        {events.map(event => (
           <EventCard
             id={event.event_id}
             name={event.name}
@@ -44,6 +58,11 @@ function EventsPage() {
           />
         ))}
       </SimpleGrid>
+      {nextCursor && (
+        <Button mb={5} onClick={() => fetchEvents(nextCursor)}>
+          Load more events
+        </Button>
+      )}
     </Container>
   );
 }
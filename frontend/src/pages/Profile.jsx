@@ -5,50 +5,60 @@ import EventCard from '../components/EventCard';
 
 function Profile() {
   const [tickets, setTickets] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const navigate = useNavigate();
   const BASE_URL = process.env.REACT_APP_BASE_URL;
 
-  useEffect(() => {
-    const fetchTickets = async () => {
-      const token = localStorage.getItem('access_token');
-      
-      if (!token) {
-        navigate('/login');
-        return;
-      }
+  // Tickets come a page at a time, upcoming events first; the server returns the cursor for the
+  // next page in a header
+  const fetchTickets = async (cursor) => {
+    const token = localStorage.getItem('access_token');
+    
+    if (!token) {
+      navigate('/login');
+      return;
+    }
 
-      try {
-        const response = await fetch(`${BASE_URL}/profile`, {
-          method: 'GET',
-          headers: {
-            'Content-Type': 'application/json',
-            'Authorization': `Bearer ${token}`
-          }
-        });
+    setLoadingMore(Boolean(cursor));
+    try {
+      const query = cursor ? `?cursor=${encodeURIComponent(cursor)}` : '';
+      const response = await fetch(`${BASE_URL}/profile${query}`, {
+        method: 'GET',
+        headers: {
+          'Content-Type': 'application/json',
+          'Authorization': `Bearer ${token}`
+        }
+      });
 
-        if (!response.ok) {
-          if (response.status === 401) {
-            localStorage.removeItem('access_token');
-            navigate('/login');
-            return;
-          }
-          const data = await response.json();
-          setError(data.error || 'Failed to fetch tickets');
-          setLoading(false);
+      if (!response.ok) {
+        if (response.status === 401) {
+          localStorage.removeItem('access_token');
+          navigate('/login');
           return;
         }
-
         const data = await response.json();
-        setTickets(data);
-        setLoading(false);
-      } catch (err) {
-        setError('Failed to connect to server. Please try again.');
+        setError(data.error || 'Failed to fetch tickets');
         setLoading(false);
+        setLoadingMore(false);
+        return;
       }
-    };
 
+      const data = await response.json();
+      setNextCursor(response.headers.get('X-Next-Cursor'));
+      setTickets(prev => cursor ? [...prev, ...data] : data);
+      setLoading(false);
+      setLoadingMore(false);
+    } catch (err) {
+      setError('Failed to connect to server. Please try again.');
+      setLoading(false);
+      setLoadingMore(false);
+    }
+  };
+
+  useEffect(() => {
     fetchTickets();
   }, [navigate]);
 
@@ -94,7 +104,7 @@ function Profile() {
         ) : (
           <VStack spacing={3} width="100%">
             {tickets.map(ticket => (
-              <Box key={ticket.id} borderWidth="1px" borderRadius="md" p={3} width="100%">
+              <Box key={ticket.barcode} borderWidth="1px" borderRadius="md" p={3} width="100%">
                 {ticket.imageUrl && (
                   <Box mb={2} width="100%" maxHeight="120px" overflow="hidden" borderRadius="md">
                     <img src={ticket.imageUrl} alt={ticket.name} style={{ width: '100%', objectFit: 'cover' }} />
@@ -116,6 +126,11 @@ function Profile() {
                 </Box>
               </Box>
             ))}
+            {nextCursor && (
+              <Button onClick={() => fetchTickets(nextCursor)} isLoading={loadingMore}>
+                Load more tickets
+              </Button>
+            )}
           </VStack>
         )}
       </VStack>